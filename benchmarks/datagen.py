@@ -0,0 +1,97 @@
+import random
+import zlib
+from datetime import datetime, timedelta
+from fedpipeline.entities import ENTITIES
+
+# Share of the requested row count each table gets, with a floor, so one
+# --rows value yields a realistically shaped dataset (few schools, many
+# utilisations).
+TABLE_SCALE = {
+    "School": (0.0005, 10),
+    "Unit": (0.01, 20),
+    "TeachingSession": (0.0002, 6),
+    "Reading": (0.2, 50),
+    "IntegrationUser": (0.1, 50),
+    "ReadingList": (0.02, 20),
+    "UnitOffering": (0.02, 20),
+    "ReadingListItem": (0.5, 100),
+    "ReadingListUsage": (0.3, 100),
+    "ReadingListItemUsage": (1.0, 100),
+    "ReadingUtilisation": (1.0, 100),
+}
+
+EPOCH = datetime(2024, 1, 1)
+
+
+class Dataset:
+    # Deterministic, FK-consistent synthetic eReserve data. Items are derived
+    # from (seed, entity, index) on demand rather than held in memory, so a
+    # million-row table costs nothing until a page of it is served. IDs run
+    # 1..count and updated_at increases with the ID, which lets
+    # updated_since filters resolve to an index with arithmetic.
+
+    def __init__(self, rows=1000, seed=42):
+        self.rows = rows
+        self.seed = seed
+        self.counts = {
+            name: max(floor, int(rows * share)) for name, (share, floor) in TABLE_SCALE.items()
+        }
+        self.touched = {name: {} for name in self.counts}
+
+    def count(self, entity_name):
+        return self.counts[entity_name]
+
+    def _updated_at(self, entity_name, index):
+        return EPOCH + timedelta(seconds=index * 10)
+
+    def item(self, entity_name, index):
+        entity = ENTITIES[entity_name]
+        rng = random.Random((self.seed << 48) ^ (zlib.crc32(entity_name.encode()) << 24) ^ index)
+        created = EPOCH + timedelta(seconds=index * 10)
+        updated = self.touched[entity_name].get(index, self._updated_at(entity_name, index))
+        item = {}
+        for column in entity.columns:
+            if column == entity.key:
+                item["id"] = index + 1
+            elif column in entity.foreign_keys:
+                item[column] = rng.randint(1, self.counts[entity.foreign_keys[column]])
+            elif column == "created_at":
+                item[column] = created.strftime("%Y-%m-%dT%H:%M:%SZ")
+            elif column == "updated_at":
+                item[column] = updated.strftime("%Y-%m-%dT%H:%M:%SZ")
+            elif column in ("start_date", "end_date"):
+                day = created.date() + timedelta(days=0 if column == "start_date" else 90)
+                item[column] = day.isoformat()
+            elif column in ("hidden", "deleted", "archived"):
+                item[column] = rng.random() < 0.05
+            elif column.endswith("_count"):
+                item[column] = rng.randint(0, 500)
+            elif column == "roles":
+                item[column] = rng.choice([["student"], ["instructor"], ["student", "tutor"]])
+            elif column == "email":
+                item[column] = f"user{index + 1}@example.edu"
+            else:
+                item[column] = f"{column.replace('_', ' ').title()} {index + 1}"
+        return item
+
+    def touch(self, entity_name, count, when=None):
+        # Mark the last `count` records as changed upstream, e.g. for a warm run.
+        when = when or EPOCH + timedelta(seconds=(self.counts[entity_name] + 1) * 10)
+        total = self.counts[entity_name]
+        for index in range(max(0, total - count), total):
+            self.touched[entity_name][index] = when
+
+    def indices_since(self, entity_name, since=None):
+        total = self.counts[entity_name]
+        if since is None:
+            return range(total)
+        first = max(0, int((since - EPOCH).total_seconds() // 10))
+        base = range(min(first, total), total)
+        extra = sorted(i for i, when in self.touched[entity_name].items() if when >= since and i < first)
+        return extra + list(base) if extra else base
+
+    def page(self, entity_name, page, per_page, since=None):
+        indices = self.indices_since(entity_name, since)
+        total_pages = max(1, -(-len(indices) // per_page))
+        chunk = indices[(page - 1) * per_page: page * per_page]
+        return [self.item(entity_name, i) for i in chunk], total_pages
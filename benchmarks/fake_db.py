@@ -0,0 +1,225 @@
+import re
+import threading
+import time
+
+
+class Error(Exception):
+    pass
+
+
+class IntegrityError(Error):
+    pass
+
+
+class ProgrammingError(Error):
+    pass
+
+
+class OperationalError(Error):
+    pass
+
+
+class InterfaceError(Error):
+    pass
+
+
+DataError = ProgrammingError
+
+_MERGE = re.compile(
+    r"MERGE INTO (\w+) AS target\s+USING \(SELECT ([\w, ]+) FROM (#\w+) WHERE (\w+) BETWEEN \? AND \?\)",
+    re.IGNORECASE,
+)
+_INSERT = re.compile(r"INSERT INTO (#?\w+)\s*\(([^)]*)\)", re.IGNORECASE)
+_SELECT_INTO = re.compile(r"SELECT TOP 0 ([\w, ]+) INTO (#\w+) FROM (\w+)", re.IGNORECASE)
+_DROP_TEMP = re.compile(r"DROP TABLE IF EXISTS (#\w+)", re.IGNORECASE)
+_SELECT_ALL = re.compile(r"^\s*SELECT ([\w, ]+) FROM (\w+)\s*$", re.IGNORECASE)
+
+
+class Database:
+    # In-memory stand-in for the SQL Server target, speaking the subset of
+    # SQL the pipeline sends through pyodbc: batched INSERTs with primary-key
+    # checks, #staging tables with the upsert MERGE, and PipelineState reads
+    # and writes. Every call sleeps round_trip_ms plus row_us per parameter
+    # row so batching and round trips cost what they would over a network.
+    # Statements it does not model are no-ops, counted in `unsupported`.
+
+    def __init__(self, round_trip_ms=0.5, row_us=2.0):
+        self.round_trip_ms = round_trip_ms
+        self.row_us = row_us
+        self.tables = {}
+        self.state = {}
+        self.calls = []
+        self.unsupported = {}
+        self.lock = threading.Lock()
+
+    def connect(self, conn_str=None, **kwargs):
+        return Connection(self)
+
+    def row_count(self, table):
+        return len(self.tables.get(table, {}))
+
+    def _cost(self, rows, table, started):
+        time.sleep((self.round_trip_ms + rows * self.row_us / 1000) / 1000)
+        with self.lock:
+            self.calls.append({"table": table, "rows": rows, "seconds": time.perf_counter() - started})
+
+
+class Connection:
+    def __init__(self, db):
+        self.db = db
+        self.temp = {}
+        self.undo = []
+        self.autocommit = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+    def cursor(self):
+        return Cursor(self)
+
+    def commit(self):
+        self.undo.clear()
+
+    def rollback(self):
+        with self.db.lock:
+            for table, key, old in reversed(self.undo):
+                if old is None:
+                    table.pop(key, None)
+                else:
+                    table[key] = old
+        self.undo.clear()
+
+    def close(self):
+        self.temp.clear()
+
+    def _write(self, table, key, row):
+        self.undo.append((table, key, table.get(key)))
+        table[key] = row
+
+
+class Cursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.db = conn.db
+        self.fast_executemany = False
+        self.rowcount = -1
+        self._results = []
+
+    def execute(self, sql, *params):
+        if len(params) == 1 and isinstance(params[0], (list, tuple)):
+            params = tuple(params[0])
+        started = time.perf_counter()
+        table = self._run(sql, [params] if "?" in sql else [()])
+        self.db._cost(1, table, started)
+        return self
+
+    def executemany(self, sql, rows):
+        started = time.perf_counter()
+        rows = list(rows)
+        table = self._run(sql, rows)
+        self.db._cost(len(rows), table, started)
+
+    def fetchone(self):
+        return self._results.pop(0) if self._results else None
+
+    def fetchmany(self, size=1):
+        rows, self._results = self._results[:size], self._results[size:]
+        return rows
+
+    def fetchall(self):
+        rows, self._results = self._results, []
+        return rows
+
+    def close(self):
+        pass
+
+    def _run(self, sql, param_rows):
+        self._results = []
+        self.rowcount = -1
+        text = " ".join(sql.split())
+
+        match = _MERGE.search(text)
+        if match and match.group(1) != "PipelineState":
+            return self._merge(match, *param_rows[0])
+        if "PipelineState" in text:
+            return self._state(text, param_rows[0])
+
+        match = _DROP_TEMP.search(text)
+        if match:
+            self.conn.temp.pop(match.group(1), None)
+            return match.group(1)
+
+        match = _SELECT_INTO.search(text)
+        if match:
+            self.conn.temp[match.group(2)] = {}
+            return match.group(2)
+
+        match = _INSERT.search(text)
+        if match:
+            return self._insert(match.group(1), param_rows)
+
+        match = _SELECT_ALL.match(text)
+        if match and match.group(2) in self.db.tables:
+            self._results = [tuple(row) for row in self.db.tables[match.group(2)].values()]
+            return match.group(2)
+
+        key = text.split(" (")[0][:60]
+        with self.db.lock:
+            self.db.unsupported[key] = self.db.unsupported.get(key, 0) + 1
+        return None
+
+    def _target(self, name):
+        if name.startswith("#"):
+            return self.conn.temp.setdefault(name, {})
+        return self.db.tables.setdefault(name, {})
+
+    def _insert(self, name, rows):
+        target = self._target(name)
+        with self.db.lock:
+            seen = set()
+            for row in rows:
+                key = row[0]
+                if not name.startswith("#") and (key in target or key in seen):
+                    raise IntegrityError(f"Violation of PRIMARY KEY constraint on {name}: duplicate key ({key}).")
+                seen.add(key)
+            for row in rows:
+                self.conn._write(target, row[0], tuple(row))
+        self.rowcount = len(rows)
+        return name
+
+    def _merge(self, match, low, high):
+        table, stage = match.group(1), match.group(3)
+        target = self._target(table)
+        inserted = updated = 0
+        with self.db.lock:
+            for key, row in self.conn.temp.get(stage, {}).items():
+                if low <= key <= high:
+                    current = target.get(key)
+                    if current is None:
+                        inserted += 1
+                    elif current == row:
+                        continue
+                    else:
+                        updated += 1
+                    self.conn._write(target, key, row)
+        self._results = [(inserted, updated)]
+        return table
+
+    def _state(self, text, params):
+        with self.db.lock:
+            if text.startswith("SELECT"):
+                row = self.db.state.get(params[0])
+                self._results = [row] if row else []
+            elif text.startswith("DELETE"):
+                self.rowcount = 1 if self.db.state.pop(params[0], None) else 0
+            elif "MERGE" in text:
+                entity, updated_at, ereserve_id = params
+                self.db.state[entity] = (updated_at, ereserve_id)
+        return "PipelineState"
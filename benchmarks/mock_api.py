@@ -0,0 +1,130 @@
+import base64
+import gzip
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from fedpipeline.config import API_CONFIG, PAGINATION_CONFIG
+from fedpipeline.entities import ENTITIES
+from fedpipeline.state import parse_timestamp
+
+
+class MockEReserveAPI:
+    # In-process stand-in for the eReserve API: login, every API_CONFIG
+    # endpoint with page-number pagination and updated_since filtering, gzip,
+    # injected latency and an optional rate of 503s. Every request is logged
+    # so the runner can report per-endpoint latency and bytes.
+
+    def __init__(self, dataset, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, token_ttl=3600, seed=0):
+        self.dataset = dataset
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.token_ttl = token_ttl
+        self.requests = []
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self._token = None
+        self._routes = {}
+        for entity in ENTITIES.values():
+            self._routes[urlparse(API_CONFIG[entity.endpoint]).path] = entity.name
+        self._login_path = urlparse(API_CONFIG["LOGIN_URL"]).path
+
+    def start(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                api._handle(self, "POST")
+
+            def do_GET(self):
+                api._handle(self, "GET")
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def urls(self):
+        # API_CONFIG with every URL pointed at this server.
+        return {key: self.base_url + urlparse(url).path for key, url in API_CONFIG.items()}
+
+    def _issue_token(self):
+        claims = {"exp": int(time.time()) + self.token_ttl, "sub": "benchmark"}
+        payload = base64.urlsafe_b64encode(json.dumps(claims).encode()).decode().rstrip("=")
+        self._token = f"Bearer mock.{payload}.signature"
+        return self._token
+
+    def _delay(self):
+        if self.latency_ms or self.jitter_ms:
+            with self._lock:
+                jitter = self._rng.uniform(0, self.jitter_ms)
+            time.sleep((self.latency_ms + jitter) / 1000)
+
+    def _send(self, handler, status, body=None, headers=None):
+        data = json.dumps(body).encode() if body is not None else b""
+        if data and "gzip" in handler.headers.get("Accept-Encoding", ""):
+            data = gzip.compress(data, compresslevel=1)
+            headers = dict(headers or {}, **{"Content-Encoding": "gzip"})
+        handler.send_response(status)
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+        return len(data)
+
+    def _handle(self, handler, method):
+        start = time.perf_counter()
+        url = urlparse(handler.path)
+        length = int(handler.headers.get("Content-Length") or 0)
+        if length:
+            handler.rfile.read(length)
+        self._delay()
+        endpoint = "login" if url.path == self._login_path else self._routes.get(url.path, url.path)
+
+        with self._lock:
+            fail = self.error_rate and self._rng.random() < self.error_rate
+        if fail:
+            status, sent = 503, self._send(handler, 503, {"error": "injected failure"})
+        elif method == "POST" and endpoint == "login":
+            status, sent = 200, self._send(handler, 200, {"ok": True}, {"Authorization": self._issue_token()})
+        elif endpoint not in ENTITIES:
+            status, sent = 404, self._send(handler, 404, {"error": "not found"})
+        elif handler.headers.get("Authorization") != self._token:
+            status, sent = 401, self._send(handler, 401, {"error": "unauthorized"})
+        else:
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            page = int(query.get(PAGINATION_CONFIG["PAGE_PARAM"], 1))
+            per_page = int(query.get(PAGINATION_CONFIG["PAGE_SIZE_PARAM"], 100))
+            since = parse_timestamp(query.get("updated_since"))
+            items, total_pages = self.dataset.page(endpoint, page, per_page, since)
+            body = {"items": items, "meta": {"page": page, "per_page": per_page, "total_pages": total_pages}}
+            status, sent = 200, self._send(handler, 200, body)
+
+        with self._lock:
+            self.requests.append({
+                "endpoint": endpoint, "status": status, "bytes": sent,
+                "seconds": time.perf_counter() - start,
+            })
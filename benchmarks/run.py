@@ -0,0 +1,286 @@
+"""
+Offline throughput benchmark for the eReserve pipeline.
+
+Runs the real pipeline code against an in-process mock eReserve API and an
+in-memory stand-in for the ODBC target, then reports rows/sec, HTTP and DB
+latency percentiles and peak RSS per entity and per stage as JSON.
+
+Usage:
+    python -m benchmarks.run --rows 100000 --latency-ms 20 --out results.json
+    python -m benchmarks.run compare baseline.json results.json [--threshold 0.1]
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from contextlib import ExitStack
+from unittest.mock import patch
+
+from benchmarks import fake_db
+from benchmarks.datagen import Dataset
+
+try:
+    import pyodbc  # noqa: F401
+except ImportError:
+    # The database stand-in replaces the ODBC driver, so the benchmark does
+    # not need one installed.
+    sys.modules["pyodbc"] = fake_db
+
+
+def _rss_mb():
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class RssSampler:
+    # Samples resident memory on a background thread; peak() reports the
+    # highest sample since the last reset.
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self._peak = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._peak = max(self._peak, _rss_mb())
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def reset(self):
+        self._peak = _rss_mb()
+
+    def peak(self):
+        return max(self._peak, _rss_mb())
+
+    def stop(self):
+        self._stop.set()
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+    ordered = sorted(values)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+    return {"count": len(ordered), "p50_ms": pick(0.50), "p95_ms": pick(0.95),
+            "p99_ms": pick(0.99), "max_ms": round(ordered[-1] * 1000, 3)}
+
+
+def _entity_report(name, elapsed, stage_stats, http, db_calls, peak_rss):
+    rows = stage_stats.get("fetch", {}).get("rows", 0)
+    stages = {}
+    for stage in ("fetch", "transform", "load"):
+        stats = stage_stats.get(stage, {})
+        busy = stats.get("busy", 0.0)
+        stages[stage] = {
+            "busy_seconds": round(busy, 4),
+            "rows": stats.get("rows", 0),
+            "rows_per_sec": round(stats.get("rows", 0) / busy, 1) if busy else None,
+            "max_queue_depth": stats.get("max_queue_depth", 0),
+        }
+    return {
+        "rows": rows,
+        "seconds": round(elapsed, 4),
+        "rows_per_sec": round(rows / elapsed, 1) if elapsed else None,
+        "peak_rss_mb": round(peak_rss, 1) if peak_rss is not None else None,
+        "stages": stages,
+        "http": dict(percentiles([r["seconds"] for r in http]), bytes=sum(r["bytes"] for r in http)),
+        "db": dict(percentiles([c["seconds"] for c in db_calls]), rows=sum(c["rows"] for c in db_calls)),
+    }
+
+
+def run_benchmark(rows=1000, seed=42, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, page_size=500,
+                  db_round_trip_ms=0.5, db_row_us=2.0, warm_changes=0.01, isolate=False, load_mode=None):
+    from benchmarks.mock_api import MockEReserveAPI
+    from fedpipeline import api_handler, dag, deadletter, fingerprints, http_cache, integrity, jobs, pipeline
+    from fedpipeline.config import (
+        API_CONFIG, PAGINATION_CONFIG, FINGERPRINT_CONFIG, HTTP_CACHE_CONFIG, INTEGRITY_CONFIG, LOAD_CONFIG,
+        SPOOL_CONFIG, DEADLETTER_CONFIG,
+    )
+    from fedpipeline.entities import ENTITIES, entity_parents
+
+    dataset = Dataset(rows=rows, seed=seed)
+    db = fake_db.Database(round_trip_ms=db_round_trip_ms, row_us=db_row_us)
+    api = MockEReserveAPI(dataset, latency_ms=latency_ms, jitter_ms=jitter_ms, error_rate=error_rate, seed=seed)
+    sampler = RssSampler().start()
+    results = {
+        "meta": {
+            "rows": rows, "seed": seed, "latency_ms": latency_ms, "jitter_ms": jitter_ms,
+            "error_rate": error_rate, "page_size": page_size, "db_round_trip_ms": db_round_trip_ms,
+            "db_row_us": db_row_us, "isolate": isolate, "load_mode": load_mode or LOAD_CONFIG["MODE"],
+            "table_rows": dict(dataset.counts), "python": platform.python_version(),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "runs": [],
+    }
+
+    with ExitStack() as stack, tempfile.TemporaryDirectory() as scratch:
+        api.start()
+        stack.callback(api.stop)
+        stack.callback(sampler.stop)
+        for module in list(sys.modules.values()):
+            if getattr(module, "__name__", "").startswith("fedpipeline") and hasattr(module, "pyodbc"):
+                stack.enter_context(patch.object(module, "pyodbc", db))
+        stack.enter_context(patch.dict(API_CONFIG, api.urls()))
+        stack.enter_context(patch.dict(PAGINATION_CONFIG, {"PAGE_SIZE": page_size}))
+        stack.enter_context(patch.dict(FINGERPRINT_CONFIG, {"PATH": os.path.join(scratch, "fingerprints.sqlite3")}))
+        stack.enter_context(patch.dict(HTTP_CACHE_CONFIG, {"PATH": os.path.join(scratch, "http_cache.sqlite3")}))
+        stack.enter_context(patch.dict(INTEGRITY_CONFIG, {"PATH": os.path.join(scratch, "orphans.sqlite3")}))
+        stack.enter_context(patch.dict(SPOOL_CONFIG, {"DIR": os.path.join(scratch, "spool")}))
+        stack.enter_context(patch.dict(DEADLETTER_CONFIG, {"PATH": os.path.join(scratch, "deadletters.sqlite3")}))
+        if load_mode:
+            stack.enter_context(patch.dict(LOAD_CONFIG, {"MODE": load_mode}))
+        fingerprints.close_store()
+        stack.callback(fingerprints.close_store)
+        http_cache.close_http_cache()
+        stack.callback(http_cache.close_http_cache)
+        integrity.close_integrity()
+        stack.callback(integrity.close_integrity)
+        deadletter.close_dead_letters()
+        stack.callback(deadletter.close_dead_letters)
+        api_handler.clear_token_cache()
+
+        for run_name in ("cold", "warm"):
+            if run_name == "warm":
+                for name in ENTITIES:
+                    dataset.touch(name, max(1, int(dataset.count(name) * warm_changes)))
+            api.requests.clear()
+            db.calls.clear()
+            pipeline.STAGE_STATS.clear()
+            sampler.reset()
+            token = api_handler.get_token()
+            entity_rss = {}
+            start = time.perf_counter()
+
+            if isolate:
+                # One entity at a time, in FK order, so memory and timings
+                # are attributable to a single table.
+                timings = {}
+                for name in dag.topological_order(entity_parents()):
+                    sampler.reset()
+                    began = time.perf_counter()
+                    jobs.sync_entity(ENTITIES[name], token)
+                    timings[name] = time.perf_counter() - began
+                    entity_rss[name] = sampler.peak()
+            else:
+                tasks = {name: (lambda entity=entity: jobs.sync_entity(entity, token)) for name, entity in ENTITIES.items()}
+                timings = dag.run_graph(tasks, entity_parents())
+
+            wall = time.perf_counter() - start
+            stage_stats = pipeline.pipeline_stats()
+            entities = {
+                name: _entity_report(
+                    name, timings.get(name, 0.0), stage_stats.get(name, {}),
+                    [r for r in api.requests if r["endpoint"] == name],
+                    [c for c in db.calls if c["table"] in (ENTITIES[name].table, f"#stage_{ENTITIES[name].table}")],
+                    entity_rss.get(name),
+                )
+                for name in ENTITIES
+            }
+            total_rows = sum(report["rows"] for report in entities.values())
+            results["runs"].append({
+                "name": run_name,
+                "wall_seconds": round(wall, 4),
+                "rows": total_rows,
+                "rows_per_sec": round(total_rows / wall, 1) if wall else None,
+                "peak_rss_mb": round(sampler.peak(), 1),
+                "http": percentiles([r["seconds"] for r in api.requests]),
+                "db": percentiles([c["seconds"] for c in db.calls]),
+                "db_rows": {table: db.row_count(table) for table in sorted(db.tables)},
+                "unsupported_sql": dict(db.unsupported),
+                "entities": entities,
+            })
+    return results
+
+
+def compare(old, new, threshold=0.1):
+    # Compare rows/sec of two result files; a drop beyond threshold is a regression.
+    regressions = []
+    lines = [f"{'run/entity':<36}{'old rows/s':>14}{'new rows/s':>14}{'change':>10}"]
+    old_runs = {run["name"]: run for run in old["runs"]}
+    for run in new["runs"]:
+        before = old_runs.get(run["name"])
+        if not before:
+            continue
+        pairs = [(run["name"], before.get("rows_per_sec"), run.get("rows_per_sec"))]
+        for name, report in run["entities"].items():
+            previous = before["entities"].get(name, {})
+            pairs.append((f"{run['name']}/{name}", previous.get("rows_per_sec"), report.get("rows_per_sec")))
+        for label, was, now in pairs:
+            if not was or not now:
+                continue
+            change = (now - was) / was
+            flag = ""
+            if change < -threshold:
+                flag = "  REGRESSION"
+                regressions.append(label)
+            lines.append(f"{label:<36}{was:>14.1f}{now:>14.1f}{change:>+10.1%}{flag}")
+    return regressions, "\n".join(lines)
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if argv[:1] == ["compare"]:
+        parser = argparse.ArgumentParser(prog="benchmarks.run compare")
+        parser.add_argument("old")
+        parser.add_argument("new")
+        parser.add_argument("--threshold", type=float, default=0.1, help="Allowed rows/sec drop (fraction)")
+        args = parser.parse_args(argv[1:])
+        with open(args.old) as old, open(args.new) as new:
+            regressions, table = compare(json.load(old), json.load(new), args.threshold)
+        print(table)
+        return 1 if regressions else 0
+
+    parser = argparse.ArgumentParser(prog="benchmarks.run", description="Offline pipeline throughput benchmark")
+    parser.add_argument("--rows", type=int, default=1000, help="Rows in the largest tables (others scale down)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Injected API latency per request")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of API requests answered with 503")
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--db-round-trip-ms", type=float, default=0.5)
+    parser.add_argument("--db-row-us", type=float, default=2.0)
+    parser.add_argument("--warm-changes", type=float, default=0.01, help="Fraction of rows changed before the warm run")
+    parser.add_argument("--load-mode", choices=["insert", "upsert"])
+    parser.add_argument("--isolate", action="store_true", help="Run entities one at a time for per-entity RSS")
+    parser.add_argument("--out", help="Write JSON results here (default: stdout)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    results = run_benchmark(
+        rows=args.rows, seed=args.seed, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate, page_size=args.page_size, db_round_trip_ms=args.db_round_trip_ms,
+        db_row_us=args.db_row_us, warm_changes=args.warm_changes, isolate=args.isolate, load_mode=args.load_mode,
+    )
+    output = json.dumps(results, indent=2, default=str)
+    if args.out:
+        with open(args.out, "w") as handle:
+            handle.write(output + "\n")
+        for run in results["runs"]:
+            print(f"{run['name']}: {run['rows']} rows in {run['wall_seconds']}s "
+                  f"({run['rows_per_sec']} rows/s, peak RSS {run['peak_rss_mb']} MB)")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,150 @@
+import logging
+import pyodbc
+from fedpipeline.config import AGGREGATES_CONFIG
+
+# Daily usage summaries kept current by the loads themselves. The upsert's
+# MERGE captures the old and new version of every row it touches; the same
+# batch, before it commits, turns those into +1/-1 deltas and merges them
+# into the summary tables. Dashboards read the summaries instead of scanning
+# the usage tables.
+
+
+class Aggregate:
+    # One summary table over one source table. groups/measures map summary
+    # columns to SQL over the source row (alias d) and anything joined to it;
+    # a measure of None counts rows. columns lists the source columns used.
+
+    def __init__(self, table, source, columns, groups, measures, join=""):
+        self.table = table
+        self.source = source
+        self.columns = tuple(columns)
+        self.groups = dict(groups)
+        self.measures = dict(measures)
+        self.join = join
+
+
+_ITEM = "JOIN ReadingListItem AS item ON item.ereserve_id = d.item_id"
+
+AGGREGATES = [
+    Aggregate(
+        "ReadingUtilisationDaily", "ReadingUtilisation", ["item_id", "created_at"],
+        {"reading_id": "item.reading_id", "list_id": "item.list_id", "usage_date": "CAST(d.created_at AS DATE)"},
+        {"utilisations": None},
+        join=_ITEM,
+    ),
+    Aggregate(
+        "ReadingListItemUsageDaily", "ReadingListItemUsage", ["item_id", "utilisation_count", "created_at"],
+        {"reading_id": "item.reading_id", "list_id": "item.list_id", "usage_date": "CAST(d.created_at AS DATE)"},
+        {"item_usages": None, "utilisations": "d.utilisation_count"},
+        join=_ITEM,
+    ),
+    Aggregate(
+        "ReadingListUsageDaily", "ReadingListUsage", ["list_id", "item_usage_count", "created_at"],
+        {"list_id": "d.list_id", "usage_date": "CAST(d.created_at AS DATE)"},
+        {"list_usages": None, "item_usages": "d.item_usage_count"},
+    ),
+]
+
+
+def aggregates_for(source):
+    if not AGGREGATES_CONFIG["ENABLED"]:
+        return []
+    return [aggregate for aggregate in AGGREGATES if aggregate.source == source]
+
+
+def _summarise(aggregate, rows):
+    # SELECT over `rows` (aliased d, with a weight column) grouped for the summary.
+    groups = ", ".join(aggregate.groups.values())
+    select = [f"{expression} AS {name}" for name, expression in aggregate.groups.items()]
+    select += [
+        f"SUM(d.weight) AS {name}" if expression is None else f"COALESCE(SUM(d.weight * {expression}), 0) AS {name}"
+        for name, expression in aggregate.measures.items()
+    ]
+    return f"SELECT {', '.join(select)} FROM {rows} AS d {aggregate.join} GROUP BY {groups}"
+
+
+def _delta_sql(aggregate):
+    # Caller declared @changes with new_/old_ copies of aggregate.columns.
+    new = ", ".join(f"new_{column} AS {column}" for column in aggregate.columns)
+    old = ", ".join(f"old_{column} AS {column}" for column in aggregate.columns)
+    rows = (
+        f"(SELECT 1 AS weight, {new} FROM @changes WHERE action IN ('INSERT', 'UPDATE') "
+        f"UNION ALL SELECT -1, {old} FROM @changes WHERE action = 'UPDATE')"
+    )
+    measures = list(aggregate.measures)
+    changed = " OR ".join(f"{name} <> 0" for name in measures)
+    keys = list(aggregate.groups)
+    # Group columns may be NULL (undated rows), and NULL must match NULL.
+    match = " AND ".join(
+        f"(target.{k} = delta.{k} OR (target.{k} IS NULL AND delta.{k} IS NULL))" for k in keys
+    )
+    columns = keys + measures
+    return f"""
+        IF OBJECT_ID('{aggregate.table}') IS NOT NULL
+        MERGE INTO {aggregate.table} WITH (HOLDLOCK) AS target
+        USING (SELECT * FROM ({_summarise(aggregate, rows)}) AS summed WHERE {changed}) AS delta
+            ON {match}
+        WHEN MATCHED AND target.{measures[0]} + delta.{measures[0]} = 0 THEN DELETE
+        WHEN MATCHED THEN UPDATE SET {', '.join(f'target.{m} = target.{m} + delta.{m}' for m in measures)}
+        WHEN NOT MATCHED BY TARGET THEN
+            INSERT ({', '.join(columns)}) VALUES ({', '.join(f'delta.{c}' for c in columns)});"""
+
+
+def _sql_type(column):
+    if column["length"] is not None:
+        return f"{column['type']}({column['length']})"
+    return column["type"]
+
+
+def merge_capture(source):
+    # (columns the MERGE must OUTPUT as ((name, type), ...), SQL applying the
+    # deltas) for a source table; ((), "") when nothing summarises it.
+    aggregates = aggregates_for(source)
+    if not aggregates:
+        return (), ""
+    # db_handler imports this module, and schema imports db_handler.
+    from fedpipeline.schema import load_schema
+    table = load_schema()[source]
+    names = list(dict.fromkeys(column for aggregate in aggregates for column in aggregate.columns))
+    capture = tuple((name, _sql_type(table[name])) for name in names)
+    return capture, "".join(_delta_sql(aggregate) for aggregate in aggregates)
+
+
+def rebuild_sql(aggregate):
+    columns = list(aggregate.groups) + list(aggregate.measures)
+    return (
+        f"DELETE FROM {aggregate.table}; "
+        f"INSERT INTO {aggregate.table} ({', '.join(columns)}) "
+        f"{_summarise(aggregate, f'(SELECT 1 AS weight, * FROM {aggregate.source})')};"
+    )
+
+
+def _ensure_table(cursor, aggregate):
+    from fedpipeline.schema import table_definitions
+    definitions = table_definitions()[aggregate.table]
+    cursor.execute(
+        f"IF OBJECT_ID('{aggregate.table}') IS NULL "
+        f"CREATE TABLE {aggregate.table} ({', '.join(definitions)})"
+    )
+
+
+def rebuild_aggregates(sources=None):
+    # Recompute the summaries from the base tables, each in one transaction.
+    from fedpipeline.db_handler import conn_str
+    rebuilt = {}
+    with pyodbc.connect(conn_str) as conn:
+        cursor = conn.cursor()
+        for aggregate in AGGREGATES:
+            if sources is not None and aggregate.source not in sources:
+                continue
+            try:
+                _ensure_table(cursor, aggregate)
+                cursor.execute(rebuild_sql(aggregate))
+                conn.commit()
+                cursor.execute(f"SELECT COUNT_BIG(*) FROM {aggregate.table}")
+                rebuilt[aggregate.table] = cursor.fetchone()[0]
+                logging.info(f"Rebuilt {aggregate.table} from {aggregate.source}: {rebuilt[aggregate.table]} rows.")
+            except Exception as e:
+                conn.rollback()
+                logging.error(f"Failed to rebuild {aggregate.table}: {e}")
+    return rebuilt
@@ -1,15 +1,120 @@
+import base64
+import json
 import requests
 import logging
-from fedpipeline.config import API_CONFIG, CREDENTIALS
+import threading
+import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from fedpipeline.config import (
+    API_CONFIG, CREDENTIALS, PAGINATION_CONFIG, HTTP_CONFIG, AUTH_CONFIG, RATE_LIMIT_CONFIG
+)
+from fedpipeline import http_cache, ratelimit
+from fedpipeline.metrics import timed, register_collector, ROWS, BYTES
+
+# One connection pool shared by every thread. requests.Session objects are not
+# guaranteed thread-safe, so each thread gets its own Session mounted on it.
+_adapter = None
+_adapter_lock = threading.Lock()
+_local = threading.local()
+
+
+def _get_adapter():
+    global _adapter
+    with _adapter_lock:
+        if _adapter is None:
+            retry = Retry(
+                total=HTTP_CONFIG["MAX_RETRIES"],
+                connect=HTTP_CONFIG["MAX_RETRIES"],
+                read=HTTP_CONFIG["MAX_RETRIES"],
+                status=HTTP_CONFIG["MAX_RETRIES"],
+                backoff_factor=HTTP_CONFIG["BACKOFF_FACTOR"],
+                status_forcelist=HTTP_CONFIG["RETRY_STATUSES"],
+                allowed_methods=frozenset(["GET", "POST"]),
+                raise_on_status=False,
+            )
+            _adapter = HTTPAdapter(
+                pool_connections=HTTP_CONFIG["POOL_SIZE"],
+                pool_maxsize=HTTP_CONFIG["POOL_SIZE"],
+                max_retries=retry,
+            )
+        return _adapter
+
+
+def get_session():
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = _get_adapter()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"})
+        _local.session = session
+    return session
+
+
+def _timeout():
+    return (HTTP_CONFIG["CONNECT_TIMEOUT"], HTTP_CONFIG["READ_TIMEOUT"])
+
+
+# Login token shared by every job, refreshed shortly before it expires.
+_token_cache = {"token": None, "expires_at": 0.0}
+_token_lock = threading.Lock()
+TOKEN_STATS = {"hits": 0, "refreshes": 0, "reauths": 0}
+
+
+def _token_expiry(token):
+    # Use the JWT exp claim when there is one, otherwise assume the configured TTL.
+    try:
+        payload = token.split()[-1].split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except Exception:
+        return time.time() + AUTH_CONFIG["TOKEN_TTL_SECONDS"]
+
 
 def get_token():
+    # Serve the cached token until it nears expiry. The lock makes concurrent
+    # callers wait for a single login rather than each logging in.
+    with _token_lock:
+        token = _token_cache["token"]
+        if token and time.time() < _token_cache["expires_at"] - AUTH_CONFIG["REFRESH_MARGIN_SECONDS"]:
+            TOKEN_STATS["hits"] += 1
+            return token
+        with timed("auth"):
+            token = _login()
+        if token:
+            TOKEN_STATS["refreshes"] += 1
+            _token_cache["token"] = token
+            _token_cache["expires_at"] = _token_expiry(token)
+        return token
+
+
+def invalidate_token(token):
+    # Drop a token the API rejected. Only clears the cache if nobody has
+    # refreshed it already, so a burst of 401s still costs a single login.
+    with _token_lock:
+        if _token_cache["token"] == token:
+            _token_cache["token"] = None
+            _token_cache["expires_at"] = 0.0
+
+
+def clear_token_cache():
+    invalidate_token(_token_cache["token"])
+
+
+def token_cache_stats():
+    return dict(TOKEN_STATS)
+
+
+def _login():
     payload = {
         "email": CREDENTIALS["email"],
         "password": CREDENTIALS["password"]
     }
     logging.info("Attempting to authenticate with API.")
     try:
-        response = requests.post(API_CONFIG["LOGIN_URL"], json=payload)
+        response = get_session().post(API_CONFIG["LOGIN_URL"], json=payload, timeout=_timeout())
         logging.info(f"Login response status: {response.status_code}")
         response.raise_for_status()
         token = response.headers.get("Authorization")
@@ -20,13 +125,141 @@ def get_token():
         logging.error(f"Failed to login and fetch token: {e}")
         return None
 
-def fetch_data_from_api(url, token):
-    logging.info(f"Fetching data from API: {url}")
-    headers = {"Authorization": token}
+def _next_page(links, body, params, page, items):
+    # Work out where the next page lives, or None when this was the last one.
+    # Supports Link headers, next URLs in the body, cursors and page counts.
+    next_url = links.get("next", {}).get("url")
+    if not next_url and isinstance(body, dict):
+        links = body.get("links") or {}
+        next_url = body.get("next") or (links.get("next") if isinstance(links, dict) else None)
+    if next_url:
+        return next_url, None
+
+    if not isinstance(body, dict):
+        return None
+    cursor = body.get("next_cursor") or (body.get("meta") or {}).get("next_cursor")
+    if cursor:
+        return None, dict(params or {}, **{PAGINATION_CONFIG["CURSOR_PARAM"]: cursor})
+
+    meta = body.get("meta") or body
+    total_pages = meta.get("total_pages") or meta.get("last_page")
+    if total_pages and page < total_pages and items:
+        return None, dict(params or {}, **{PAGINATION_CONFIG["PAGE_PARAM"]: page + 1})
+    return None
+
+
+def _limited_get(url, headers, params):
+    # GET through the rate limiter. A 429/503 backs the limiter off and the
+    # request is retried once the endpoint's pause (Retry-After) is over.
+    for attempt in range(RATE_LIMIT_CONFIG["MAX_RETRIES"] + 1):
+        endpoint = ratelimit.before_request(url)
+        try:
+            response = get_session().get(url, headers=headers, params=params, timeout=_timeout())
+        except Exception:
+            ratelimit.after_request(endpoint)
+            raise
+        pause = ratelimit.after_request(endpoint, response.status_code, response.headers.get("Retry-After"), attempt)
+        if pause is None or attempt == RATE_LIMIT_CONFIG["MAX_RETRIES"]:
+            return response
+        logging.warning(f"{url} answered {response.status_code}; retrying in {pause:.1f}s.")
+        if endpoint is None:
+            time.sleep(pause)
+    return response
+
+
+def _get_with_reauth(url, token, params, extra_headers=None):
+    # Re-authenticate once, transparently, if the API says the token is no longer valid.
+    headers = dict(extra_headers or {}, Authorization=token)
+    response = _limited_get(url, headers, params)
+    if response.status_code == 401:
+        logging.warning(f"Token rejected by {url}; re-authenticating.")
+        invalidate_token(token)
+        token = get_token()
+        if token:
+            TOKEN_STATS["reauths"] += 1
+            headers = dict(extra_headers or {}, Authorization=token)
+            response = _limited_get(url, headers, params)
+    return response, token
+
+
+def iter_api_pages(url, token, params=None, page_size=None, entity_name="all", skip_unchanged=False):
+    # Generator yielding one list of items per API page, so callers never hold
+    # more than a page of decoded records at once. Raises if a page fails so
+    # callers can tell a short stream from a complete one.
+    #
+    # Pages are requested conditionally. A 304 answers with the cached body,
+    # or, with skip_unchanged, yields nothing at all: the page was already
+    # loaded, and its fresh copy is staged until http_cache.commit(entity).
+    page_size = page_size or PAGINATION_CONFIG["PAGE_SIZE"]
+    params = dict(params or {}, **{
+        PAGINATION_CONFIG["PAGE_SIZE_PARAM"]: page_size,
+        PAGINATION_CONFIG["PAGE_PARAM"]: 1,
+    })
+    page = 1
+    while url:
+        logging.info(f"Fetching data from API: {url} (page {page})")
+        try:
+            key = http_cache.request_key(url, params)
+            entry = http_cache.lookup(entity_name, key)
+            with timed("http", entity_name):
+                response, token = _get_with_reauth(url, token, params, http_cache.conditional_headers(entry))
+                content = http_cache.cached_body(entry) if entry and response.status_code == 304 else None
+                if entry and response.status_code == 304 and content is None:
+                    # Evicted since the lookup: fetch it unconditionally.
+                    entry = None
+                    response, token = _get_with_reauth(url, token, params)
+                response.raise_for_status()
+            if content is not None:
+                http_cache.record_hit(entity_name, entry)
+                links = {"next": {"url": entry["next_url"]}} if entry["next_url"] else {}
+                with timed("decode", entity_name):
+                    body = json.loads(content)
+            else:
+                http_cache.record_miss(entity_name)
+                links = response.links
+                BYTES.inc(len(response.content), entity=entity_name)
+                with timed("decode", entity_name):
+                    body = response.json()
+            items = body.get("items", []) if isinstance(body, dict) else body
+            following = _next_page(links, body, params, page, items)
+            if entry is None or response.status_code != 304:
+                http_cache.stage(
+                    entity_name, key, response, links.get("next", {}).get("url"), pending=skip_unchanged
+                )
+            unchanged = skip_unchanged and response.status_code == 304
+            if not unchanged:
+                ROWS.inc(len(items), entity=entity_name, stage="fetch")
+        except Exception as e:
+            logging.error(f"Failed to fetch data from {url}: {e}")
+            raise
+        del body, response, content
+        if not unchanged:
+            yield items
+
+        if following is None:
+            return
+        next_url, next_params = following
+        if next_url:
+            # Next links already carry their query string.
+            url, params = next_url, None
+        else:
+            params = next_params
+        page += 1
+
+
+def fetch_data_from_api(url, token, params=None):
+    # Convenience wrapper collecting every page into one list.
+    items = []
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        return response.json().get("items", [])
-    except Exception as e:
-        logging.error(f"Failed to fetch data from {url}: {e}")
+        for page in iter_api_pages(url, token, params):
+            items.extend(page)
+    except Exception:
         return []
+    return items
+
+
+register_collector(lambda: (
+    "fedpipeline_token_cache_events_total", "counter", "Token cache hits, refreshes and 401 re-authentications.",
+    {(event,): count for event, count in token_cache_stats().items()}, ("event",),
+))
+
@@ -29,3 +29,186 @@ DB_CONFIG = {
     "UID": "sa",
     "PWD": "tharu"
 }
+
+# Database load settings
+LOAD_CONFIG = {
+    "MODE": "upsert",            # "insert" (plain INSERT) or "upsert" (staging table + MERGE)
+    "BATCH_SIZE": 1000,          # Rows sent per executemany round trip
+    "FAST_EXECUTEMANY": True,    # Bind parameter arrays in one call (pyodbc)
+    "ERROR_SAMPLE_IDS": 5        # Rejected IDs quoted per error class in the log
+}
+
+# Incremental sync settings
+SYNC_CONFIG = {
+    "INCREMENTAL": True,                     # Only fetch/keep records past the stored watermark
+    "OVERLAP_SECONDS": 300,                  # Re-read this window behind the watermark to absorb clock skew
+    "UPDATED_SINCE_PARAM": "updated_since"   # Query parameter used to ask the API for changes only
+}
+
+# API pagination settings
+PAGINATION_CONFIG = {
+    "PAGE_SIZE": 500,               # Items requested per page
+    "PAGE_SIZE_PARAM": "per_page",  # Query parameter carrying the page size
+    "PAGE_PARAM": "page",           # Query parameter carrying the page number
+    "CURSOR_PARAM": "cursor"        # Query parameter carrying an opaque cursor
+}
+
+# HTTP client settings
+HTTP_CONFIG = {
+    "POOL_SIZE": 20,                          # Keep-alive connections kept per host
+    "CONNECT_TIMEOUT": 5,                     # Seconds to establish a connection
+    "READ_TIMEOUT": 60,                       # Seconds to wait for response data
+    "MAX_RETRIES": 3,                         # Retries on 5xx and connection resets
+    "BACKOFF_FACTOR": 0.5,                    # Exponential backoff: 0.5s, 1s, 2s, ...
+    "RETRY_STATUSES": [500, 502, 504]         # 429/503 are left to the rate limiter (RATE_LIMIT_CONFIG)
+}
+
+# Client-side API rate limiting settings
+RATE_LIMIT_CONFIG = {
+    "ENABLED": True,
+    "RATE": 10.0,                   # Requests per second per endpoint when the API is healthy
+    "BURST": 5,                     # Requests an idle endpoint may send back to back
+    "MIN_RATE": 0.2,
+    "MAX_CONCURRENCY": 8,           # In-flight API requests across all endpoints
+    "MIN_CONCURRENCY": 1,
+    "DECREASE": 0.5,                # Rate and concurrency multiplier on a 429/503
+    "RECOVERY": 0.5,                # Requests/second won back per successful request
+    "BACKOFF_SECONDS": 1.0,         # Pause after a 429/503 without Retry-After, doubling per retry
+    "MAX_RETRY_AFTER_SECONDS": 300,
+    "MAX_RETRIES": 5,               # Retries of a throttled request before giving up
+    "ENDPOINTS": {                  # Per-endpoint overrides of RATE / BURST / MIN_RATE, by API_CONFIG key
+        "READING_UTILISATION_URL": {"RATE": 5.0, "BURST": 2}
+    }
+}
+
+# Auth token cache settings
+AUTH_CONFIG = {
+    "TOKEN_TTL_SECONDS": 3600,      # Assumed lifetime when the token carries no exp claim
+    "REFRESH_MARGIN_SECONDS": 60    # Refresh this long before the token expires
+}
+
+# Scheduler settings
+SCHEDULER_CONFIG = {
+    "MAX_WORKERS": 11,              # Entity jobs run concurrently on this many threads
+    "PARENT_WAIT_SECONDS": 600,     # Longest a child load waits for its parent tables
+    "MODE": "adaptive",             # "adaptive": each entity on its own interval; "cycle": every entity every minute
+    "MIN_INTERVAL_SECONDS": 60,
+    "MAX_INTERVAL_SECONDS": 3600,
+    "SPEEDUP": 0.5,                 # Interval multiplier after a run that loaded changes
+    "BACKOFF": 1.5,                 # Interval multiplier after a run that found nothing new
+    "JITTER": 0.1,                  # +/- fraction applied to every interval so runs don't line up
+    "INTERVALS": {                  # Per-entity (min, max) seconds, overriding the defaults above
+        "ReadingUtilisation": (60, 600),
+        "ReadingListItemUsage": (60, 900),
+        "ReadingListUsage": (60, 900),
+        "School": (900, 21600),
+        "Unit": (900, 21600),
+        "TeachingSession": (900, 21600)
+    }
+}
+
+# Fetch -> transform -> load pipeline settings
+PIPELINE_CONFIG = {
+    "QUEUE_SIZE": 4     # Pages buffered between stages; a full queue throttles the stage feeding it
+}
+
+# Row change-detection cache settings
+FINGERPRINT_CONFIG = {
+    "ENABLED": True,                        # Skip rows whose content hash is unchanged since the last load
+    "PATH": "fingerprints.sqlite3"          # Local store that keeps fingerprints across restarts
+}
+
+# Metrics exposition settings
+METRICS_CONFIG = {
+    "ENABLED": True,
+    "HOST": "127.0.0.1",                # /metrics listens here; keep local unless scraped remotely
+    "PORT": 9108,
+    "TEXTFILE": None,                   # e.g. "/var/lib/node_exporter/fedpipeline.prom"
+    "TEXTFILE_INTERVAL_SECONDS": 30
+}
+
+# Profiling mode settings
+PROFILING_CONFIG = {
+    "CYCLES": 0,                # Profile this many runs after startup: full passes in cycle mode,
+                                # single-entity syncs in adaptive mode (the startup pass counts as one)
+    "SIGNAL_CYCLES": 1,         # Runs profiled after each SIGUSR1 (kill -USR1 <pid>), counted the same way
+    "DIR": "profiles",          # One timestamped folder per profiled run (suffixed with the entity in adaptive mode)
+    "TOP": 15,                  # Hot functions / allocation sites listed in the summary
+    "TRACEMALLOC_FRAMES": 5
+}
+
+# Conditional-request (ETag / Last-Modified) cache settings
+HTTP_CACHE_CONFIG = {
+    "ENABLED": True,
+    "PATH": "http_cache.sqlite3",       # Validators and compressed page bodies, kept across restarts
+    "MAX_BYTES": 64 * 1024 * 1024       # Least recently used pages are evicted beyond this size
+}
+
+# Referential-integrity pre-check settings
+INTEGRITY_CONFIG = {
+    "ENABLED": True,                # Hold back child rows whose parent row hasn't loaded yet
+    "PATH": "orphans.sqlite3",      # Parked orphan rows, kept across restarts
+    "MAX_PARK_HOURS": 24,           # After this long an orphan is sent anyway and the database decides
+    "SEED_RETRY_SECONDS": 300       # Wait before re-reading a parent's keys after the read failed
+}
+
+# Client-side type coercion settings
+SCHEMA_CONFIG = {
+    "ENABLED": True,                # Convert payload values to the column types declared in sql/db.sql
+    "PATH": None,                   # DDL to read column types from; None means the repo's sql/db.sql
+    "TRUNCATE": True                # Cut over-long strings to the column length (False: reject the row)
+}
+
+# Deleted-row reconciliation settings
+RECONCILE_CONFIG = {
+    "ENABLED": True,
+    "INTERVAL_SECONDS": 24 * 3600,      # Full ID listing per entity; much slower than incremental syncs
+    "BATCH_SIZE": 1000,                 # IDs deleted per executemany round trip
+    "MAX_DELETE_FRACTION": 0.1,         # Refuse to remove more than this share of a table in one pass
+    "BITMAP_MAX_ID": 2 ** 26,           # Bitmaps stay under 8 MB; larger IDs go to a sorted array
+    "SOFT_DELETE": {                    # entity -> flag column set to 1 instead of deleting the row
+        "ReadingList": "deleted"
+    }
+}
+
+# Fetch -> load spool settings
+SPOOL_CONFIG = {
+    "ENABLED": True,                    # Spool fetched pages to disk so a failed load resumes without refetching
+    "DIR": "spool",                     # One folder of segment files per entity
+    "SEGMENT_BYTES": 16 * 1024 * 1024,  # Start a new segment file beyond this size
+    "FSYNC": True                       # fsync every page and checkpoint (survives power loss, not just crashes)
+}
+
+# Full refresh (shadow table swap) settings
+REFRESH_CONFIG = {
+    "SHADOW_SUFFIX": "_shadow",         # Tables are bulk-loaded under this name, then renamed into place
+    "OLD_SUFFIX": "_old",               # Replaced live tables, dropped after the swap unless KEEP_OLD
+    "KEEP_OLD": False,
+    "LOCK_TIMEOUT_MS": 2000,            # Longest the swap waits behind readers before giving up
+    "SWAP_RETRIES": 3,
+    "MIN_ROW_RATIO": 0.5,               # Refuse a shadow with fewer rows than this share of the live table
+    "MAX_REJECT_FRACTION": 0.01         # Refuse a shadow missing more than this share of fetched rows
+}
+
+# Usage summary tables (see fedpipeline/aggregates.py)
+AGGREGATES_CONFIG = {
+    "ENABLED": True     # Apply usage deltas to the *Daily summary tables inside each upsert
+}
+
+# Dead-letter store settings (see fedpipeline/deadletter.py)
+DEADLETTER_CONFIG = {
+    "ENABLED": True,                    # Keep rejected rows and their payloads for replay instead of only logging them
+    "PATH": "deadletters.sqlite3",
+    "BATCH_SIZE": 1000,                 # Rows retried per load during a replay
+    "RETRY_BASE_SECONDS": 300,          # Wait after the first failure; doubles with every failed retry
+    "RETRY_MAX_SECONDS": 24 * 3600,
+    "MAX_ATTEMPTS": 10,                 # Beyond this a row is only retried by replay-dead-letters --force
+    "REPLAY_ON_SYNC": True              # Retry an entity's due dead letters after each successful sync
+}
+
+# Schema migration settings (see fedpipeline/migrations.py)
+MIGRATIONS_CONFIG = {
+    "ON_STARTUP": True,             # Apply pending migrations before the scheduler starts
+    "LOCK_TIMEOUT_MS": 30000,       # Wait this long for another instance's migration to finish
+    "USAGE_COMPRESSION": "PAGE"     # Data compression on the append-heavy usage tables (PAGE, ROW or NONE)
+}
@@ -1,6 +1,11 @@
 import pyodbc
 import logging
-from fedpipeline.config import DB_CONFIG
+import re
+import time
+from functools import lru_cache
+from fedpipeline.aggregates import aggregates_for, merge_capture
+from fedpipeline.config import DB_CONFIG, LOAD_CONFIG
+from fedpipeline.metrics import timed, ROWS, ERRORS
 
 # Construct the database connection string
 conn_str = (
@@ -11,22 +16,226 @@ conn_str = (
     f"PWD={DB_CONFIG['PWD']}"
 )
 
-def insert_records(query, records, entity_name):
+
+def _new_stats():
+    return {
+        "sent": 0, "rejected": 0, "rejected_ids": [], "rejected_errors": {}, "errors": {}, "batches": 0,
+        "elapsed": 0.0, "failed": False
+    }
+
+
+_CONSTRAINT_PATTERN = re.compile(r'constraint "?([\w.]+)"?', re.IGNORECASE)
+
+
+def _reject(stats, record_id, e):
+    # Aggregate rejections by error class (exception, SQLSTATE, constraint)
+    # instead of logging every row: a rerun that fails 100k rows should cost
+    # a handful of log lines, not 100k writes from inside the load loop.
+    stats["rejected"] += 1
+    stats["rejected_ids"].append(record_id)
+    parts = [type(e).__name__]
+    if e.args and isinstance(e.args[0], str) and len(e.args[0]) <= 8:
+        parts.append(e.args[0])
+    constraint = _CONSTRAINT_PATTERN.search(str(e))
+    if constraint:
+        parts.append(constraint.group(1))
+    stats["rejected_errors"][record_id] = " ".join(parts)
+    error = stats["errors"].setdefault(" ".join(parts), {"count": 0, "sample_ids": [], "message": str(e)[:300]})
+    error["count"] += 1
+    if len(error["sample_ids"]) < LOAD_CONFIG["ERROR_SAMPLE_IDS"]:
+        error["sample_ids"].append(record_id)
+
+
+def _log_rejections(entity_name, stats):
+    for error_class, error in stats["errors"].items():
+        logging.error(
+            f"{entity_name}: {error['count']} records rejected with {error_class} "
+            f"(e.g. IDs {', '.join(map(str, error['sample_ids']))}) – {error['message']}"
+        )
+
+
+def _execute_batch(conn, cursor, query, batch, stats):
+    # Send the batch in one round trip. If it fails, roll it back and bisect
+    # so only the offending rows are rejected instead of the whole batch.
+    try:
+        cursor.executemany(query, batch)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        if len(batch) == 1:
+            _reject(stats, batch[0][0], e)
+            return
+        mid = len(batch) // 2
+        _execute_batch(conn, cursor, query, batch[:mid], stats)
+        _execute_batch(conn, cursor, query, batch[mid:], stats)
+
+
+def insert_records(query, records, entity_name, batch_size=None):
+    stats = _new_stats()
     if not records:
         logging.warning(f"No {entity_name} records to insert.")
-        return
+        return stats
+
+    batch_size = batch_size or LOAD_CONFIG["BATCH_SIZE"]
+    logging.info(f"Inserting {len(records)} {entity_name} records to DB in batches of {batch_size}.")
+    table = re.search(r"INSERT\s+INTO\s+(\w+)", query, re.IGNORECASE)
+    if table and aggregates_for(table.group(1)):
+        logging.warning(f"{entity_name}: INSERT mode doesn't maintain the usage summaries; run rebuild-aggregates.")
+    start = time.perf_counter()
 
-    logging.info(f"Inserting {len(records)} {entity_name} records to DB.")
-    
     try:
         with pyodbc.connect(conn_str) as conn:
             cursor = conn.cursor()
-            for record in records:
-                try:
-                    cursor.execute(query, record)
-                except Exception as e:
-                    logging.error(f"Error executing query for record with ID: {record[0]} – {e}")
-            conn.commit()
-        logging.info(f"{len(records)} {entity_name} records insertion ended.")
+            cursor.fast_executemany = LOAD_CONFIG["FAST_EXECUTEMANY"]
+            for i in range(0, len(records), batch_size):
+                batch = records[i:i + batch_size]
+                stats["sent"] += len(batch)
+                stats["batches"] += 1
+                _execute_batch(conn, cursor, query, batch, stats)
+        stats["elapsed"] = time.perf_counter() - start
+        _log_rejections(entity_name, stats)
+        logging.info(
+            f"{entity_name} insertion ended: {stats['sent']} sent, {stats['rejected']} rejected, "
+            f"{stats['batches']} batches in {stats['elapsed']:.2f}s."
+        )
     except Exception as e:
+        stats["elapsed"] = time.perf_counter() - start
+        stats["failed"] = True
+        _log_rejections(entity_name, stats)
         logging.error(f"Failed to connect to database or insert {entity_name} records: {e}")
+    return stats
+
+
+_INSERT_PATTERN = re.compile(r"INSERT\s+INTO\s+(\w+)\s*\(([^)]*)\)", re.IGNORECASE)
+
+
+@lru_cache(maxsize=None)
+def parse_insert_query(query):
+    # Pull the target table and column list out of an INSERT statement so the
+    # upsert path can stage and merge the same shape of record.
+    match = _INSERT_PATTERN.search(query)
+    if not match:
+        raise ValueError(f"Not an INSERT INTO statement: {query}")
+    columns = tuple(c.strip() for c in match.group(2).split(","))
+    return match.group(1), columns
+
+
+@lru_cache(maxsize=None)
+def build_merge_query(table, columns, key_column="ereserve_id", capture=(), after=""):
+    # capture: ((column, type), ...) whose old and new values the MERGE
+    # records in @changes for `after`, SQL run in the same batch (and so the
+    # same transaction) before the counts are returned.
+    stage = f"#stage_{table}"
+    non_key = [c for c in columns if c != key_column]
+    column_list = ", ".join(columns)
+    source_values = ", ".join(f"source.{c}" for c in columns)
+    # EXCEPT compares NULLs as equal, so identical rows are left untouched.
+    changed = (
+        f"EXISTS (SELECT {', '.join(f'source.{c}' for c in non_key)} "
+        f"EXCEPT SELECT {', '.join(f'target.{c}' for c in non_key)})"
+    )
+    update_set = ", ".join(f"target.{c} = source.{c}" for c in non_key)
+    matched = f"WHEN MATCHED AND {changed} THEN UPDATE SET {update_set}" if non_key else ""
+    captured = "".join(f", new_{c} {kind}, old_{c} {kind}" for c, kind in capture)
+    output = "".join(f", inserted.{c}, deleted.{c}" for c, _ in capture)
+    return f"""
+        SET NOCOUNT ON;
+        DECLARE @changes TABLE (action NVARCHAR(10){captured});
+        MERGE INTO {table} AS target
+        USING (SELECT {column_list} FROM {stage} WHERE {key_column} BETWEEN ? AND ?) AS source
+            ON target.{key_column} = source.{key_column}
+        {matched}
+        WHEN NOT MATCHED BY TARGET THEN
+            INSERT ({column_list}) VALUES ({source_values})
+        OUTPUT $action{output} INTO @changes;{after}
+        SELECT
+            COALESCE(SUM(CASE WHEN action = 'INSERT' THEN 1 ELSE 0 END), 0),
+            COALESCE(SUM(CASE WHEN action = 'UPDATE' THEN 1 ELSE 0 END), 0)
+        FROM @changes;
+    """
+
+
+def _merge_keys(conn, cursor, merge_query, keys, stats):
+    # One set-based MERGE over the key range. If a row breaks a constraint the
+    # whole statement fails, so bisect the key range to isolate it.
+    try:
+        cursor.execute(merge_query, keys[0], keys[-1])
+        inserted, updated = cursor.fetchone()
+        conn.commit()
+        stats["inserted"] += inserted
+        stats["updated"] += updated
+    except Exception as e:
+        conn.rollback()
+        if len(keys) == 1:
+            _reject(stats, keys[0], e)
+            return
+        mid = len(keys) // 2
+        _merge_keys(conn, cursor, merge_query, keys[:mid], stats)
+        _merge_keys(conn, cursor, merge_query, keys[mid:], stats)
+
+
+def upsert_records(query, records, entity_name, key_column="ereserve_id", batch_size=None):
+    stats = _new_stats()
+    stats.update({"inserted": 0, "updated": 0, "unchanged": 0})
+    if not records:
+        logging.warning(f"No {entity_name} records to upsert.")
+        return stats
+
+    table, columns = parse_insert_query(query)
+    key_index = columns.index(key_column)
+    stage = f"#stage_{table}"
+    batch_size = batch_size or LOAD_CONFIG["BATCH_SIZE"]
+
+    # MERGE refuses to touch a target row twice, so keep the last copy of each key.
+    unique = {record[key_index]: record for record in records}
+    staged = list(unique.values())
+    keys = sorted(unique)
+
+    logging.info(f"Upserting {len(staged)} {entity_name} records to DB via {stage}.")
+    start = time.perf_counter()
+
+    try:
+        with pyodbc.connect(conn_str) as conn:
+            cursor = conn.cursor()
+            cursor.fast_executemany = LOAD_CONFIG["FAST_EXECUTEMANY"]
+            cursor.execute(f"DROP TABLE IF EXISTS {stage}")
+            cursor.execute(f"SELECT TOP 0 {', '.join(columns)} INTO {stage} FROM {table}")
+            conn.commit()
+
+            stage_query = f"INSERT INTO {stage} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+            for i in range(0, len(staged), batch_size):
+                batch = staged[i:i + batch_size]
+                stats["sent"] += len(batch)
+                stats["batches"] += 1
+                _execute_batch(conn, cursor, stage_query, batch, stats)
+
+            # Summary tables over this one move in the same transaction as its rows.
+            capture, after = merge_capture(table)
+            _merge_keys(conn, cursor, build_merge_query(table, columns, key_column, capture, after), keys, stats)
+            cursor.execute(f"DROP TABLE IF EXISTS {stage}")
+            conn.commit()
+
+        stats["unchanged"] = stats["sent"] - stats["rejected"] - stats["inserted"] - stats["updated"]
+        stats["elapsed"] = time.perf_counter() - start
+        _log_rejections(entity_name, stats)
+        logging.info(
+            f"{entity_name} upsert ended: {stats['inserted']} inserted, {stats['updated']} updated, "
+            f"{stats['unchanged']} unchanged, {stats['rejected']} rejected in {stats['elapsed']:.2f}s."
+        )
+    except Exception as e:
+        stats["elapsed"] = time.perf_counter() - start
+        stats["failed"] = True
+        _log_rejections(entity_name, stats)
+        logging.error(f"Failed to connect to database or upsert {entity_name} records: {e}")
+    return stats
+
+
+def load_records(query, records, entity_name):
+    with timed("load", entity_name):
+        if LOAD_CONFIG["MODE"] == "upsert":
+            stats = upsert_records(query, records, entity_name)
+        else:
+            stats = insert_records(query, records, entity_name)
+    ROWS.inc(stats["sent"] - stats["rejected"], entity=entity_name, stage="load")
+    ERRORS.inc(stats["rejected"] + int(stats["failed"]), entity=entity_name, stage="load")
+    return stats
@@ -0,0 +1,228 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from fedpipeline.config import DEADLETTER_CONFIG, FINGERPRINT_CONFIG
+from fedpipeline.dag import topological_order
+from fedpipeline.db_handler import load_records
+from fedpipeline.entities import ENTITIES, entity_parents
+from fedpipeline.fingerprints import record_loaded
+from fedpipeline.integrity import record_keys
+from fedpipeline.metrics import register_collector, timed
+from fedpipeline.schema import coerce_rows
+
+# Rows refused by type coercion or by SQL Server are kept here with their raw
+# payload, instead of surviving only as a log line. Once the cause is fixed
+# (a parent arrives, a column is widened) replay() sends just these rows
+# again, in batches, rather than refetching whole endpoints. Each failed
+# replay doubles the wait before the row is due again.
+
+_lock = threading.Lock()
+_store = None
+_FIRST_KEY = -(2 ** 63)
+
+
+def _connect():
+    global _store
+    if _store is None:
+        _store = sqlite3.connect(DEADLETTER_CONFIG["PATH"], check_same_thread=False)
+        _store.execute(
+            "CREATE TABLE IF NOT EXISTS dead_letters ("
+            " entity TEXT NOT NULL, ereserve_id INTEGER NOT NULL, payload TEXT NOT NULL,"
+            " stage TEXT NOT NULL, error_class TEXT NOT NULL, message TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL, first_failed REAL NOT NULL, last_failed REAL NOT NULL,"
+            " next_attempt REAL NOT NULL,"
+            " PRIMARY KEY (entity, ereserve_id)) WITHOUT ROWID"
+        )
+    return _store
+
+
+def close_dead_letters():
+    global _store
+    with _lock:
+        if _store is not None:
+            _store.close()
+            _store = None
+
+
+def _as_key(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def coercion_failures(rejects):
+    # coerce_rows() rejects -> {key: (stage, error class, message)}.
+    return {key: ("transform", f"CoercionError {reason.split(':')[0]}", reason) for key, reason in rejects}
+
+
+def load_failures(stats):
+    # load_records() stats -> {key: (stage, error class, message)}.
+    classes = stats.get("rejected_errors", {})
+    errors = stats.get("errors", {})
+    failures = {}
+    for key in stats.get("rejected_ids", ()):
+        error_class = classes.get(key, "Rejected")
+        failures[key] = ("load", error_class, errors.get(error_class, {}).get("message", ""))
+    return failures
+
+
+def record(entity, failures, items=(), rows=(), attempt=False):
+    # Store each failed row. The payload is the API item when we have it; rows
+    # released from the orphan queue have none, so their row is stored under
+    # the item's field names instead. Only a replay (attempt=True) counts
+    # another attempt and pushes the row back; a sync that meets the row again
+    # just refreshes its payload and error.
+    if not DEADLETTER_CONFIG["ENABLED"] or not failures:
+        return
+    failures = {_as_key(key): failure for key, failure in failures.items()}
+    payloads = {}
+    for item in items:
+        key = _as_key(item.get("id")) if isinstance(item, dict) else None
+        if key in failures:
+            payloads[key] = item
+    for row in rows:
+        key = _as_key(row[0])
+        if key in failures and key not in payloads:
+            payloads[key] = dict(zip(entity.fields, row))
+    now = time.time()
+    entries = [
+        (entity.name, key, json.dumps(payloads[key], default=str), stage, error_class, message[:1000], now, now,
+         now + DEADLETTER_CONFIG["RETRY_BASE_SECONDS"])
+        for key, (stage, error_class, message) in failures.items() if key in payloads
+    ]
+    if len(entries) < len(failures):
+        logging.warning(f"{entity.name}: {len(failures) - len(entries)} rejected rows had no usable ID or payload.")
+    query = (
+        "INSERT INTO dead_letters (entity, ereserve_id, payload, stage, error_class, message, attempts,"
+        " first_failed, last_failed, next_attempt) VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?, ?)"
+        " ON CONFLICT (entity, ereserve_id) DO UPDATE SET"
+        " payload = excluded.payload, stage = excluded.stage, error_class = excluded.error_class,"
+        " message = excluded.message, last_failed = excluded.last_failed"
+    )
+    if attempt:
+        query += (
+            ", attempts = dead_letters.attempts + 1,"
+            " next_attempt = excluded.last_failed + min(?, ? * (1 << min(dead_letters.attempts, 30)))"
+        )
+        entries = [entry + (DEADLETTER_CONFIG["RETRY_MAX_SECONDS"], DEADLETTER_CONFIG["RETRY_BASE_SECONDS"])
+                   for entry in entries]
+    with _lock:
+        store = _connect()
+        store.executemany(query, entries)
+        store.commit()
+    logging.warning(f"{entity.name}: {len(entries)} rejected rows kept in the dead-letter store for replay.")
+
+
+def resolve(entity_name, keys):
+    # These keys loaded: they're no longer dead letters.
+    with _lock:
+        store = _connect()
+        if store.execute("SELECT 1 FROM dead_letters WHERE entity = ? LIMIT 1", (entity_name,)).fetchone() is None:
+            return
+        store.executemany(
+            "DELETE FROM dead_letters WHERE entity = ? AND ereserve_id = ?",
+            ((entity_name, _as_key(key)) for key in keys),
+        )
+        store.commit()
+
+
+def forget(entity_name):
+    # The table was reloaded from scratch; its old dead letters are moot.
+    with _lock:
+        store = _connect()
+        store.execute("DELETE FROM dead_letters WHERE entity = ?", (entity_name,))
+        store.commit()
+
+
+def _due(entity_name, after, force):
+    # Next batch of dead letters past `after`, in key order (a seek on the
+    # primary key, so a replay costs O(failed rows), not O(table)).
+    query = "SELECT ereserve_id, payload FROM dead_letters WHERE entity = ? AND ereserve_id > ?"
+    params = [entity_name, after]
+    if not force:
+        query += " AND next_attempt <= ? AND attempts < ?"
+        params += [time.time(), DEADLETTER_CONFIG["MAX_ATTEMPTS"]]
+    query += " ORDER BY ereserve_id LIMIT ?"
+    params.append(DEADLETTER_CONFIG["BATCH_SIZE"])
+    with _lock:
+        return _connect().execute(query, params).fetchall()
+
+
+def replay_entity(entity, force=False):
+    # Retry the entity's due dead letters batch by batch; force ignores the
+    # retry spacing and MAX_ATTEMPTS. Rows that fail again stay, one attempt on.
+    report = {"retried": 0, "loaded": 0, "failed": 0}
+    after = _FIRST_KEY
+    with timed("replay", entity.name):
+        while True:
+            batch = _due(entity.name, after, force)
+            if not batch:
+                break
+            after = batch[-1][0]
+            items = [json.loads(payload) for _, payload in batch]
+            rejects = []
+            rows, _ = coerce_rows(entity, entity.project(items), rejects)
+            failures = coercion_failures(rejects)
+            if rows:
+                stats = load_records(entity.insert_sql, rows, entity.name)
+                if stats["failed"]:
+                    # Nothing was tried, so no attempt is counted.
+                    logging.error(f"{entity.name}: dead-letter replay stopped, the load failed.")
+                    break
+                failures.update(load_failures(stats))
+            loaded = [row[0] for row in rows if row[0] not in failures]
+            record(entity, failures, items=items, attempt=True)
+            resolve(entity.name, loaded)
+            if FINGERPRINT_CONFIG["ENABLED"]:
+                record_loaded(entity.name, rows, failures)
+            record_keys(entity.name, loaded)
+            report["retried"] += len(batch)
+            report["loaded"] += len(loaded)
+            report["failed"] += len(batch) - len(loaded)
+    if report["retried"]:
+        logging.info(
+            f"{entity.name} dead-letter replay: {report['retried']} retried, {report['loaded']} loaded, "
+            f"{report['failed']} failed again."
+        )
+    return report
+
+
+def replay(names=None, force=False):
+    # Parents first, so a child whose parent was the problem finds it loaded.
+    waiting = dead_letter_counts()
+    reports = {}
+    for name in topological_order(entity_parents()):
+        if name in waiting and (not names or name in names):
+            try:
+                reports[name] = replay_entity(ENTITIES[name], force)
+            except Exception as e:
+                logging.error(f"Error replaying {name} dead letters: {e}")
+    return reports
+
+
+def dead_letter_counts():
+    with _lock:
+        return dict(_connect().execute("SELECT entity, COUNT(*) FROM dead_letters GROUP BY entity").fetchall())
+
+
+def dead_letter_keys(entity_name):
+    with _lock:
+        rows = _connect().execute("SELECT ereserve_id FROM dead_letters WHERE entity = ?", (entity_name,)).fetchall()
+    return [key for key, in rows]
+
+
+def _error_counts():
+    with _lock:
+        rows = _connect().execute(
+            "SELECT entity, stage, error_class, COUNT(*) FROM dead_letters GROUP BY entity, stage, error_class"
+        ).fetchall()
+    return {(entity, stage, error_class): count for entity, stage, error_class, count in rows}
+
+
+register_collector(lambda: (
+    "fedpipeline_dead_letter_rows", "gauge", "Rejected rows waiting in the dead-letter store for replay.",
+    _error_counts(), ("entity", "stage", "error_class"),
+))
@@ -0,0 +1,106 @@
+from operator import itemgetter
+from fedpipeline.config import API_CONFIG
+
+
+def compile_projector(fields):
+    # Build a page -> rows function. The fast path is one C-level itemgetter
+    # call per item; items missing a field fall back to dict.get so absent
+    # values still load as NULL, as before.
+    getter = itemgetter(*fields)
+    if len(fields) == 1:
+        single = getter
+        getter = lambda item: (single(item),)
+
+    def project_item(item):
+        try:
+            return getter(item)
+        except KeyError:
+            return tuple(item.get(field) for field in fields)
+
+    def project(items):
+        try:
+            return list(map(getter, items))
+        except KeyError:
+            return list(map(project_item, items))
+
+    return project
+
+
+def build_insert_sql(table, columns):
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+
+class Entity:
+    # One API endpoint loaded into one table. Columns are listed in table
+    # order; the key column is read from the payload's "id" and every other
+    # column from the payload field of the same name. foreign_keys maps a
+    # column to the entity it references; parents are derived from it.
+
+    def __init__(self, name, endpoint, columns, foreign_keys=None, table=None, key="ereserve_id"):
+        self.name = name
+        self.endpoint = endpoint
+        self.table = table or name
+        self.columns = tuple(columns)
+        self.key = key
+        self.foreign_keys = dict(foreign_keys or {})
+        self.parents = tuple(dict.fromkeys(self.foreign_keys.values()))
+        self.fields = tuple("id" if column == key else column for column in self.columns)
+        self.project = compile_projector(self.fields)
+        self.insert_sql = build_insert_sql(self.table, self.columns)
+
+    @property
+    def url(self):
+        return API_CONFIG[self.endpoint]
+
+    def __repr__(self):
+        return f"Entity({self.name!r})"
+
+
+# foreign_keys mirror the constraints declared in sql/db.sql.
+ENTITIES = {entity.name: entity for entity in [
+    Entity("IntegrationUser", "INTEGRATION_USERS_URL", [
+        "ereserve_id", "identifier", "roles", "first_name", "last_name", "email",
+        "lti_consumer_user_id", "lti_lis_person_sourcedid", "created_at", "updated_at",
+    ]),
+    Entity("School", "SCHOOLS_URL", ["ereserve_id", "name"]),
+    Entity("Reading", "READINGS_URL", [
+        "ereserve_id", "reading_title", "genre", "source_document_title",
+        "article_number", "created_at", "updated_at",
+    ]),
+    Entity("Unit", "UNITS_URL", ["ereserve_id", "code", "name"]),
+    Entity("TeachingSession", "TEACHING_SESSIONS_URL", [
+        "ereserve_id", "name", "start_date", "end_date", "archived", "created_at", "updated_at",
+    ]),
+    Entity("ReadingList", "READING_LISTS_URL", [
+        "ereserve_id", "unit_id", "teaching_session_id", "name", "duration",
+        "start_date", "end_date", "hidden", "usage_count", "item_count",
+        "approved_item_count", "deleted", "created_at", "updated_at",
+    ], foreign_keys={"unit_id": "Unit", "teaching_session_id": "TeachingSession"}),
+    Entity("ReadingListItem", "READING_LIST_ITEMS_URL", [
+        "ereserve_id", "list_id", "reading_id", "status", "hidden",
+        "reading_utilisations_count", "reading_importance", "usage_count", "created_at", "updated_at",
+    ], foreign_keys={"list_id": "ReadingList", "reading_id": "Reading"}),
+    Entity("ReadingListUsage", "READING_LIST_USAGE_URL", [
+        "ereserve_id", "list_id", "integration_user_id", "item_usage_count",
+        "list_publication_method", "created_at", "updated_at",
+    ], foreign_keys={"list_id": "ReadingList", "integration_user_id": "IntegrationUser"}),
+    Entity("UnitOffering", "UNIT_OFFERINGS_URL", [
+        "ereserve_id", "unit_id", "reading_list_id", "source_unit_code", "source_unit_name",
+        "source_unit_offering", "result", "list_publication_method", "created_at", "updated_at",
+    ], foreign_keys={"unit_id": "Unit", "reading_list_id": "ReadingList"}),
+    Entity("ReadingListItemUsage", "READING_LIST_ITEM_USAGE_URL", [
+        "ereserve_id", "item_id", "list_usage_id", "integration_user_id",
+        "utilisation_count", "created_at", "updated_at",
+    ], foreign_keys={
+        "item_id": "ReadingListItem", "list_usage_id": "ReadingListUsage", "integration_user_id": "IntegrationUser",
+    }),
+    Entity("ReadingUtilisation", "READING_UTILISATION_URL", [
+        "ereserve_id", "integration_user_id", "item_id", "item_usage_id", "created_at", "updated_at",
+    ], foreign_keys={
+        "integration_user_id": "IntegrationUser", "item_id": "ReadingListItem", "item_usage_id": "ReadingListItemUsage",
+    }),
+]}
+
+
+def entity_parents():
+    return {name: entity.parents for name, entity in ENTITIES.items()}
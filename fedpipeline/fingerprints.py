@@ -0,0 +1,221 @@
+import hashlib
+import json
+import logging
+import pyodbc
+import sqlite3
+import threading
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from fedpipeline.config import FINGERPRINT_CONFIG
+from fedpipeline.db_handler import conn_str
+from fedpipeline.metrics import register_collector
+from fedpipeline.state import parse_timestamp
+
+# entity -> {ereserve_id: 64-bit content hash}, loaded lazily from the local store.
+_cache = {}
+# entity -> store generation the cache was loaded at. Every bulk change to an
+# entity's fingerprints (resync, rebuild, reconcile) bumps its generation, so a
+# scheduler notices changes made by a separate CLI process and reloads.
+_generations = {}
+_lock = threading.Lock()
+_store = None
+FINGERPRINT_STATS = {}
+
+
+def _canonical(value):
+    # Hash API payloads and database rows the same way: timestamps and dates
+    # as ISO datetimes, booleans as 0/1, lists as JSON.
+    if isinstance(value, str):
+        if len(value) >= 10 and value[4:5] == "-" and value[7:8] == "-":
+            parsed = parse_timestamp(value)
+            if parsed is not None:
+                return parsed.isoformat()
+        return value
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.isoformat()
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day).isoformat()
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, sort_keys=True)
+    return value
+
+
+def fingerprint(row):
+    digest = hashlib.blake2b(repr(tuple(map(_canonical, row))).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def _connect():
+    global _store
+    if _store is None:
+        _store = sqlite3.connect(FINGERPRINT_CONFIG["PATH"], check_same_thread=False)
+        _store.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints ("
+            " entity TEXT NOT NULL, ereserve_id INTEGER NOT NULL, hash INTEGER NOT NULL,"
+            " PRIMARY KEY (entity, ereserve_id)) WITHOUT ROWID"
+        )
+        _store.execute(
+            "CREATE TABLE IF NOT EXISTS generations (entity TEXT PRIMARY KEY NOT NULL, generation INTEGER NOT NULL)"
+        )
+    return _store
+
+
+def close_store():
+    global _store
+    with _lock:
+        if _store is not None:
+            _store.close()
+            _store = None
+        _cache.clear()
+        _generations.clear()
+        FINGERPRINT_STATS.clear()
+
+
+def _generation(entity_name):
+    # Caller holds _lock.
+    row = _connect().execute("SELECT generation FROM generations WHERE entity = ?", (entity_name,)).fetchone()
+    return row[0] if row else 0
+
+
+def _bump_generation(store, entity_name):
+    # Caller holds _lock and has brought _cache[entity_name] in line with the store.
+    store.execute(
+        "INSERT INTO generations (entity, generation) VALUES (?, 1)"
+        " ON CONFLICT (entity) DO UPDATE SET generation = generation + 1",
+        (entity_name,),
+    )
+    _generations[entity_name] = _generation(entity_name)
+
+
+def _entity_cache(entity_name):
+    # Caller holds _lock.
+    generation = _generation(entity_name)
+    cache = _cache.get(entity_name)
+    if cache is None or _generations.get(entity_name) != generation:
+        rows = _connect().execute("SELECT ereserve_id, hash FROM fingerprints WHERE entity = ?", (entity_name,))
+        cache = _cache[entity_name] = dict(rows)
+        _generations[entity_name] = generation
+        FINGERPRINT_STATS.setdefault(entity_name, {"hits": 0, "misses": 0})
+    return cache
+
+
+def filter_changed(entity_name, rows):
+    # Drop rows whose content matches the fingerprint of the last successful load.
+    # Hashing happens outside the lock so concurrent entities transform in parallel.
+    hashes = [fingerprint(row) for row in rows]
+    with _lock:
+        cache = _entity_cache(entity_name)
+        changed = [row for row, value in zip(rows, hashes) if cache.get(row[0]) != value]
+        stats = FINGERPRINT_STATS[entity_name]
+        stats["hits"] += len(rows) - len(changed)
+        stats["misses"] += len(changed)
+    return changed
+
+
+def record_loaded(entity_name, rows, rejected_ids=()):
+    # Remember rows the database accepted; rejected rows must be re-sent next time.
+    rejected = set(rejected_ids)
+    entries = [(entity_name, row[0], fingerprint(row)) for row in rows if row[0] not in rejected]
+    if not entries:
+        return
+    with _lock:
+        cache = _entity_cache(entity_name)
+        cache.update((ereserve_id, value) for _, ereserve_id, value in entries)
+        store = _connect()
+        store.executemany("INSERT OR REPLACE INTO fingerprints (entity, ereserve_id, hash) VALUES (?, ?, ?)", entries)
+        store.commit()
+
+
+def clear_fingerprints(entity_name):
+    with _lock:
+        _cache.pop(entity_name, None)
+        store = _connect()
+        store.execute("DELETE FROM fingerprints WHERE entity = ?", (entity_name,))
+        _bump_generation(store, entity_name)
+        store.commit()
+
+
+def forget_fingerprints(entity_name, keys):
+    # Rows removed from the table: if they come back they must load again.
+    keys = list(keys)
+    if not keys:
+        return
+    with _lock:
+        cache = _entity_cache(entity_name)
+        for key in keys:
+            cache.pop(key, None)
+        store = _connect()
+        store.executemany(
+            "DELETE FROM fingerprints WHERE entity = ? AND ereserve_id = ?", ((entity_name, k) for k in keys)
+        )
+        _bump_generation(store, entity_name)
+        store.commit()
+
+
+def fingerprint_stats():
+    stats = {}
+    with _lock:
+        for entity_name, counts in FINGERPRINT_STATS.items():
+            total = counts["hits"] + counts["misses"]
+            stats[entity_name] = dict(counts, hit_ratio=counts["hits"] / total if total else 0.0)
+    return stats
+
+
+def rebuild_from_database(entity):
+    # Replace an entity's fingerprints with hashes of what the table actually
+    # holds, reporting how far the local cache had drifted.
+    rebuilt = {}
+    with pyodbc.connect(conn_str) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {', '.join(entity.columns)} FROM {entity.table}")
+        while True:
+            rows = cursor.fetchmany(10000)
+            if not rows:
+                break
+            for row in rows:
+                rebuilt[row[0]] = fingerprint(tuple(row))
+
+    with _lock:
+        cached = _entity_cache(entity.name)
+        report = {
+            "matched": sum(1 for key, value in rebuilt.items() if cached.get(key) == value),
+            "stale": sum(1 for key, value in rebuilt.items() if key in cached and cached[key] != value),
+            "missing_in_db": sum(1 for key in cached if key not in rebuilt),
+            "rows": len(rebuilt),
+        }
+        store = _connect()
+        store.execute("DELETE FROM fingerprints WHERE entity = ?", (entity.name,))
+        store.executemany(
+            "INSERT INTO fingerprints (entity, ereserve_id, hash) VALUES (?, ?, ?)",
+            ((entity.name, key, value) for key, value in rebuilt.items()),
+        )
+        _cache[entity.name] = rebuilt
+        _bump_generation(store, entity.name)
+        store.commit()
+    logging.info(
+        f"{entity.name} fingerprints rebuilt from {report['rows']} rows: {report['matched']} matched, "
+        f"{report['stale']} stale, {report['missing_in_db']} no longer in the database."
+    )
+    return report
+
+
+def _collect():
+    values = {}
+    for entity_name, counts in fingerprint_stats().items():
+        values[(entity_name, "hit")] = counts["hits"]
+        values[(entity_name, "miss")] = counts["misses"]
+    return (
+        "fedpipeline_fingerprint_lookups_total", "counter",
+        "Change-detection lookups; hits are unchanged rows skipped before the database.",
+        values, ("entity", "result"),
+    )
+
+
+register_collector(_collect)
+
@@ -0,0 +1,185 @@
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import urlencode
+from fedpipeline.config import HTTP_CACHE_CONFIG
+from fedpipeline.metrics import register_collector
+
+# Validators (ETag / Last-Modified) and compressed bodies per requested page.
+# Pages fetched for an entity are staged and only become cache entries once
+# that entity's run has loaded them, so a 304 always means "already loaded".
+_lock = threading.Lock()
+_store = None
+HTTP_CACHE_STATS = {}
+
+
+def _connect():
+    global _store
+    if _store is None:
+        _store = sqlite3.connect(HTTP_CACHE_CONFIG["PATH"], check_same_thread=False)
+        for table in ("http_cache", "http_cache_pending"):
+            _store.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                " key TEXT PRIMARY KEY, entity TEXT NOT NULL, etag TEXT, last_modified TEXT,"
+                " next_url TEXT, body BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+    return _store
+
+
+def close_http_cache():
+    global _store
+    with _lock:
+        if _store is not None:
+            _store.close()
+            _store = None
+        HTTP_CACHE_STATS.clear()
+
+
+def request_key(url, params=None):
+    return f"{url}?{urlencode(sorted(params.items()))}" if params else url
+
+
+def _stats(entity_name):
+    return HTTP_CACHE_STATS.setdefault(entity_name, {"hits": 0, "misses": 0, "bytes_saved": 0})
+
+
+def lookup(entity_name, key):
+    # Returns the cached entry to revalidate, or None. Entries are per entity:
+    # a page another caller cached (e.g. reconciliation) was never loaded.
+    if not HTTP_CACHE_CONFIG["ENABLED"]:
+        return None
+    with _lock:
+        row = _connect().execute(
+            "SELECT etag, last_modified, next_url, size FROM http_cache WHERE key = ? AND entity = ?",
+            (key, entity_name),
+        ).fetchone()
+    if row is None:
+        return None
+    etag, last_modified, next_url, size = row
+    return {"key": key, "etag": etag, "last_modified": last_modified, "next_url": next_url, "size": size}
+
+
+def conditional_headers(entry):
+    headers = {}
+    if entry and entry["etag"]:
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry["last_modified"]:
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+def cached_body(entry):
+    with _lock:
+        store = _connect()
+        row = store.execute("SELECT body FROM http_cache WHERE key = ?", (entry["key"],)).fetchone()
+        store.execute("UPDATE http_cache SET last_used = ? WHERE key = ?", (time.time(), entry["key"]))
+        store.commit()
+    return zlib.decompress(row[0]) if row else None
+
+
+def record_hit(entity_name, entry):
+    with _lock:
+        stats = _stats(entity_name)
+        stats["hits"] += 1
+        stats["bytes_saved"] += entry["size"]
+
+
+def record_miss(entity_name):
+    with _lock:
+        _stats(entity_name)["misses"] += 1
+
+
+def stage(entity_name, key, response, next_url=None, pending=True):
+    # Keep a page the server sent validators for. Pending pages wait for
+    # commit(); pass pending=False to cache it straight away.
+    if not HTTP_CACHE_CONFIG["ENABLED"]:
+        return
+    etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+    if not etag and not last_modified:
+        return
+    body = response.content
+    table = "http_cache_pending" if pending else "http_cache"
+    with _lock:
+        store = _connect()
+        store.execute(
+            f"INSERT OR REPLACE INTO {table} (key, entity, etag, last_modified, next_url, body, size, last_used)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, entity_name, etag, last_modified, next_url, zlib.compress(body), len(body), time.time()),
+        )
+        store.commit()
+        if not pending:
+            _evict(store)
+
+
+def commit(entity_name):
+    # The entity's run loaded every page it fetched: make its pages revalidatable.
+    with _lock:
+        store = _connect()
+        store.execute(
+            "INSERT OR REPLACE INTO http_cache SELECT * FROM http_cache_pending WHERE entity = ?", (entity_name,)
+        )
+        store.execute("DELETE FROM http_cache_pending WHERE entity = ?", (entity_name,))
+        store.commit()
+        _evict(store)
+
+
+def discard(entity_name):
+    # The run failed somewhere: its pages must be downloaded again next time.
+    with _lock:
+        store = _connect()
+        store.execute("DELETE FROM http_cache_pending WHERE entity = ?", (entity_name,))
+        store.commit()
+
+
+def clear_http_cache(entity_name):
+    with _lock:
+        store = _connect()
+        store.execute("DELETE FROM http_cache WHERE entity = ?", (entity_name,))
+        store.execute("DELETE FROM http_cache_pending WHERE entity = ?", (entity_name,))
+        store.commit()
+
+
+def _evict(store):
+    # Caller holds _lock. Drop least recently used pages until under MAX_BYTES.
+    total = store.execute("SELECT COALESCE(SUM(LENGTH(body)), 0) FROM http_cache").fetchone()[0]
+    excess = total - HTTP_CACHE_CONFIG["MAX_BYTES"]
+    if excess <= 0:
+        return
+    evicted = 0
+    for key, stored in store.execute("SELECT key, LENGTH(body) FROM http_cache ORDER BY last_used").fetchall():
+        if excess <= 0:
+            break
+        store.execute("DELETE FROM http_cache WHERE key = ?", (key,))
+        excess -= stored
+        evicted += 1
+    store.commit()
+    logging.info(f"HTTP cache over {HTTP_CACHE_CONFIG['MAX_BYTES']} bytes; evicted {evicted} pages.")
+
+
+def http_cache_stats():
+    stats = {}
+    with _lock:
+        for entity_name, counts in HTTP_CACHE_STATS.items():
+            total = counts["hits"] + counts["misses"]
+            stats[entity_name] = dict(counts, hit_ratio=counts["hits"] / total if total else 0.0)
+    return stats
+
+
+def _collect():
+    values = {}
+    for entity_name, counts in http_cache_stats().items():
+        values[(entity_name, "hit")] = counts["hits"]
+        values[(entity_name, "miss")] = counts["misses"]
+    return (
+        "fedpipeline_http_cache_requests_total", "counter",
+        "Conditional page requests; hits are 304 Not Modified answers.", values, ("entity", "result"),
+    )
+
+
+register_collector(_collect)
+register_collector(lambda: (
+    "fedpipeline_http_cache_bytes_saved_total", "counter", "Response bytes not downloaded thanks to 304s.",
+    {(entity_name,): counts["bytes_saved"] for entity_name, counts in http_cache_stats().items()}, ("entity",),
+))
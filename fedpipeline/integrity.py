@@ -0,0 +1,292 @@
+import json
+import logging
+import pyodbc
+import sqlite3
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from fedpipeline.config import INTEGRITY_CONFIG
+from fedpipeline.db_handler import conn_str
+from fedpipeline.metrics import register_collector
+
+# Foreign keys checked in memory before a row reaches SQL Server. A child row
+# whose parent isn't loaded yet is parked instead of sent (and rejected); it
+# is retried once the parent shows up.
+
+
+class KeyIndex:
+    # Loaded keys of one table: a sorted array of 64-bit ints (8 bytes a key)
+    # plus a small set of recent additions, merged in once it grows.
+
+    def __init__(self, keys=()):
+        self._sorted = array("q", sorted(set(keys)))
+        self._recent = set()
+
+    def __contains__(self, key):
+        if key in self._recent:
+            return True
+        i = bisect_left(self._sorted, key)
+        return i < len(self._sorted) and self._sorted[i] == key
+
+    def __len__(self):
+        return len(self._sorted) + len(self._recent)
+
+    def add(self, keys):
+        self._recent.update(key for key in keys if key not in self)
+        if len(self._recent) > max(4096, len(self._sorted) // 8):
+            self._sorted = array("q", sorted(set(self._sorted).union(self._recent)))
+            self._recent = set()
+
+
+_lock = threading.Lock()
+_indexes = {}
+# parent -> keys recorded while its index is being seeded; parent -> when seeding last failed.
+_seeding = {}
+_seed_failed = {}
+_seed_locks = {}
+_store = None
+# (child, column, parent) -> orphan rows parked since startup.
+ORPHAN_STATS = {}
+
+
+def _as_key(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _connect():
+    global _store
+    if _store is None:
+        _store = sqlite3.connect(INTEGRITY_CONFIG["PATH"], check_same_thread=False)
+        _store.execute(
+            "CREATE TABLE IF NOT EXISTS orphans ("
+            " entity TEXT NOT NULL, ereserve_id INTEGER NOT NULL, row TEXT NOT NULL,"
+            " missing TEXT NOT NULL, parked_at REAL NOT NULL,"
+            " PRIMARY KEY (entity, ereserve_id)) WITHOUT ROWID"
+        )
+    return _store
+
+
+def close_integrity():
+    global _store
+    with _lock:
+        if _store is not None:
+            _store.close()
+            _store = None
+        _indexes.clear()
+        _seeding.clear()
+        _seed_failed.clear()
+        ORPHAN_STATS.clear()
+
+
+def _read_keys(parent):
+    keys = array("q")
+    with pyodbc.connect(conn_str) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {parent.key} FROM {parent.table}")
+        while True:
+            rows = cursor.fetchmany(10000)
+            if not rows:
+                break
+            keys.extend(row[0] for row in rows)
+    return keys
+
+
+def _seed_due(name):
+    # Caller holds _lock. After a failed seed, wait before reading the table again.
+    failed = _seed_failed.get(name)
+    return failed is None or time.time() - failed >= INTEGRITY_CONFIG["SEED_RETRY_SECONDS"]
+
+
+def _parent_index(parent):
+    # Caller must not hold _lock. Seeded from the table on first use, then
+    # kept current by record_keys(); None while the table can't be read. The
+    # scan runs outside _lock (one per parent at a time), so other entities'
+    # checks and the metrics don't wait for it.
+    with _lock:
+        if parent.name in _indexes or not _seed_due(parent.name):
+            return _indexes.get(parent.name)
+        seed_lock = _seed_locks.setdefault(parent.name, threading.Lock())
+    with seed_lock:
+        with _lock:
+            if parent.name in _indexes or not _seed_due(parent.name):
+                return _indexes.get(parent.name)
+            # Keys loaded during the scan may be missing from it; keep them aside.
+            pending = _seeding[parent.name] = []
+        try:
+            keys = _read_keys(parent)
+        except Exception as e:
+            with _lock:
+                _seeding.pop(parent.name, None)
+                _seed_failed[parent.name] = time.time()
+            logging.warning(
+                f"Integrity pre-check off for {parent.name} children, retrying in "
+                f"{INTEGRITY_CONFIG['SEED_RETRY_SECONDS']}s: {e}"
+            )
+            return None
+        index = KeyIndex(keys)
+        with _lock:
+            if _seeding.get(parent.name) is pending:
+                # Not forgotten (forget_keys) while we were reading: publish it.
+                del _seeding[parent.name]
+                _seed_failed.pop(parent.name, None)
+                index.add(pending)
+                _indexes[parent.name] = index
+        logging.info(f"Loaded {len(keys)} {parent.name} keys for the integrity pre-check.")
+        return index
+
+
+def record_keys(entity_name, keys):
+    # Rows of entity_name that are now in the database.
+    with _lock:
+        index = _indexes.get(entity_name)
+        if index is not None:
+            index.add(keys)
+        elif entity_name in _seeding:
+            _seeding[entity_name].extend(keys)
+
+
+def forget_keys(entity_name):
+    # Rows of entity_name were deleted: reseed its index from the table on next use.
+    with _lock:
+        _indexes.pop(entity_name, None)
+        _seeding.pop(entity_name, None)
+        _seed_failed.pop(entity_name, None)
+
+
+def _relationships(entity):
+    from fedpipeline.entities import ENTITIES
+    return [
+        (entity.columns.index(column), column, ENTITIES[parent])
+        for column, parent in entity.foreign_keys.items()
+    ]
+
+
+def _missing_parents(row, checks):
+    missing = []
+    for position, column, parent, index in checks:
+        key = _as_key(row[position])
+        if key is not None and key not in index:
+            missing.append((column, parent.name))
+    return missing
+
+
+def _checks(entity):
+    # Caller must not hold _lock.
+    return [
+        (position, column, parent, index)
+        for position, column, parent in _relationships(entity)
+        for index in [_parent_index(parent)] if index is not None
+    ]
+
+
+def split_orphans(entity, rows):
+    # Returns (rows safe to send, [(row, [(column, parent), ...]), ...]).
+    if not INTEGRITY_CONFIG["ENABLED"] or not entity.foreign_keys or not rows:
+        return rows, []
+    checks = _checks(entity)
+    if not checks:
+        return rows, []
+    with _lock:
+        ready, orphans = [], []
+        for row in rows:
+            missing = _missing_parents(row, checks)
+            if missing:
+                orphans.append((row, missing))
+            else:
+                ready.append(row)
+    return ready, orphans
+
+
+def park(entity_name, orphans):
+    if not orphans:
+        return
+    now = time.time()
+    with _lock:
+        for _, missing in orphans:
+            for column, parent in missing:
+                key = (entity_name, column, parent)
+                ORPHAN_STATS[key] = ORPHAN_STATS.get(key, 0) + 1
+        store = _connect()
+        store.executemany(
+            "INSERT OR REPLACE INTO orphans (entity, ereserve_id, row, missing, parked_at) VALUES (?, ?, ?, ?, ?)",
+            [
+                (entity_name, row[0], json.dumps(list(row), default=str),
+                 "," + ",".join(parent for _, parent in missing) + ",", now)
+                for row, missing in orphans
+            ],
+        )
+        store.commit()
+    counts = {}
+    for _, missing in orphans:
+        for column, parent in missing:
+            counts[f"{column}->{parent}"] = counts.get(f"{column}->{parent}", 0) + 1
+    logging.warning(
+        f"{entity_name}: parked {len(orphans)} rows whose parents haven't loaded yet "
+        f"({', '.join(f'{name}: {count}' for name, count in counts.items())})."
+    )
+
+
+def release_ready(entity):
+    # Parked rows whose parents have all arrived, plus any parked longer than
+    # MAX_PARK_HOURS (the database gets the final say on those). They stay
+    # parked until resolve() confirms the load. Rows come back as stored in
+    # JSON (timestamps as strings), so coerce them again before loading.
+    with _lock:
+        parked = _connect().execute(
+            "SELECT row, parked_at FROM orphans WHERE entity = ?", (entity.name,)
+        ).fetchall()
+    if not parked:
+        return []
+    checks = _checks(entity)
+    with _lock:
+        expired = time.time() - INTEGRITY_CONFIG["MAX_PARK_HOURS"] * 3600
+        released = []
+        for row_json, parked_at in parked:
+            row = tuple(json.loads(row_json))
+            if parked_at < expired or not _missing_parents(row, checks):
+                released.append(row)
+    if released:
+        logging.info(f"{entity.name}: releasing {len(released)} of {len(parked)} parked rows.")
+    return released
+
+
+def resolve(entity_name, keys):
+    # These keys reached the database (or were refused by it): unpark them.
+    with _lock:
+        store = _connect()
+        if store.execute("SELECT 1 FROM orphans WHERE entity = ? LIMIT 1", (entity_name,)).fetchone() is None:
+            return
+        store.executemany("DELETE FROM orphans WHERE entity = ? AND ereserve_id = ?", ((entity_name, k) for k in keys))
+        store.commit()
+
+
+def parked_counts():
+    with _lock:
+        return dict(_connect().execute("SELECT entity, COUNT(*) FROM orphans GROUP BY entity").fetchall())
+
+
+def children_waiting_on(parent_name):
+    with _lock:
+        rows = _connect().execute(
+            "SELECT DISTINCT entity FROM orphans WHERE missing LIKE ?", (f"%,{parent_name},%",)
+        ).fetchall()
+    return [entity for entity, in rows]
+
+
+def orphan_stats():
+    with _lock:
+        return dict(ORPHAN_STATS)
+
+
+register_collector(lambda: (
+    "fedpipeline_orphan_rows_total", "counter", "Child rows parked because a referenced parent wasn't loaded yet.",
+    orphan_stats(), ("entity", "column", "parent"),
+))
+register_collector(lambda: (
+    "fedpipeline_orphan_rows_parked", "gauge", "Orphan rows currently waiting for their parents.",
+    {(entity,): count for entity, count in parked_counts().items()}, ("entity",),
+))
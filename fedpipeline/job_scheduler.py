@@ -1,85 +1,198 @@
 import logging
+import random
 import schedule
 import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-from fedpipeline.api_handler import get_token, fetch_data_from_api
-from fedpipeline.db_handler import insert_records
-from fedpipeline.config import API_CONFIG
+from fedpipeline.api_handler import get_token
+from fedpipeline.config import SCHEDULER_CONFIG, RECONCILE_CONFIG
+from fedpipeline.dag import run_graph
+from fedpipeline.entities import ENTITIES, entity_parents
+from fedpipeline.integrity import children_waiting_on
+from fedpipeline.metrics import register_collector
+from fedpipeline.profiling import profile_cycle
+from fedpipeline.reconcile import reconcile_all
 
 
-def run_entity_job(name, url, format_fn, query):
+def job():
+    logging.info("Starting scheduled job...")
+
     try:
         token = get_token()
         if not token:
-            logging.error(f"Skipping {name} job: Missing token.")
+            logging.error("Job aborted: Missing token.")
             return
 
-        items = fetch_data_from_api(url, token)
-        if items is None:
-            logging.error(f"Skipping {name} job: API returned None.")
-            return
+        from fedpipeline import jobs
 
-        formatted = [format_fn(i) for i in items]
-        insert_records(query, formatted, name)
-        logging.info(f"{name} job completed successfully. {len(formatted)} records inserted.")
+        # Each entity job runs in its own try-except inside run_graph to isolate failures
+        tasks = {
+            name: (lambda entity=entity: jobs.sync_entity(entity, token))
+            for name, entity in ENTITIES.items()
+        }
+        start = time.perf_counter()
+        with profile_cycle():
+            timings = run_graph(tasks, entity_parents())
+        for name, elapsed in timings.items():
+            logging.info(f"{name} job completed in {elapsed:.2f}s.")
+        logging.info(f"Scheduled job finished in {time.perf_counter() - start:.2f}s.")
 
     except Exception as e:
-        logging.exception(f"Error occurred during {name} job: {str(e)}")
+        logging.exception(f"Unexpected error in job(): {str(e)}")
 
 
-def job():
-    logging.info("Starting scheduled job...")
+# Per-entity schedule used in adaptive mode, exposed for metrics.
+SCHEDULE = {}
 
-    try:
-        token = get_token()
-        if not token:
-            logging.error("Job aborted: Missing token.")
-            return
 
-        from fedpipeline.jobs import (
-            process_integration_users,
-            process_schools,
-            process_readings,
-            process_units,
-            process_teaching_sessions,
-            process_reading_lists,
-            process_reading_list_items,
-            process_reading_list_usage,
-            process_reading_list_item_usage,
-            process_reading_utilisation,
-            process_unit_offerings
+def _jittered(seconds, rng):
+    jitter = SCHEDULER_CONFIG["JITTER"]
+    return seconds * rng.uniform(1 - jitter, 1 + jitter)
+
+
+def initial_schedule(now, rng=random):
+    # Every entity starts at its minimum interval, first runs spread over it
+    # so they don't all hit the API in the same second.
+    plan = {}
+    for name in ENTITIES:
+        low, high = SCHEDULER_CONFIG["INTERVALS"].get(
+            name, (SCHEDULER_CONFIG["MIN_INTERVAL_SECONDS"], SCHEDULER_CONFIG["MAX_INTERVAL_SECONDS"])
         )
+        plan[name] = {
+            "min": low, "max": high, "interval": low, "next_run": now + rng.uniform(0, low),
+            "running": False, "pending": False, "coalesced": 0, "runs": 0, "last_changes": None,
+        }
+    return plan
 
-        # Wrap each call in try-except to isolate failures
-        for process_fn in [
-            process_integration_users,
-            process_schools,
-            process_readings,
-            process_units,
-            process_teaching_sessions,
-            process_reading_lists,
-            process_reading_list_items,
-            process_reading_list_usage,
-            process_reading_list_item_usage,
-            process_reading_utilisation,
-            process_unit_offerings
-        ]:
-            try:
-                process_fn(token)
-                logging.info(f"{process_fn.__name__} execution completed.")
-            except Exception as e:
-                logging.exception(f"Error in {process_fn.__name__}: {str(e)}")
 
-    except Exception as e:
-        logging.exception(f"Unexpected error in job(): {str(e)}")
+def next_interval(state, changes):
+    # Narrow the interval while an entity keeps changing, widen it while it
+    # is quiet. A failed run (changes is None) keeps the current interval.
+    if changes is None:
+        return state["interval"]
+    factor = SCHEDULER_CONFIG["SPEEDUP"] if changes else SCHEDULER_CONFIG["BACKOFF"]
+    return min(state["max"], max(state["min"], state["interval"] * factor))
+
+
+def due_entities(plan, now, parents):
+    # Due, not already running, and no parent mid-load: a child never writes
+    # while rows it may reference are still being loaded.
+    return [
+        name for name, state in plan.items()
+        if state["next_run"] <= now and not state["running"]
+        and not any(plan[parent]["running"] for parent in parents.get(name, ()))
+    ]
+
+
+def finish_run(plan, name, stats, now, parents, rng=random):
+    state = plan[name]
+    # A run whose load failed tells us nothing about the change rate.
+    changes = stats["load"]["rows"] if stats and not stats.get("failed") else None
+    state["running"] = False
+    state["runs"] += 1
+    state["last_changes"] = changes
+    state["interval"] = next_interval(state, changes)
+    # The next run counts from when this one finished, so a slow run delays
+    # its successor instead of letting runs pile up behind it.
+    state["next_run"] = now + _jittered(state["interval"], rng)
+    if state["pending"]:
+        # Something came due for it during the run (e.g. a child's rejections): go again now.
+        state["pending"] = False
+        state["next_run"] = now
+    if stats and stats.get("rejected"):
+        # Rejected rows are usually children of parents we haven't loaded
+        # yet; bring the parents forward rather than wait out their interval.
+        for parent in parents.get(name, ()):
+            plan[parent]["next_run"] = min(plan[parent]["next_run"], now)
+    if changes:
+        # New parent rows may be what parked orphan rows are waiting for.
+        for child in children_waiting_on(name):
+            if child in plan:
+                plan[child]["next_run"] = min(plan[child]["next_run"], now)
+    logging.info(
+        f"{name}: {changes if changes is not None else 'failed'} changes, "
+        f"next run in {state['next_run'] - now:.0f}s (interval {state['interval']:.0f}s)."
+    )
+
+
+def run_entity(name):
+    token = get_token()
+    if not token:
+        logging.error(f"Skipping {name} job: Missing token.")
+        return None
+    from fedpipeline.jobs import sync_entity
+    with profile_cycle(name):
+        return sync_entity(ENTITIES[name], token)
+
+
+def run_adaptive(stop=None, now=time.monotonic, rng=random):
+    # Run each entity on its own, self-adjusting interval. At most one run per
+    # entity is in flight: its next_run is cleared while it runs, and a run
+    # brought forward meanwhile is coalesced into one that starts as soon as
+    # it finishes. stop() ends the loop (tests).
+    parents = entity_parents()
+    SCHEDULE.clear()
+    SCHEDULE.update(initial_schedule(now(), rng))
+    running = {}
+    # Reconciliation runs on its own, much slower clock, first after one interval.
+    reconcile = {"next_run": now() + RECONCILE_CONFIG["INTERVAL_SECONDS"], "future": None}
+    with ThreadPoolExecutor(max_workers=SCHEDULER_CONFIG["MAX_WORKERS"]) as pool:
+        while not (stop and stop()):
+            current = now()
+            if RECONCILE_CONFIG["ENABLED"] and reconcile["future"] is None and reconcile["next_run"] <= current:
+                reconcile["future"] = pool.submit(reconcile_all)
+            if reconcile["future"] is not None and reconcile["future"].done():
+                reconcile["future"] = None
+                reconcile["next_run"] = now() + RECONCILE_CONFIG["INTERVAL_SECONDS"]
+            for name, state in SCHEDULE.items():
+                if state["running"] and state["next_run"] <= current:
+                    state["coalesced"] += 1
+                    state["pending"] = True
+                    state["next_run"] = float("inf")
+            for name in due_entities(SCHEDULE, current, parents):
+                SCHEDULE[name]["running"] = True
+                SCHEDULE[name]["next_run"] = float("inf")
+                running[pool.submit(run_entity, name)] = name
+
+            waits = [state["next_run"] - current for state in SCHEDULE.values() if not state["running"]]
+            timeout = min([1.0] + [max(0.0, w) for w in waits])
+            if running:
+                finished, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+            else:
+                finished = ()
+                time.sleep(timeout)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    stats = future.result()
+                except Exception as e:
+                    logging.exception(f"Error occurred during {name} job: {e}")
+                    stats = None
+                finish_run(SCHEDULE, name, stats, now(), parents, rng)
+    return SCHEDULE
+
+
+register_collector(lambda: (
+    "fedpipeline_schedule_interval_seconds", "gauge", "Current adaptive refresh interval per entity.",
+    {(name,): state["interval"] for name, state in list(SCHEDULE.items())}, ("entity",),
+))
 
 
 def start_scheduler():
     try:
-        schedule.every(1).minutes.do(job)
-        logging.info("Scheduler started. Waiting for job trigger...")
-        while True:
-            schedule.run_pending()
-            time.sleep(1)
+        if SCHEDULER_CONFIG["MODE"] == "cycle":
+            schedule.every(1).minutes.do(job)
+            if RECONCILE_CONFIG["ENABLED"]:
+                schedule.every(RECONCILE_CONFIG["INTERVAL_SECONDS"]).seconds.do(reconcile_all)
+            logging.info("Scheduler started. Waiting for job trigger...")
+            while True:
+                schedule.run_pending()
+                time.sleep(1)
+        else:
+            # One full FK-ordered pass first, so children never start ahead of
+            # their parents on a fresh database; then every entity on its own.
+            logging.info("Scheduler started in adaptive mode.")
+            job()
+            run_adaptive()
     except Exception as e:
         logging.exception(f"Scheduler crashed: {str(e)}")
@@ -1,302 +1,223 @@
 import logging
-from fedpipeline.api_handler import fetch_data_from_api
-from fedpipeline.db_handler import insert_records
-from fedpipeline.config import API_CONFIG
+from itertools import chain
+from fedpipeline import deadletter, http_cache
+from fedpipeline.api_handler import iter_api_pages
+from fedpipeline.db_handler import load_records
+from fedpipeline.config import SYNC_CONFIG, FINGERPRINT_CONFIG, SPOOL_CONFIG, DEADLETTER_CONFIG
+from fedpipeline.dag import wait_for_parents
+from fedpipeline.entities import ENTITIES
+from fedpipeline.fingerprints import filter_changed, record_loaded, fingerprint_stats
+from fedpipeline.integrity import split_orphans, park, release_ready, record_keys, resolve
+from fedpipeline.metrics import timed, ROWS
+from fedpipeline.pipeline import run_pipeline
+from fedpipeline.schema import coerce_rows
+from fedpipeline.spool import Spool
+from fedpipeline.state import (
+    get_watermark, save_watermark, since_params, filter_since, compute_watermark, parse_timestamp
+)
+
+
+def fetch_changes(entity_name, url, token, watermark=None):
+    # Yield pages of records past the watermark (every record when there is none).
+    fetched = kept = 0
+    hits = http_cache.http_cache_stats().get(entity_name, {}).get("hits", 0)
+    for page in iter_api_pages(url, token, since_params(watermark), entity_name=entity_name, skip_unchanged=True):
+        changes = filter_since(page, watermark)
+        fetched += len(page)
+        kept += len(changes)
+        if changes:
+            yield changes
+
+    if not fetched and http_cache.http_cache_stats().get(entity_name, {}).get("hits", 0) > hits:
+        logging.info(f"{entity_name} unchanged since the last load (HTTP 304); skipping transform and load.")
+    elif not kept:
+        logging.warning(f"No {entity_name} data fetched.")
+    elif watermark:
+        logging.info(f"{entity_name}: {kept} of {fetched} fetched records are past the watermark.")
+
+
+def _position(watermark):
+    updated_at, ereserve_id = watermark
+    return updated_at, ereserve_id or 0
+
+
+def sync_entity(entity, token):
+    # Stream one entity through the fetch -> transform -> load pipeline. The
+    # watermark is only saved once every page loaded and the fetch completed.
+    # Fetched pages are spooled to disk first, so a failure part-way reloads
+    # them from the spool next run instead of re-reading the whole delta.
+    spool = None
+    try:
+        incremental = SYNC_CONFIG["INCREMENTAL"]
+        fingerprinting = FINGERPRINT_CONFIG["ENABLED"]
+        watermark = get_watermark(entity.name) if incremental else None
+        progress = {"advanced": watermark, "failed": False, "rejected": 0, "invalid": 0, "parked": 0, "holds": []}
+        http_cache.discard(entity.name)  # leftovers of a run that died part-way
+
+        def hold(items, keys):
+            # Without the dead-letter store a rejected row is only fetched
+            # again if the watermark stays behind it: note just before it.
+            if DEADLETTER_CONFIG["ENABLED"] or not keys:
+                return
+            keys = {str(key) for key in keys}
+            for item in items:
+                updated_at = parse_timestamp(item.get("updated_at"))
+                if updated_at is not None and str(item.get("id")) in keys:
+                    progress["holds"].append((updated_at, (item.get("id") or 0) - 1))
+
+        def transform(items):
+            with timed("transform", entity.name):
+                rejects = []
+                rows, invalid = coerce_rows(entity, entity.project(items), rejects)
+                progress["invalid"] += invalid
+                deadletter.record(entity, deadletter.coercion_failures(rejects), items=items)
+                hold(items, [key for key, _ in rejects])
+                if fingerprinting:
+                    rows = filter_changed(entity.name, rows)
+            ROWS.inc(len(rows), entity=entity.name, stage="transform")
+            return rows
+
+        def send(rows, items=()):
+            stats = load_records(entity.insert_sql, rows, entity.name)
+            if (stats or {}).get("failed"):
+                progress["failed"] = True
+                return None
+            progress["rejected"] += stats.get("rejected", 0)
+            rejected = set(stats.get("rejected_ids", ()))
+            if fingerprinting:
+                record_loaded(entity.name, rows, rejected)
+            loaded = [row[0] for row in rows if row[0] not in rejected]
+            record_keys(entity.name, loaded)
+            resolve(entity.name, [row[0] for row in rows])
+            # Rejected rows keep their payload for replay; a row that loads now is no longer one.
+            deadletter.record(entity, deadletter.load_failures(stats), items=items, rows=rows)
+            hold(items, stats.get("rejected_ids", ()))
+            deadletter.resolve(entity.name, loaded)
+            return stats
+
+        def load(formatted, items):
+            if progress["failed"]:
+                # SQL Server is down: the rest of the run only fills the spool.
+                return
+            if formatted:
+                # Under the entity graph, hold the write until parent tables have committed.
+                wait_for_parents(entity.name)
+                # Rows referencing parents that aren't loaded yet wait in the orphan queue.
+                formatted, orphans = split_orphans(entity, formatted)
+                park(entity.name, orphans)
+                progress["parked"] += len(orphans)
+            if formatted and send(formatted, items) is None:
+                return
+            progress["advanced"] = compute_watermark(items, progress["advanced"])
+            if spool is not None and not progress["failed"]:
+                spool.commit()
+
+        pages = None
+        if SPOOL_CONFIG["ENABLED"]:
+            spool = Spool(entity.name)
+            if spool.pending():
+                logging.info(f"{entity.name}: resuming from pages spooled by an interrupted run.")
+                pages = spool.replay()
+            if pages is None or not spool.state["fetch_complete"]:
+                spool.start()
+                fetched = spool.record(fetch_changes(entity.name, entity.url, token, watermark))
+                pages = fetched if pages is None else chain(pages, fetched)
+        else:
+            pages = fetch_changes(entity.name, entity.url, token, watermark)
+        stats = run_pipeline(entity.name, pages, transform, load)
+        if not stats["errors"] and not progress["failed"]:
+            parked = release_ready(entity)
+            rejects = []
+            released, invalid = coerce_rows(entity, parked, rejects)
+            if invalid:
+                # Rows that can never load don't stay parked.
+                progress["invalid"] += invalid
+                keep = {row[0] for row in released}
+                dropped = [row for row in parked if row[0] not in keep]
+                deadletter.record(entity, deadletter.coercion_failures(rejects), rows=dropped)
+                resolve(entity.name, [row[0] for row in dropped])
+            if released:
+                wait_for_parents(entity.name)
+                send(released)
+        # Rows refused by type coercion count as rejected, like the database's refusals.
+        progress["rejected"] += progress["invalid"]
+        stats["rejected"] = progress["rejected"]
+        stats["parked"] = progress["parked"]
+        # The load itself failed (SQL Server unreachable): "rows" says nothing about the source.
+        stats["failed"] = progress["failed"]
+        advanced = progress["advanced"]
+        if advanced and progress["holds"] and min(progress["holds"]) < _position(advanced):
+            advanced = min(progress["holds"])
+            logging.warning(f"{entity.name}: watermark held before rejected rows so they are fetched again.")
+        complete = not stats["errors"] and not progress["failed"]
+        moved = advanced and (not watermark or _position(advanced) > _position(watermark))
+        if incremental and complete and moved:
+            save_watermark(entity.name, advanced)
+        if spool is not None and complete:
+            spool.clear()
+        if complete and DEADLETTER_CONFIG["REPLAY_ON_SYNC"]:
+            # Rows rejected by earlier runs whose retry is due; the cause may be fixed by now.
+            stats["replayed"] = deadletter.replay_entity(entity)["loaded"]
+        # Pages become revalidatable (304 -> skipped) only once every row on them is
+        # in, or the rows that aren't wait in the dead-letter store (as in hold()).
+        if complete and (DEADLETTER_CONFIG["ENABLED"] or not progress["rejected"]):
+            http_cache.commit(entity.name)
+        else:
+            http_cache.discard(entity.name)
+        if fingerprinting and entity.name in fingerprint_stats():
+            counts = fingerprint_stats()[entity.name]
+            logging.info(
+                f"{entity.name} change detection: {counts['hits']} unchanged skipped, "
+                f"{counts['misses']} new or changed ({counts['hit_ratio']:.1%} hit ratio)."
+            )
+        return stats
+    except Exception as e:
+        logging.error(f"Error processing {entity.name} data: {e}")
+    finally:
+        if spool is not None:
+            spool.close()
 
 
+# Named entry points for each entity, kept for callers that run one table.
 def process_integration_users(token):
-    try:
-        users = fetch_data_from_api(API_CONFIG["INTEGRATION_USERS_URL"], token)
-        if not users:
-            logging.warning("No IntegrationUser data fetched.")
-            return
-        formatted = [
-            (
-                item.get("id"),
-                item.get("identifier"),
-                item.get("roles"),
-                item.get("first_name"),
-                item.get("last_name"),
-                item.get("email"),
-                item.get("lti_consumer_user_id"),
-                item.get("lti_lis_person_sourcedid"),
-                item.get("created_at"),
-                item.get("updated_at")
-            ) for item in users
-        ]
-        query = """
-            INSERT INTO IntegrationUser (
-                ereserve_id, identifier, roles, first_name, last_name, email,
-                lti_consumer_user_id, lti_lis_person_sourcedid, created_at, updated_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """
-        insert_records(query, formatted, "IntegrationUser")
-    except Exception as e:
-        logging.error(f"Error processing IntegrationUser data: {e}")
+    return sync_entity(ENTITIES["IntegrationUser"], token)
 
 
 def process_schools(token):
-    try:
-        schools = fetch_data_from_api(API_CONFIG["SCHOOLS_URL"], token)
-        if not schools:
-            logging.warning("No School data fetched.")
-            return
-        formatted = [(item.get("id"), item.get("name")) for item in schools]
-        query = "INSERT INTO School (ereserve_id, name) VALUES (?, ?)"
-        insert_records(query, formatted, "School")
-    except Exception as e:
-        logging.error(f"Error processing School data: {e}")
+    return sync_entity(ENTITIES["School"], token)
 
 
 def process_readings(token):
-    try:
-        readings = fetch_data_from_api(API_CONFIG["READINGS_URL"], token)
-        if not readings:
-            logging.warning("No Reading data fetched.")
-            return
-        formatted = [
-            (
-                item.get("id"),
-                item.get("reading_title"),
-                item.get("genre"),
-                item.get("source_document_title"),
-                item.get("article_number"),
-                item.get("created_at"),
-                item.get("updated_at")
-            ) for item in readings
-        ]
-        query = """
-            INSERT INTO Reading (
-                ereserve_id, reading_title, genre, source_document_title,
-                article_number, created_at, updated_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?)
-        """
-        insert_records(query, formatted, "Reading")
-    except Exception as e:
-        logging.error(f"Error processing Reading data: {e}")
+    return sync_entity(ENTITIES["Reading"], token)
 
 
 def process_units(token):
-    try:
-        units = fetch_data_from_api(API_CONFIG["UNITS_URL"], token)
-        if not units:
-            logging.warning("No Unit data fetched.")
-            return
-        formatted = [(item.get("id"), item.get("code"), item.get("name")) for item in units]
-        query = "INSERT INTO Unit (ereserve_id, code, name) VALUES (?, ?, ?)"
-        insert_records(query, formatted, "Unit")
-    except Exception as e:
-        logging.error(f"Error processing Unit data: {e}")
+    return sync_entity(ENTITIES["Unit"], token)
 
 
 def process_unit_offerings(token):
-    try:
-        offerings = fetch_data_from_api(API_CONFIG["UNIT_OFFERINGS_URL"], token)
-        if not offerings:
-            logging.warning("No UnitOffering data fetched.")
-            return
-        formatted = [
-            (
-                item.get("id"),
-                item.get("unit_id"),
-                item.get("reading_list_id"),
-                item.get("source_unit_code"),
-                item.get("source_unit_name"),
-                item.get("source_unit_offering"),
-                item.get("result"),
-                item.get("list_publication_method"),
-                item.get("created_at"),
-                item.get("updated_at")
-            ) for item in offerings
-        ]
-        query = """
-            INSERT INTO UnitOffering (
-                ereserve_id, unit_id, reading_list_id, source_unit_code,
-                source_unit_name, source_unit_offering, result,
-                list_publication_method, created_at, updated_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """
-        insert_records(query, formatted, "UnitOffering")
-    except Exception as e:
-        logging.error(f"Error processing UnitOffering data: {e}")
+    return sync_entity(ENTITIES["UnitOffering"], token)
 
 
 def process_teaching_sessions(token):
-    try:
-        sessions = fetch_data_from_api(API_CONFIG["TEACHING_SESSIONS_URL"], token)
-        if not sessions:
-            logging.warning("No TeachingSession data fetched.")
-            return
-        formatted = [
-            (
-                item.get("id"),
-                item.get("name"),
-                item.get("start_date"),
-                item.get("end_date"),
-                item.get("archived"),
-                item.get("created_at"),
-                item.get("updated_at")
-            ) for item in sessions
-        ]
-        query = """
-            INSERT INTO TeachingSession (
-                ereserve_id, name, start_date, end_date,
-                archived, created_at, updated_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?)
-        """
-        insert_records(query, formatted, "TeachingSession")
-    except Exception as e:
-        logging.error(f"Error processing TeachingSession data: {e}")
+    return sync_entity(ENTITIES["TeachingSession"], token)
 
 
 def process_reading_lists(token):
-    try:
-        lists = fetch_data_from_api(API_CONFIG["READING_LISTS_URL"], token)
-        if not lists:
-            logging.warning("No ReadingList data fetched.")
-            return
-        formatted = [
-            (
-                item.get("id"),
-                item.get("unit_id"),
-                item.get("teaching_session_id"),
-                item.get("name"),
-                item.get("duration"),
-                item.get("start_date"),
-                item.get("end_date"),
-                item.get("hidden"),
-                item.get("usage_count"),
-                item.get("item_count"),
-                item.get("approved_item_count"),
-                item.get("deleted"),
-                item.get("created_at"),
-                item.get("updated_at")
-            ) for item in lists
-        ]
-        query = """
-            INSERT INTO ReadingList (
-                ereserve_id, unit_id, teaching_session_id, name, duration,
-                start_date, end_date, hidden, usage_count, item_count,
-                approved_item_count, deleted, created_at, updated_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """
-        insert_records(query, formatted, "ReadingList")
-    except Exception as e:
-        logging.error(f"Error processing ReadingList data: {e}")
+    return sync_entity(ENTITIES["ReadingList"], token)
 
 
 def process_reading_list_items(token):
-    try:
-        items = fetch_data_from_api(API_CONFIG["READING_LIST_ITEMS_URL"], token)
-        if not items:
-            logging.warning("No ReadingListItem data fetched.")
-            return
-        formatted = [
-            (
-                item.get("id"),
-                item.get("list_id"),
-                item.get("reading_id"),
-                item.get("status"),
-                item.get("hidden"),
-                item.get("reading_utilisations_count"),
-                item.get("reading_importance"),
-                item.get("usage_count"),
-                item.get("created_at"),
-                item.get("updated_at")
-            ) for item in items
-        ]
-        query = """
-            INSERT INTO ReadingListItem (
-                ereserve_id, list_id, reading_id, status, hidden,
-                reading_utilisations_count, reading_importance,
-                usage_count, created_at, updated_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """
-        insert_records(query, formatted, "ReadingListItem")
-    except Exception as e:
-        logging.error(f"Error processing ReadingListItem data: {e}")
+    return sync_entity(ENTITIES["ReadingListItem"], token)
 
 
 def process_reading_list_usage(token):
-    try:
-        usages = fetch_data_from_api(API_CONFIG["READING_LIST_USAGE_URL"], token)
-        if not usages:
-            logging.warning("No ReadingListUsage data fetched.")
-            return
-        formatted = [
-            (
-                item.get("id"),
-                item.get("list_id"),
-                item.get("integration_user_id"),
-                item.get("item_usage_count"),
-                item.get("list_publication_method"),
-                item.get("created_at"),
-                item.get("updated_at")
-            ) for item in usages
-        ]
-        query = """
-            INSERT INTO ReadingListUsage (
-                ereserve_id, list_id, integration_user_id,
-                item_usage_count, list_publication_method,
-                created_at, updated_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?)
-        """
-        insert_records(query, formatted, "ReadingListUsage")
-    except Exception as e:
-        logging.error(f"Error processing ReadingListUsage data: {e}")
+    return sync_entity(ENTITIES["ReadingListUsage"], token)
 
 
 def process_reading_list_item_usage(token):
-    try:
-        usages = fetch_data_from_api(API_CONFIG["READING_LIST_ITEM_USAGE_URL"], token)
-        if not usages:
-            logging.warning("No ReadingListItemUsage data fetched.")
-            return
-        formatted = [
-            (
-                item.get("id"),
-                item.get("item_id"),
-                item.get("list_usage_id"),
-                item.get("integration_user_id"),
-                item.get("utilisation_count"),
-                item.get("created_at"),
-                item.get("updated_at")
-            ) for item in usages
-        ]
-        query = """
-            INSERT INTO ReadingListItemUsage (
-                ereserve_id, item_id, list_usage_id,
-                integration_user_id, utilisation_count,
-                created_at, updated_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?)
-        """
-        insert_records(query, formatted, "ReadingListItemUsage")
-    except Exception as e:
-        logging.error(f"Error processing ReadingListItemUsage data: {e}")
+    return sync_entity(ENTITIES["ReadingListItemUsage"], token)
 
 
 def process_reading_utilisation(token):
-    try:
-        utilisations = fetch_data_from_api(API_CONFIG["READING_UTILISATION_URL"], token)
-        if not utilisations:
-            logging.warning("No ReadingUtilisation data fetched.")
-            return
-        formatted = [
-            (
-                item.get("id"),
-                item.get("integration_user_id"),
-                item.get("item_id"),
-                item.get("item_usage_id"),
-                item.get("created_at"),
-                item.get("updated_at")
-            ) for item in utilisations
-        ]
-        query = """
-            INSERT INTO ReadingUtilisation (
-                ereserve_id, integration_user_id, item_id,
-                item_usage_id, created_at, updated_at
-            ) VALUES (?, ?, ?, ?, ?, ?)
-        """
-        insert_records(query, formatted, "ReadingUtilisation")
-    except Exception as e:
-        logging.error(f"Error processing ReadingUtilisation data: {e}")
+    return sync_entity(ENTITIES["ReadingUtilisation"], token)
@@ -1,13 +1,28 @@
 # logger.py
 
+import atexit
 import logging
+import logging.handlers
+import queue
 
-logging.basicConfig(
-    filename="pipeline.log",
-    level=logging.INFO,
-    format="%(asctime)s | %(levelname)-8s | %(message)s",
+# Worker threads only put records on a queue; a single listener thread does
+# the file I/O, so a burst of log lines never stalls a fetch or load.
+_queue = queue.Queue(-1)
+
+_file_handler = logging.FileHandler("pipeline.log")
+_file_handler.setFormatter(logging.Formatter(
+    "%(asctime)s | %(levelname)-8s | %(message)s",
     datefmt="%Y-%m-%d %H:%M:%S",
-)
+))
+
+_queue_handler = logging.handlers.QueueHandler(_queue)
+
+logging.basicConfig(level=logging.INFO, handlers=[_queue_handler])
+
+listener = logging.handlers.QueueListener(_queue, _file_handler, respect_handler_level=True)
+listener.start()
+# Flush whatever is still queued when the process exits.
+atexit.register(listener.stop)
 
 # Export a logger instance for use elsewhere
-logger = logging.getLogger("fedpipeline")
\ No newline at end of file
+logger = logging.getLogger("fedpipeline")
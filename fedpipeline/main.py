@@ -7,15 +7,136 @@ Description:
 
     This script initializes logging and starts the job scheduler that periodically
     fetches data from the eReserve API and inserts it into the SQL Server database.
+
+    Usage:
+        python -m fedpipeline.main                  # run the scheduler
+        python -m fedpipeline.main resync <Entity>  # force a full resync of one entity
+        python -m fedpipeline.main rebuild-fingerprints [Entity ...]
+                                                    # rebuild the change-detection cache from the DB
+        python -m fedpipeline.main reconcile [--dry-run] [Entity ...]
+                                                    # remove rows deleted upstream
+        python -m fedpipeline.main full-refresh [Entity ...]
+                                                    # reload tables via shadow copies and a swap
+        python -m fedpipeline.main rebuild-aggregates
+                                                    # recompute the usage summary tables
+        python -m fedpipeline.main migrate [--dry-run]
+                                                    # apply pending schema migrations
+        python -m fedpipeline.main replay-dead-letters [--force] [Entity ...]
+                                                    # retry rejected rows kept in the dead-letter store
 -------------------------------------------------------------------------------
 """
+import argparse
 import logging
 from fedpipeline.logger import logger
 from fedpipeline.job_scheduler import start_scheduler
+from fedpipeline.aggregates import rebuild_aggregates
+from fedpipeline.config import MIGRATIONS_CONFIG
+from fedpipeline.deadletter import replay
+from fedpipeline.entities import ENTITIES
+from fedpipeline.fingerprints import clear_fingerprints, rebuild_from_database
+from fedpipeline.http_cache import clear_http_cache
+from fedpipeline.metrics import start_metrics
+from fedpipeline.migrations import migrate
+from fedpipeline.profiling import install_profiling
+from fedpipeline.reconcile import reconcile_all
+from fedpipeline.refresh import full_refresh
+from fedpipeline.spool import Spool
+from fedpipeline.state import reset_watermark
+
+
+def entity_name(value):
+    if value not in ENTITIES:
+        raise argparse.ArgumentTypeError(f"unknown entity {value!r} (choose from {', '.join(sorted(ENTITIES))})")
+    return value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="fedpipeline", description="eReserve data pipeline")
+    commands = parser.add_subparsers(dest="command")
+    resync = commands.add_parser("resync", help="Clear an entity's sync watermark so its next run is a full refresh")
+    resync.add_argument("entity", type=entity_name, help="Entity/table name, e.g. ReadingList")
+    rebuild = commands.add_parser("rebuild-fingerprints", help="Rebuild the row change-detection cache from the database")
+    rebuild.add_argument("entities", nargs="*", type=entity_name, help="Entities to rebuild (default: all)")
+    reconcile = commands.add_parser("reconcile", help="Remove rows the API no longer returns, children first")
+    reconcile.add_argument("entities", nargs="*", type=entity_name, help="Entities to reconcile (default: all)")
+    reconcile.add_argument("--dry-run", action="store_true", help="Report the differences without deleting")
+    refresh = commands.add_parser(
+        "full-refresh", help="Reload tables from scratch into shadow copies and swap them in (replaces delete_data.sql)"
+    )
+    refresh.add_argument(
+        "entities", nargs="*", type=entity_name, help="Entities to refresh, with their dependents (default: all)"
+    )
+    commands.add_parser("rebuild-aggregates", help="Recompute the usage summary tables from the base tables")
+    migrations = commands.add_parser("migrate", help="Apply pending schema migrations")
+    migrations.add_argument("--dry-run", action="store_true", help="List pending migrations without applying them")
+    dead_letters = commands.add_parser("replay-dead-letters", help="Retry rejected rows kept in the dead-letter store")
+    dead_letters.add_argument("entities", nargs="*", type=entity_name, help="Entities to replay (default: all)")
+    dead_letters.add_argument(
+        "--force", action="store_true", help="Retry every row now, ignoring retry spacing and MAX_ATTEMPTS"
+    )
+    args = parser.parse_args(argv)
+
+    if args.command == "resync":
+        # Forget the watermark, the row fingerprints and the cached pages, or
+        # the resync would skip every row; spooled pages of the old delta go too.
+        clear_fingerprints(args.entity)
+        clear_http_cache(args.entity)
+        Spool(args.entity).clear()
+        return 0 if reset_watermark(args.entity) else 1
+
+    if args.command == "rebuild-fingerprints":
+        for name in args.entities or ENTITIES:
+            report = rebuild_from_database(ENTITIES[name])
+            print(f"{name}: {report['rows']} rows, {report['matched']} matched, "
+                  f"{report['stale']} stale, {report['missing_in_db']} missing in DB")
+        return 0
+
+    if args.command == "reconcile":
+        reports = reconcile_all(args.entities, dry_run=args.dry_run)
+        for name, report in reports.items():
+            print(f"{name}: {report['stale']} gone upstream, {report['removed']} removed, "
+                  f"{report['blocked']} still referenced{', skipped (over limit)' if report['skipped'] else ''}")
+        return 0 if reports and len(reports) == len(args.entities or ENTITIES) else 1
+
+    if args.command == "migrate":
+        result = migrate(dry_run=args.dry_run)
+        print(f"Schema version {result['current']}; applied {result['applied'] or 'nothing'}, "
+              f"pending {result['pending'] or 'nothing'}.")
+        return 1 if result["pending"] and not args.dry_run else 0
+
+    if args.command == "rebuild-aggregates":
+        rebuilt = rebuild_aggregates()
+        for table, rows in rebuilt.items():
+            print(f"{table}: {rows} rows")
+        return 0 if rebuilt else 1
+
+    if args.command == "replay-dead-letters":
+        reports = replay(args.entities, force=args.force)
+        for name, report in reports.items():
+            print(f"{name}: {report['retried']} retried, {report['loaded']} loaded, {report['failed']} failed again")
+        if not reports:
+            print("No dead letters due.")
+        return 0 if all(not report["failed"] for report in reports.values()) else 1
+
+    if args.command == "full-refresh":
+        result = full_refresh(args.entities)
+        for name, report in result["entities"].items():
+            print(f"{name}: {report['rows']} rows (was {report['live_rows']}), {report['rejected']} rejected, "
+                  f"{report['orphans']} orphaned")
+        print("Swapped into place." if result["swapped"] else "Not swapped; live tables unchanged.")
+        return 0 if result["swapped"] else 1
 
-if __name__ == "__main__":
-    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
     logging.info("Pipeline starting...")
+    if MIGRATIONS_CONFIG["ON_STARTUP"]:
+        migrate()
+    start_metrics()
+    install_profiling()
     start_scheduler()
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    raise SystemExit(main())
 
 
@@ -0,0 +1,198 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from fedpipeline.config import METRICS_CONFIG
+
+# Minimal Prometheus-style counters and histograms. Updates are one dict
+# operation under a lock and happen per page or batch, never per row, so
+# they are cheap enough to leave on in production.
+
+_lock = threading.Lock()
+_metrics = []
+_collectors = []
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(name, "") for name in self.labels), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with _lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels):
+        series = self._values.get(tuple(labels.get(name, "") for name in self.labels))
+        return series[2] if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, observations) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                bucket = _format_labels(self.labels, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+            bucket = _format_labels(self.labels, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket} {observations}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {observations}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "fedpipeline_stage_duration_seconds", "Time spent per pipeline stage call.", ("entity", "stage")
+)
+ROWS = Counter("fedpipeline_rows_total", "Rows handled per pipeline stage.", ("entity", "stage"))
+BYTES = Counter("fedpipeline_bytes_total", "Response bytes received from the API.", ("entity",))
+ERRORS = Counter("fedpipeline_errors_total", "Failures and rejected rows per pipeline stage.", ("entity", "stage"))
+
+
+def register_collector(collect):
+    # collect() returns (name, type, help, {label tuple: value}, label names)
+    # and is read at scrape time, for state that already lives elsewhere.
+    _collectors.append(collect)
+
+
+@contextmanager
+def timed(stage, entity="all"):
+    # Observe the duration of the block; an exception also counts as an error.
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.inc(entity=entity, stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, entity=entity, stage=stage)
+
+
+def render():
+    with _lock:
+        lines = []
+        for metric in _metrics:
+            lines.extend(metric.render())
+    for collect in _collectors:
+        try:
+            name, kind, documentation, values, labels = collect()
+        except Exception as e:
+            logging.error(f"Metrics collector failed: {e}")
+            continue
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {kind}")
+        for key, value in sorted(values.items()):
+            lines.append(f"{name}{_format_labels(labels, key)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path):
+    # Write atomically so node-exporter never reads a half-written file.
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, "w") as handle:
+        handle.write(render())
+    os.replace(temp, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_metrics_server(host=None, port=None):
+    server = ThreadingHTTPServer((host or METRICS_CONFIG["HOST"], METRICS_CONFIG["PORT"] if port is None else port),
+                                 _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logging.info(f"Serving metrics on http://{server.server_address[0]}:{server.server_address[1]}/metrics")
+    return server
+
+
+def start_textfile_writer(path=None, interval=None):
+    path = path or METRICS_CONFIG["TEXTFILE"]
+    interval = interval or METRICS_CONFIG["TEXTFILE_INTERVAL_SECONDS"]
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                write_textfile(path)
+            except Exception as e:
+                logging.error(f"Failed to write metrics textfile {path}: {e}")
+
+    threading.Thread(target=run, name="metrics-textfile", daemon=True).start()
+    return stop
+
+
+def start_metrics():
+    # Start whatever exposition config asks for; called once at startup.
+    if not METRICS_CONFIG["ENABLED"]:
+        return
+    try:
+        start_metrics_server()
+    except OSError as e:
+        logging.error(f"Could not start metrics server: {e}")
+    if METRICS_CONFIG["TEXTFILE"]:
+        start_textfile_writer()
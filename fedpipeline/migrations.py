@@ -0,0 +1,160 @@
+import logging
+import pyodbc
+from fedpipeline.config import MIGRATIONS_CONFIG
+from fedpipeline.db_handler import conn_str
+from fedpipeline.entities import ENTITIES
+
+# Versioned schema changes on top of sql/db.sql, applied in order at startup.
+# Every statement checks before it changes anything, so re-running a
+# migration is harmless; SchemaMigrations records which versions are in. An
+# application lock keeps two pipeline instances from migrating at once.
+
+LOCK_RESOURCE = "fedpipeline-migrations"
+USAGE_TABLES = ("ReadingListUsage", "ReadingListItemUsage", "ReadingUtilisation")
+
+_VERSION_TABLE = """
+IF OBJECT_ID('SchemaMigrations') IS NULL
+CREATE TABLE SchemaMigrations (
+    version INT PRIMARY KEY NOT NULL,
+    name NVARCHAR(200) NOT NULL,
+    applied_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME()
+)"""
+
+
+def fk_index_statements(entity, table=None):
+    # One index per FK column, so FK checks and joins on it seek.
+    table = table or entity.table
+    return [
+        f"IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_{entity.table}_{column}' "
+        f"AND object_id = OBJECT_ID('{table}')) "
+        f"CREATE INDEX IX_{entity.table}_{column} ON {table} ({column}) "
+        f"WITH (DATA_COMPRESSION = {compression(entity.table)})"
+        for column in entity.foreign_keys
+    ]
+
+
+def compression(table):
+    return MIGRATIONS_CONFIG["USAGE_COMPRESSION"] if table in USAGE_TABLES else "NONE"
+
+
+def compression_statement(table, target=None):
+    # Usage tables only grow and are read in bulk: compress them (PAGE by default).
+    target = target or table
+    kind = compression(table)
+    return (
+        f"IF EXISTS (SELECT 1 FROM sys.partitions WHERE object_id = OBJECT_ID('{target}') "
+        f"AND index_id IN (0, 1) AND data_compression_desc <> '{kind}') "
+        f"ALTER TABLE {target} REBUILD WITH (DATA_COMPRESSION = {kind})"
+    )
+
+
+def _state_tables():
+    return ["""
+IF OBJECT_ID('PipelineState') IS NULL
+CREATE TABLE PipelineState (
+    entity NVARCHAR(100) PRIMARY KEY NOT NULL,
+    last_updated_at DATETIME2,
+    last_ereserve_id INT,
+    synced_at DATETIME2 DEFAULT SYSUTCDATETIME()
+)"""]
+
+
+def _summary_tables():
+    from fedpipeline.aggregates import AGGREGATES
+    from fedpipeline.schema import table_definitions
+    definitions = table_definitions()
+    return [
+        f"IF OBJECT_ID('{aggregate.table}') IS NULL "
+        f"CREATE TABLE {aggregate.table} ({', '.join(definitions[aggregate.table])})"
+        for aggregate in AGGREGATES
+    ]
+
+
+def _fk_indexes():
+    return [statement for entity in ENTITIES.values() for statement in fk_index_statements(entity)]
+
+
+def _usage_compression():
+    return [compression_statement(table) for table in USAGE_TABLES]
+
+
+# (version, name, statements). Append only: never edit or renumber one that shipped.
+MIGRATIONS = [
+    (1, "Pipeline state tables", _state_tables),
+    (2, "Usage summary tables", _summary_tables),
+    (3, "Indexes on foreign key columns", _fk_indexes),
+    (4, "Data compression on usage tables", _usage_compression),
+]
+
+
+def _acquire_lock(cursor):
+    cursor.execute(
+        "DECLARE @result INT; "
+        "EXEC @result = sp_getapplock @Resource = ?, @LockMode = 'Exclusive', @LockOwner = 'Session', "
+        "@LockTimeout = ?; SELECT @result",
+        LOCK_RESOURCE, MIGRATIONS_CONFIG["LOCK_TIMEOUT_MS"],
+    )
+    return cursor.fetchone()[0] >= 0
+
+
+def _release_lock(cursor):
+    cursor.execute("EXEC sp_releaseapplock @Resource = ?, @LockOwner = 'Session'", LOCK_RESOURCE)
+
+
+def applied_versions(cursor):
+    cursor.execute("SELECT version FROM SchemaMigrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def migrate(dry_run=False):
+    # Apply pending migrations in order, each in its own transaction.
+    # Returns {"current", "applied", "pending"}; dry_run only lists them.
+    result = {"current": 0, "applied": [], "pending": []}
+    try:
+        with pyodbc.connect(conn_str) as conn:
+            cursor = conn.cursor()
+            if not _acquire_lock(cursor):
+                logging.warning("Another instance is migrating the database; skipping migrations.")
+                return result
+            try:
+                if dry_run:
+                    # Read-only: a database never migrated has no version table yet.
+                    cursor.execute("SELECT OBJECT_ID('SchemaMigrations')")
+                    done = set() if cursor.fetchone()[0] is None else applied_versions(cursor)
+                else:
+                    cursor.execute(_VERSION_TABLE)
+                    conn.commit()
+                    done = applied_versions(cursor)
+                result["current"] = max(done, default=0)
+                for version, name, statements in MIGRATIONS:
+                    if version in done:
+                        continue
+                    if dry_run:
+                        result["pending"].append(version)
+                        logging.info(f"Migration {version} ({name}) pending:")
+                        for statement in statements():
+                            logging.info(f"  {statement.strip()}")
+                        continue
+                    try:
+                        for statement in statements():
+                            cursor.execute(statement)
+                        cursor.execute("INSERT INTO SchemaMigrations (version, name) VALUES (?, ?)", version, name)
+                        conn.commit()
+                    except Exception as e:
+                        conn.rollback()
+                        logging.error(f"Migration {version} ({name}) failed and was rolled back: {e}")
+                        finished = done.union(result["applied"])
+                        result["pending"] = [v for v, _, _ in MIGRATIONS if v not in finished]
+                        return result
+                    result["applied"].append(version)
+                    result["current"] = version
+                    logging.info(f"Applied migration {version}: {name}.")
+            finally:
+                _release_lock(cursor)
+                if dry_run:
+                    conn.rollback()
+                else:
+                    conn.commit()
+    except Exception as e:
+        logging.error(f"Could not run schema migrations: {e}")
+    return result
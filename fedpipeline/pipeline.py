@@ -0,0 +1,145 @@
+import logging
+import queue
+import threading
+import time
+from fedpipeline.config import PIPELINE_CONFIG
+from fedpipeline.metrics import register_collector
+from fedpipeline.profiling import profile_thread, profiled
+
+STAGES = ("fetch", "transform", "load")
+
+# Stage stats of the latest run per entity, for spotting the bottleneck stage.
+STAGE_STATS = {}
+_stats_lock = threading.Lock()
+
+_DONE = object()
+
+
+def _put(q, item, stop):
+    # Blocking put (this is the backpressure) that gives up once the run is stopped.
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q, stop, stage_stats):
+    # Track the deepest backlog waiting in front of each stage: a stage whose
+    # input queue keeps filling up is the bottleneck.
+    stage_stats["max_queue_depth"] = max(stage_stats["max_queue_depth"], q.qsize())
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+def run_pipeline(entity_name, pages, transform, load, queue_size=None):
+    # Fetch, transform and load run on their own threads linked by bounded
+    # queues, so page N+1 downloads while page N is written and a slow
+    # database throttles fetching. load(rows, items) runs on the caller's thread.
+    size = queue_size or PIPELINE_CONFIG["QUEUE_SIZE"]
+    fetched, transformed = queue.Queue(size), queue.Queue(size)
+    stop = threading.Event()
+    stats = {stage: {"busy": 0.0, "pages": 0, "rows": 0, "max_queue_depth": 0} for stage in STAGES}
+    stats["errors"] = []
+
+    def fetch_stage():
+        # A fetch error ends the stream but pages already fetched still load.
+        try:
+            iterator = iter(pages)
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    items = next(iterator)
+                except StopIteration:
+                    break
+                stats["fetch"]["busy"] += time.perf_counter() - start
+                stats["fetch"]["pages"] += 1
+                stats["fetch"]["rows"] += len(items)
+                if not _put(fetched, items, stop):
+                    break
+        except Exception as e:
+            logging.error(f"{entity_name} fetch stage failed: {e}")
+            stats["errors"].append(("fetch", e))
+        finally:
+            _put(fetched, _DONE, stop)
+
+    def transform_stage():
+        try:
+            while True:
+                items = _get(fetched, stop, stats["transform"])
+                if items is _DONE:
+                    break
+                start = time.perf_counter()
+                rows = transform(items)
+                stats["transform"]["busy"] += time.perf_counter() - start
+                stats["transform"]["pages"] += 1
+                stats["transform"]["rows"] += len(rows)
+                if not _put(transformed, (rows, items), stop):
+                    break
+        except Exception as e:
+            logging.error(f"{entity_name} transform stage failed: {e}")
+            stats["errors"].append(("transform", e))
+            stop.set()
+        finally:
+            _put(transformed, _DONE, stop)
+
+    threads = [
+        threading.Thread(target=profiled(entity_name, fetch_stage), name=f"{entity_name}-fetch", daemon=True),
+        threading.Thread(target=profiled(entity_name, transform_stage), name=f"{entity_name}-transform", daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        with profile_thread(entity_name):
+            while True:
+                batch = _get(transformed, stop, stats["load"])
+                if batch is _DONE:
+                    break
+                rows, items = batch
+                start = time.perf_counter()
+                load(rows, items)
+                stats["load"]["busy"] += time.perf_counter() - start
+                stats["load"]["pages"] += 1
+                stats["load"]["rows"] += len(rows)
+    except Exception as e:
+        logging.error(f"{entity_name} load stage failed: {e}")
+        stats["errors"].append(("load", e))
+        stop.set()
+    finally:
+        for thread in threads:
+            thread.join()
+
+    with _stats_lock:
+        STAGE_STATS[entity_name] = stats
+    logging.info(
+        f"{entity_name} pipeline: " + ", ".join(
+            f"{stage} {stats[stage]['busy']:.2f}s busy / {stats[stage]['rows']} rows / "
+            f"max queue {stats[stage]['max_queue_depth']}" for stage in STAGES
+        )
+    )
+    return stats
+
+
+def pipeline_stats():
+    with _stats_lock:
+        return {entity: {stage: dict(stats[stage]) for stage in STAGES} for entity, stats in STAGE_STATS.items()}
+
+
+register_collector(lambda: (
+    "fedpipeline_stage_busy_seconds", "gauge", "Busy time per stage in the latest run of each entity.",
+    {(entity, stage): stats[stage]["busy"] for entity, stats in pipeline_stats().items() for stage in STAGES},
+    ("entity", "stage"),
+))
+register_collector(lambda: (
+    "fedpipeline_stage_max_queue_depth", "gauge", "Deepest input backlog per stage in the latest run of each entity.",
+    {(entity, stage): stats[stage]["max_queue_depth"] for entity, stats in pipeline_stats().items() for stage in STAGES},
+    ("entity", "stage"),
+))
+
@@ -0,0 +1,181 @@
+import cProfile
+import contextvars
+import io
+import logging
+import os
+import pstats
+import signal
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from fedpipeline.config import PROFILING_CONFIG
+
+# Opt-in profiling of whole scheduled runs. Nothing is traced until a run is
+# armed (config or SIGUSR1); unarmed, the hooks below cost one context lookup.
+# A run is a full pass in cycle mode and one entity's sync in adaptive mode,
+# where several overlap: each has its own session, carried in a context
+# variable, so one entity's stage threads never land in another's profile.
+
+_lock = threading.Lock()
+_armed = {"cycles": 0}
+_session = contextvars.ContextVar("profiling_session", default=None)
+# tracemalloc is process-wide: started by the first overlapping session, stopped by the last.
+_tracing = {"sessions": 0, "started": False}
+
+
+def arm(cycles):
+    # Profile the next `cycles` scheduled runs.
+    with _lock:
+        _armed["cycles"] += cycles
+    if cycles:
+        logging.info(f"Profiling armed for the next {cycles} scheduled run(s).")
+
+
+def armed_cycles():
+    return _armed["cycles"]
+
+
+def _on_signal(signum, frame):
+    arm(PROFILING_CONFIG["SIGNAL_CYCLES"])
+
+
+def install_profiling():
+    # Called once from main: arm the configured runs and listen for SIGUSR1
+    # (not available on Windows, where only the config switch applies).
+    arm(PROFILING_CONFIG["CYCLES"])
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, _on_signal)
+
+
+@contextmanager
+def profile_thread(entity_name):
+    # cProfile only sees the thread that enabled it, so every pipeline stage
+    # thread profiles itself and the run merges the results per entity.
+    session = _session.get()
+    if session is None:
+        yield
+        return
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError as e:
+        # Another profiler (or debugger) already owns the hook.
+        logging.warning(f"Could not profile {entity_name} on {threading.current_thread().name}: {e}")
+        yield
+        return
+    try:
+        yield
+    finally:
+        profile.disable()
+        with session["lock"]:
+            session["profiles"][entity_name].append(profile)
+
+
+def profiled(entity_name, func):
+    # New threads start with an empty context: hand them the session of the
+    # run that creates them.
+    session = _session.get()
+
+    def run(*args, **kwargs):
+        token = _session.set(session)
+        try:
+            with profile_thread(entity_name):
+                return func(*args, **kwargs)
+        finally:
+            _session.reset(token)
+    return run
+
+
+def _start_tracing():
+    with _lock:
+        _tracing["sessions"] += 1
+        if _tracing["sessions"] == 1 and not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILING_CONFIG["TRACEMALLOC_FRAMES"])
+            _tracing["started"] = True
+        tracemalloc.reset_peak()
+        return tracemalloc.take_snapshot()
+
+
+def _stop_tracing():
+    with _lock:
+        _tracing["sessions"] -= 1
+        if _tracing["sessions"] == 0 and _tracing["started"]:
+            tracemalloc.stop()
+            _tracing["started"] = False
+
+
+@contextmanager
+def profile_cycle(label=None):
+    # Wrap one scheduled run (label: the entity, in adaptive mode); yields the
+    # output folder when the run is profiled.
+    with _lock:
+        if _session.get() is not None or _armed["cycles"] <= 0:
+            session = None
+        else:
+            _armed["cycles"] -= 1
+            session = {"lock": threading.Lock(), "profiles": defaultdict(list)}
+    if session is None:
+        yield None
+        return
+
+    token = _session.set(session)
+    baseline = _start_tracing()
+    folder = time.strftime("%Y%m%d-%H%M%S") + (f"-{label}" if label else "")
+    path = os.path.join(PROFILING_CONFIG["DIR"], folder)
+    start = time.perf_counter()
+    try:
+        yield path
+    finally:
+        _session.reset(token)
+        try:
+            summary = _write_profile(path, session["profiles"], baseline, time.perf_counter() - start)
+            logging.info(summary)
+        except Exception as e:
+            logging.error(f"Failed to write profile to {path}: {e}")
+        finally:
+            _stop_tracing()
+
+
+def _write_profile(path, profiles, baseline, elapsed):
+    # Per entity: a pstats dump (open with `python -m pstats <file>` or
+    # snakeviz). Per run: the allocation snapshot plus a text summary.
+    top = PROFILING_CONFIG["TOP"]
+    # tracemalloc is process-wide, so allocations are reported for the run
+    # as a whole (including runs that overlapped it): the sites that grew the
+    # most since the run started. Taken
+    # first so the profiler's own bookkeeping stays out of it.
+    current, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, cProfile.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    os.makedirs(path, exist_ok=True)
+    snapshot.dump(os.path.join(path, "allocations.snapshot"))
+
+    combined = None
+    for entity_name, entity_profiles in sorted(profiles.items()):
+        stats = pstats.Stats(*entity_profiles)
+        stats.dump_stats(os.path.join(path, f"{entity_name}.prof"))
+        if combined is None:
+            combined = pstats.Stats(*entity_profiles)
+        else:
+            combined.add(*entity_profiles)
+
+    out = io.StringIO()
+    out.write(f"Profiled run finished in {elapsed:.2f}s; {len(profiles)} entities, "
+              f"traced memory {current / 1e6:.1f} MB (peak {peak / 1e6:.1f} MB). Output: {path}\n")
+    out.write(f"Top {top} functions by own time:\n")
+    if combined is not None:
+        combined.stream = out
+        combined.sort_stats("tottime").print_stats(top)
+    out.write(f"Top {top} allocation sites by growth:\n")
+    for stat in snapshot.compare_to(baseline, "lineno")[:top]:
+        out.write(f"  {stat}\n")
+
+    summary = out.getvalue()
+    with open(os.path.join(path, "summary.txt"), "w") as handle:
+        handle.write(summary)
+    return summary
@@ -0,0 +1,184 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+from fedpipeline.config import API_CONFIG, RATE_LIMIT_CONFIG
+from fedpipeline.metrics import Counter, register_collector
+
+# Client-side throttling for API calls: a token bucket per endpoint paces
+# requests, and one AIMD concurrency limit caps in-flight requests across all
+# endpoints. A 429/503 halves both and pauses the endpoint for Retry-After;
+# every success wins a little back, so throughput recovers once the API does.
+
+THROTTLE_STATUSES = (429, 503)
+THROTTLED = Counter("fedpipeline_api_throttled_total", "429/503 answers per API endpoint.", ("endpoint",))
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, min_rate):
+        self.max_rate = self.rate = float(rate)
+        self.min_rate = min_rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now > self.updated:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self, pause):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * RATE_LIMIT_CONFIG["DECREASE"])
+            # Nothing accrues while paused, so the endpoint restarts gently.
+            self.tokens = 0.0
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+            self.updated = self.paused_until
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + RATE_LIMIT_CONFIG["RECOVERY"])
+
+
+class ConcurrencyLimit:
+    def __init__(self, maximum, minimum=1):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= max(self.minimum, int(self.limit)):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False, succeeded=True):
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                # Requests already in flight when the API pushed back answer
+                # with 429s too; count them as one congestion event.
+                if now - self._last_decrease >= 1.0:
+                    self.limit = max(self.minimum, self.limit * RATE_LIMIT_CONFIG["DECREASE"])
+                    self._last_decrease = now
+            elif succeeded:
+                # Additive increase: about one more slot per `limit` successes.
+                # Errors (connection failures, 5xx) leave the limit alone.
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+_lock = threading.Lock()
+_buckets = {}
+_concurrency = {"limit": None}
+
+
+def endpoint_name(url):
+    # The API_CONFIG key whose URL prefixes this one (next links included),
+    # falling back to the host for anything else.
+    best = None
+    for name, base in API_CONFIG.items():
+        if url.startswith(base) and url[len(base):len(base) + 1] in ("", "/", "?"):
+            if best is None or len(base) > len(API_CONFIG[best]):
+                best = name
+    return best or urlsplit(url).netloc
+
+
+def _bucket(endpoint):
+    with _lock:
+        bucket = _buckets.get(endpoint)
+        if bucket is None:
+            settings = dict(RATE_LIMIT_CONFIG, **RATE_LIMIT_CONFIG["ENDPOINTS"].get(endpoint, {}))
+            bucket = _buckets[endpoint] = TokenBucket(settings["RATE"], settings["BURST"], settings["MIN_RATE"])
+        return bucket
+
+
+def _limit():
+    with _lock:
+        if _concurrency["limit"] is None:
+            _concurrency["limit"] = ConcurrencyLimit(
+                RATE_LIMIT_CONFIG["MAX_CONCURRENCY"], RATE_LIMIT_CONFIG["MIN_CONCURRENCY"]
+            )
+        return _concurrency["limit"]
+
+
+def reset_limiters():
+    with _lock:
+        _buckets.clear()
+        _concurrency["limit"] = None
+
+
+def retry_after_seconds(value, attempt=0):
+    # Retry-After is either delta-seconds or an HTTP date.
+    delay = None
+    if value:
+        try:
+            delay = float(value)
+        except (TypeError, ValueError):
+            try:
+                delay = parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                delay = None
+    if delay is None:
+        delay = RATE_LIMIT_CONFIG["BACKOFF_SECONDS"] * 2 ** attempt
+    return min(max(delay, 0.0), RATE_LIMIT_CONFIG["MAX_RETRY_AFTER_SECONDS"])
+
+
+def before_request(url):
+    # Blocks until the endpoint may send; returns the endpoint for after_request().
+    if not RATE_LIMIT_CONFIG["ENABLED"]:
+        return None
+    endpoint = endpoint_name(url)
+    _bucket(endpoint).acquire()
+    _limit().acquire()
+    return endpoint
+
+
+def after_request(endpoint, status=None, retry_after=None, attempt=0):
+    # Returns the pause before a retry when the API throttled us, else None.
+    if endpoint is None:
+        return retry_after_seconds(retry_after, attempt) if status in THROTTLE_STATUSES else None
+    throttled = status in THROTTLE_STATUSES
+    succeeded = status is not None and 200 <= status < 400
+    _limit().release(throttled, succeeded)
+    if not throttled:
+        if succeeded:
+            _bucket(endpoint).succeeded()
+        return None
+    pause = retry_after_seconds(retry_after, attempt)
+    _bucket(endpoint).throttled(pause)
+    THROTTLED.inc(endpoint=endpoint)
+    return pause
+
+
+def limiter_stats():
+    with _lock:
+        stats = {endpoint: {"rate": bucket.rate} for endpoint, bucket in _buckets.items()}
+        limit = _concurrency["limit"]
+    return stats, (limit.limit if limit else RATE_LIMIT_CONFIG["MAX_CONCURRENCY"])
+
+
+register_collector(lambda: (
+    "fedpipeline_api_rate_limit", "gauge", "Current requests/second allowed per API endpoint.",
+    {(endpoint,): stats["rate"] for endpoint, stats in limiter_stats()[0].items()}, ("endpoint",),
+))
+register_collector(lambda: (
+    "fedpipeline_api_concurrency_limit", "gauge", "Current in-flight API request limit.",
+    {(): limiter_stats()[1]}, (),
+))
@@ -0,0 +1,237 @@
+import logging
+import pyodbc
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from fedpipeline.aggregates import aggregates_for, rebuild_aggregates
+from fedpipeline.api_handler import get_token, iter_api_pages
+from fedpipeline.config import RECONCILE_CONFIG
+from fedpipeline.dag import topological_order
+from fedpipeline.db_handler import conn_str, _new_stats, _execute_batch, _log_rejections
+from fedpipeline.deadletter import dead_letter_keys, resolve as resolve_dead_letters
+from fedpipeline.entities import ENTITIES, entity_parents
+from fedpipeline.fingerprints import forget_fingerprints
+from fedpipeline.integrity import forget_keys
+from fedpipeline.metrics import register_collector, timed
+
+# Deletions upstream never show up in an incremental sync. Reconciliation
+# compares the full set of IDs the API returns with the set in each table and
+# deletes (or soft-deletes) only the difference, children before parents,
+# instead of wiping every table with sql/delete_data.sql and reloading.
+
+_lock = threading.Lock()
+RECONCILE_STATS = {}
+
+
+class IdBitmap:
+    # One bit per ereserve_id, so ten million IDs cost ~1.2 MB. The bitmap is
+    # sized by the largest ID, so IDs past BITMAP_MAX_ID (or negative) go to a
+    # sorted array of 8 bytes per ID instead: one large or sparse ID can't
+    # blow the bitmap up to hundreds of MB.
+
+    def __init__(self):
+        self.bits = bytearray()
+        self.bit_count = 0
+        self._overflow = array("q")
+        self._overflow_sorted = True
+
+    def add(self, key):
+        if key < 0 or key > RECONCILE_CONFIG["BITMAP_MAX_ID"]:
+            self._overflow.append(key)
+            self._overflow_sorted = False
+            return
+        index, mask = key >> 3, 1 << (key & 7)
+        if index >= len(self.bits):
+            self.bits.extend(bytes(max(index + 1 - len(self.bits), len(self.bits))))
+        if not self.bits[index] & mask:
+            self.bits[index] |= mask
+            self.bit_count += 1
+
+    @property
+    def overflow(self):
+        # Sorted and de-duplicated on the first read after an add.
+        if not self._overflow_sorted:
+            self._overflow = array("q", sorted(set(self._overflow)))
+            self._overflow_sorted = True
+        return self._overflow
+
+    def __contains__(self, key):
+        if key < 0 or key > RECONCILE_CONFIG["BITMAP_MAX_ID"]:
+            overflow = self.overflow
+            i = bisect_left(overflow, key)
+            return i < len(overflow) and overflow[i] == key
+        index = key >> 3
+        return index < len(self.bits) and bool(self.bits[index] & (1 << (key & 7)))
+
+    def __len__(self):
+        return self.bit_count + len(self.overflow)
+
+    def difference(self, other, chunk=4096):
+        # Yield the IDs in self but not in other, in ascending order, one
+        # chunk of the bitmaps at a time.
+        for offset in range(0, len(self.bits), chunk):
+            ours = int.from_bytes(self.bits[offset:offset + chunk], "little")
+            theirs = int.from_bytes(other.bits[offset:offset + chunk], "little")
+            bits = ours & ~theirs
+            while bits:
+                lowest = bits & -bits
+                yield offset * 8 + lowest.bit_length() - 1
+                bits ^= lowest
+        yield from (key for key in self.overflow if key not in other)
+
+
+def _soft_delete_column(entity):
+    return RECONCILE_CONFIG["SOFT_DELETE"].get(entity.name)
+
+
+def database_ids(entity):
+    # Keys currently in the table; soft-deleted rows are already reconciled.
+    ids = IdBitmap()
+    column = _soft_delete_column(entity)
+    where = f" WHERE {column} IS NULL OR {column} = 0" if column else ""
+    with pyodbc.connect(conn_str) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {entity.key} FROM {entity.table}{where}")
+        while True:
+            rows = cursor.fetchmany(10000)
+            if not rows:
+                break
+            for row in rows:
+                ids.add(row[0])
+    return ids
+
+
+def api_ids(entity, token):
+    # Every ID the API lists for the entity. Raises if any page fails: a
+    # short listing must never be mistaken for deletions.
+    ids = IdBitmap()
+    for page in iter_api_pages(entity.url, token, entity_name=f"{entity.name}:reconcile"):
+        for item in page:
+            if isinstance(item, dict) and item.get("id") is not None:
+                ids.add(int(item["id"]))
+    return ids
+
+
+def _batches(keys, size):
+    batch = []
+    for key in keys:
+        batch.append((key,))
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def apply_deletions(entity, stale_ids):
+    # Delete (or flag) the stale rows in batches. A parent row still
+    # referenced by a live child fails its FK and is skipped by bisection,
+    # like a rejected insert; returns (removed IDs, db stats).
+    column = _soft_delete_column(entity)
+    if column:
+        query = f"UPDATE {entity.table} SET {column} = 1 WHERE {entity.key} = ?"
+    else:
+        query = f"DELETE FROM {entity.table} WHERE {entity.key} = ?"
+    stats = _new_stats()
+    removed = []
+    with pyodbc.connect(conn_str) as conn:
+        cursor = conn.cursor()
+        cursor.fast_executemany = True
+        for batch in _batches(stale_ids, RECONCILE_CONFIG["BATCH_SIZE"]):
+            stats["sent"] += len(batch)
+            stats["batches"] += 1
+            rejected_before = len(stats["rejected_ids"])
+            _execute_batch(conn, cursor, query, batch, stats)
+            blocked = set(stats["rejected_ids"][rejected_before:])
+            removed.extend(key for key, in batch if key not in blocked)
+    _log_rejections(entity.name, stats)
+    return removed, stats
+
+
+def reconcile_entity(entity, token, dry_run=False):
+    # The table is read before the API: a row loaded while the listing is
+    # being fetched is then in neither snapshot or in both, never deleted.
+    report = {"database": 0, "api": 0, "stale": 0, "removed": 0, "blocked": 0, "missing": 0, "skipped": False}
+    with timed("reconcile", entity.name):
+        in_db = database_ids(entity)
+        in_api = api_ids(entity, token)
+        report["database"], report["api"] = len(in_db), len(in_api)
+        stale = list(in_db.difference(in_api))
+    report["stale"] = len(stale)
+    report["missing"] = len(in_api) - (len(in_db) - len(stale))
+
+    limit = RECONCILE_CONFIG["MAX_DELETE_FRACTION"]
+    if stale and (not len(in_api) or len(stale) > limit * len(in_db)):
+        # An empty or truncated listing looks like mass deletion; leave that
+        # to a person (sql/delete_data.sql or a higher limit).
+        logging.error(
+            f"{entity.name}: reconciliation would remove {len(stale)} of {len(in_db)} rows "
+            f"(limit {limit:.0%}); skipped."
+        )
+        report["skipped"] = True
+    elif stale and not dry_run:
+        with timed("reconcile_delete", entity.name):
+            removed, stats = apply_deletions(entity, stale)
+        report["removed"], report["blocked"] = len(removed), stats["rejected"]
+        # Forget what we knew about the removed rows so a reappearing row loads again.
+        forget_fingerprints(entity.name, removed)
+        forget_keys(entity.name)
+    if len(in_api) and not report["skipped"] and not dry_run:
+        # Rejected rows gone upstream mustn't come back through a replay.
+        resolve_dead_letters(entity.name, [key for key in dead_letter_keys(entity.name) if key not in in_api])
+
+    action = "soft-deleted" if _soft_delete_column(entity) else "deleted"
+    logging.info(
+        f"{entity.name} reconciliation{' (dry run)' if dry_run else ''}: {report['database']} in DB, "
+        f"{report['api']} in API, {report['stale']} gone upstream, {report['removed']} {action}, "
+        f"{report['blocked']} still referenced, {report['missing']} not loaded yet."
+    )
+    with _lock:
+        RECONCILE_STATS[entity.name] = dict(report, finished=time.time())
+    return report
+
+
+def reconcile_all(names=None, dry_run=False, token=None):
+    # Children first, so their stale rows are gone before their parents' are deleted.
+    token = token or get_token()
+    if not token:
+        logging.error("Reconciliation aborted: Missing token.")
+        return {}
+    selected = set(names or ENTITIES)
+    reports = {}
+    for name in reversed(topological_order(entity_parents())):
+        if name not in selected:
+            continue
+        try:
+            reports[name] = reconcile_entity(ENTITIES[name], token, dry_run)
+        except Exception as e:
+            logging.error(f"Error reconciling {name}: {e}")
+    # Deletions don't go through the MERGE that keeps the summaries current.
+    sources = [
+        ENTITIES[name].table for name, report in reports.items()
+        if report.get("removed") and aggregates_for(ENTITIES[name].table)
+    ]
+    if sources:
+        rebuild_aggregates(sources)
+    return reports
+
+
+def reconcile_stats():
+    with _lock:
+        return {name: dict(report) for name, report in RECONCILE_STATS.items()}
+
+
+def _collect():
+    values = {}
+    for name, report in reconcile_stats().items():
+        for result in ("stale", "removed", "blocked", "missing"):
+            values[(name, result)] = report[result]
+    return (
+        "fedpipeline_reconcile_rows", "gauge",
+        "Rows found gone upstream, removed, still referenced and not yet loaded by the last reconciliation.",
+        values, ("entity", "result"),
+    )
+
+
+register_collector(_collect)
@@ -0,0 +1,301 @@
+import logging
+import pyodbc
+import re
+import time
+from fedpipeline.aggregates import aggregates_for, rebuild_aggregates
+from fedpipeline.api_handler import get_token, iter_api_pages
+from fedpipeline.config import REFRESH_CONFIG, LOAD_CONFIG
+from fedpipeline.dag import topological_order
+from fedpipeline.db_handler import conn_str, _new_stats, _execute_batch, _log_rejections
+from fedpipeline.entities import ENTITIES, entity_parents
+from fedpipeline.fingerprints import clear_fingerprints
+from fedpipeline.http_cache import clear_http_cache
+from fedpipeline.deadletter import forget as forget_dead_letters
+from fedpipeline.integrity import forget_keys
+from fedpipeline.metrics import timed, ROWS
+from fedpipeline.migrations import compression, fk_index_statements
+from fedpipeline.pipeline import run_pipeline
+from fedpipeline.schema import coerce_rows, table_definitions
+from fedpipeline.spool import Spool
+from fedpipeline.state import compute_watermark, save_watermark
+
+# Full refresh without emptying the live tables: every entity is bulk-loaded
+# into a shadow copy (<Table>_shadow, a heap loaded WITH (TABLOCK)), indexed
+# and FK-checked there, and then all shadows replace their live tables in one
+# transaction of sp_renames. Readers only wait for that metadata change.
+#
+# Children's FKs point at their parent's table object, so a table is always
+# refreshed together with every table below it: the shadow children reference
+# the shadow parents and the renames carry those FKs across.
+
+_FOREIGN_KEY = re.compile(r"CONSTRAINT\s+(\w+)\s+FOREIGN\s+KEY\s*\((\w+)\)\s*REFERENCES\s+(\w+)\s*\((\w+)\)", re.I)
+
+
+def refresh_set(names=None):
+    # The requested entities plus everything that references them, parents first.
+    parents = entity_parents()
+    selected = set(names or ENTITIES)
+    changed = True
+    while changed:
+        children = {name for name, ups in parents.items() if selected.intersection(ups)}
+        changed = not children <= selected
+        selected |= children
+    return [name for name in topological_order(parents) if name in selected]
+
+
+def shadow_name(table):
+    return table + REFRESH_CONFIG["SHADOW_SUFFIX"]
+
+
+def shadow_ddl(entity, refreshing):
+    # The table as declared in sql/db.sql, minus its keys: those are added
+    # once the rows are in, so the load goes into a plain heap.
+    tables = {ENTITIES[name].table for name in refreshing}
+    columns, foreign_keys = [], []
+    for definition in table_definitions()[entity.table]:
+        match = _FOREIGN_KEY.match(definition)
+        if match:
+            name, column, parent, parent_key = match.groups()
+            foreign_keys.append((name, column, shadow_name(parent) if parent in tables else parent, parent_key))
+        elif not definition.upper().startswith("CONSTRAINT"):
+            columns.append(re.sub(r"\s+PRIMARY\s+KEY", "", definition, flags=re.I))
+    return {
+        "create": f"CREATE TABLE {shadow_name(entity.table)} (\n    " + ",\n    ".join(columns) + "\n)",
+        "primary_key": f"PK_{entity.table}",
+        "foreign_keys": foreign_keys,
+    }
+
+
+def _drop_leftovers(conn, cursor, refreshing):
+    # Shadows of a refresh that didn't finish, and old tables kept by the last one.
+    for name in reversed(refreshing):
+        table = ENTITIES[name].table
+        for leftover in (shadow_name(table), table + REFRESH_CONFIG["OLD_SUFFIX"]):
+            cursor.execute(f"DROP TABLE IF EXISTS {leftover}")
+    conn.commit()
+
+
+def _check_recovery_model(cursor):
+    cursor.execute("SELECT recovery_model_desc FROM sys.databases WHERE name = DB_NAME()")
+    row = cursor.fetchone()
+    model = row[0] if row else None
+    if model == "FULL":
+        logging.warning("Database uses the FULL recovery model; the shadow load is fully logged.")
+    return model
+
+
+def load_shadow(entity, token, conn, cursor, ddl):
+    # Fetch every record and bulk-insert it into the entity's shadow table.
+    shadow = shadow_name(entity.table)
+    cursor.execute(ddl["create"])
+    conn.commit()
+    query = (f"INSERT INTO {shadow} WITH (TABLOCK) ({', '.join(entity.columns)}) "
+             f"VALUES ({', '.join('?' * len(entity.columns))})")
+    stats = _new_stats()
+    progress = {"invalid": 0, "watermark": None, "fetched": 0}
+
+    def transform(items):
+        progress["fetched"] += len(items)
+        rows, invalid = coerce_rows(entity, entity.project(items))
+        progress["invalid"] += invalid
+        return rows
+
+    def load(rows, items):
+        batch_size = LOAD_CONFIG["BATCH_SIZE"]
+        for i in range(0, len(rows), batch_size):
+            stats["sent"] += len(rows[i:i + batch_size])
+            stats["batches"] += 1
+            _execute_batch(conn, cursor, query, rows[i:i + batch_size], stats)
+        progress["watermark"] = compute_watermark(items, progress["watermark"])
+
+    pages = iter_api_pages(entity.url, token, entity_name=f"{entity.name}:refresh")
+    pipeline = run_pipeline(entity.name, pages, transform, load)
+    _log_rejections(entity.name, stats)
+    ROWS.inc(stats["sent"] - stats["rejected"], entity=entity.name, stage="refresh")
+    return {
+        "fetched": progress["fetched"],
+        "rejected": stats["rejected"] + progress["invalid"],
+        "watermark": progress["watermark"],
+        "complete": not pipeline["errors"],
+    }
+
+
+def finish_shadow(entity, conn, cursor, ddl):
+    # Duplicates (pages shifting under pagination) and rows whose parent isn't
+    # there go; then the keys are built, FKs checked against the new parents.
+    shadow = shadow_name(entity.table)
+    cursor.execute(
+        f"WITH numbered AS (SELECT ROW_NUMBER() OVER (PARTITION BY {entity.key} ORDER BY (SELECT NULL)) AS n "
+        f"FROM {shadow}) DELETE FROM numbered WHERE n > 1"
+    )
+    duplicates = max(cursor.rowcount, 0)
+    orphans = 0
+    for _, column, parent, parent_key in ddl["foreign_keys"]:
+        cursor.execute(
+            f"DELETE child FROM {shadow} AS child WHERE child.{column} IS NOT NULL AND NOT EXISTS "
+            f"(SELECT 1 FROM {parent} AS parent WHERE parent.{parent_key} = child.{column})"
+        )
+        orphans += max(cursor.rowcount, 0)
+    conn.commit()
+    # Same physical design the migrations give the live table.
+    cursor.execute(
+        f"ALTER TABLE {shadow} ADD CONSTRAINT {shadow_name(ddl['primary_key'])} "
+        f"PRIMARY KEY CLUSTERED ({entity.key}) WITH (DATA_COMPRESSION = {compression(entity.table)})"
+    )
+    for statement in fk_index_statements(entity, shadow):
+        cursor.execute(statement)
+    for name, column, parent, parent_key in ddl["foreign_keys"]:
+        cursor.execute(
+            f"ALTER TABLE {shadow} WITH CHECK ADD CONSTRAINT {shadow_name(name)} "
+            f"FOREIGN KEY ({column}) REFERENCES {parent} ({parent_key})"
+        )
+    conn.commit()
+    cursor.execute(f"SELECT COUNT_BIG(*) FROM {shadow}")
+    rows = cursor.fetchone()[0]
+    cursor.execute(f"SELECT COUNT_BIG(*) FROM {entity.table}")
+    live = cursor.fetchone()[0]
+    return {"rows": rows, "live_rows": live, "duplicates": duplicates, "orphans": orphans}
+
+
+def validate(entity_name, report):
+    # Returns why the shadow mustn't replace the live table, or None.
+    if not report["complete"]:
+        return "the fetch did not complete"
+    dropped = report["rejected"] + report["orphans"]
+    if report["fetched"] and dropped > REFRESH_CONFIG["MAX_REJECT_FRACTION"] * report["fetched"]:
+        return f"{dropped} of {report['fetched']} fetched rows were rejected or orphaned"
+    if report["rows"] < REFRESH_CONFIG["MIN_ROW_RATIO"] * report["live_rows"]:
+        return f"{report['rows']} rows would replace {report['live_rows']}"
+    return None
+
+
+def swap_sql(refreshing, ddls):
+    # One transaction of renames: live -> _old, shadow -> live. Constraint
+    # names are schema-wide, so the old ones move aside first.
+    old = REFRESH_CONFIG["OLD_SUFFIX"]
+    lines = [
+        "SET NOCOUNT ON;",
+        "SET XACT_ABORT ON;",
+        f"SET LOCK_TIMEOUT {int(REFRESH_CONFIG['LOCK_TIMEOUT_MS'])};",
+        "BEGIN TRANSACTION;",
+    ]
+    constraints = []
+    for name in refreshing:
+        ddl = ddls[name]
+        constraints += [ddl["primary_key"]] + [fk[0] for fk in ddl["foreign_keys"]]
+    for constraint in constraints:
+        lines.append(
+            f"IF OBJECT_ID('{constraint}') IS NOT NULL EXEC sp_rename '{constraint}', '{constraint}{old}', 'OBJECT';"
+        )
+    for name in refreshing:
+        table = ENTITIES[name].table
+        lines.append(f"EXEC sp_rename '{table}', '{table}{old}';")
+    for name in refreshing:
+        table = ENTITIES[name].table
+        lines.append(f"EXEC sp_rename '{shadow_name(table)}', '{table}';")
+    for constraint in constraints:
+        lines.append(f"EXEC sp_rename '{shadow_name(constraint)}', '{constraint}', 'OBJECT';")
+    lines.append("COMMIT TRANSACTION;")
+    return "\n".join(lines)
+
+
+def swapped_sql(refreshing):
+    # Returns a row only if every live table moved aside and every shadow took its place.
+    old = REFRESH_CONFIG["OLD_SUFFIX"]
+    checks = " AND ".join(
+        f"OBJECT_ID('{table}{old}') IS NOT NULL AND OBJECT_ID('{shadow_name(table)}') IS NULL"
+        for table in (ENTITIES[name].table for name in refreshing)
+    )
+    return f"SELECT 1 WHERE {checks}"
+
+
+def _swap(conn, cursor, refreshing, ddls):
+    # Retried a few times: a long-running report can hold the lock past LOCK_TIMEOUT.
+    sql = swap_sql(refreshing, ddls)
+    conn.autocommit = True
+    try:
+        for attempt in range(REFRESH_CONFIG["SWAP_RETRIES"] + 1):
+            try:
+                start = time.perf_counter()
+                with timed("refresh_swap"):
+                    cursor.execute(sql)
+                    # An error in a later statement only surfaces when its
+                    # result set is read; without this it would pass silently.
+                    while cursor.nextset():
+                        pass
+                cursor.execute(swapped_sql(refreshing))
+                if cursor.fetchone() is None:
+                    raise RuntimeError("the swap transaction was rolled back")
+                return time.perf_counter() - start
+            except Exception as e:
+                if attempt == REFRESH_CONFIG["SWAP_RETRIES"]:
+                    raise
+                logging.warning(f"Table swap blocked ({e}); retrying.")
+                time.sleep(1)
+    finally:
+        conn.autocommit = False
+
+
+def full_refresh(names=None, token=None):
+    # Reload the given entities (and everything referencing them) from scratch.
+    refreshing = refresh_set(names)
+    if names and len(refreshing) > len(set(names)):
+        logging.info(f"Full refresh also covers dependent tables: {', '.join(refreshing)}.")
+    token = token or get_token()
+    if not token:
+        logging.error("Full refresh aborted: Missing token.")
+        return {"swapped": False, "entities": {}}
+
+    ddls = {name: shadow_ddl(ENTITIES[name], refreshing) for name in refreshing}
+    reports = {}
+    with pyodbc.connect(conn_str) as conn:
+        cursor = conn.cursor()
+        cursor.fast_executemany = LOAD_CONFIG["FAST_EXECUTEMANY"]
+        _drop_leftovers(conn, cursor, refreshing)
+        _check_recovery_model(cursor)
+
+        problem = None
+        for name in refreshing:
+            entity = ENTITIES[name]
+            with timed("refresh_load", name):
+                report = load_shadow(entity, token, conn, cursor, ddls[name])
+                report.update(finish_shadow(entity, conn, cursor, ddls[name]))
+            reports[name] = report
+            problem = validate(name, report)
+            logging.info(
+                f"{name} shadow loaded: {report['rows']} rows (live {report['live_rows']}), "
+                f"{report['rejected']} rejected, {report['orphans']} orphaned, {report['duplicates']} duplicates."
+            )
+            if problem:
+                logging.error(f"Full refresh abandoned, {name}: {problem}. Live tables are unchanged.")
+                break
+
+        if problem:
+            _drop_leftovers(conn, cursor, refreshing)
+            return {"swapped": False, "entities": reports}
+
+        try:
+            elapsed = _swap(conn, cursor, refreshing, ddls)
+        except Exception as e:
+            logging.error(f"Full refresh abandoned, table swap failed: {e}. Live tables are unchanged.")
+            _drop_leftovers(conn, cursor, refreshing)
+            return {"swapped": False, "entities": reports}
+        logging.info(f"Swapped {len(refreshing)} shadow tables into place in {elapsed * 1000:.0f}ms.")
+        if not REFRESH_CONFIG["KEEP_OLD"]:
+            _drop_leftovers(conn, cursor, refreshing)
+
+    # The tables now hold exactly the API's snapshot: restart incremental
+    # sync from it and drop local state describing the old contents.
+    for name in refreshing:
+        clear_fingerprints(name)
+        clear_http_cache(name)
+        forget_keys(name)
+        forget_dead_letters(name)
+        Spool(name).clear()
+        if reports[name]["watermark"]:
+            save_watermark(name, reports[name]["watermark"])
+    # Shadow loads bypass the MERGE that keeps the summaries current.
+    sources = [ENTITIES[name].table for name in refreshing if aggregates_for(ENTITIES[name].table)]
+    if sources:
+        rebuild_aggregates(sources)
+    return {"swapped": True, "entities": reports}
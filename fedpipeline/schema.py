@@ -0,0 +1,284 @@
+import json
+import logging
+import os
+import re
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+from fedpipeline.config import SCHEMA_CONFIG
+from fedpipeline.metrics import register_collector
+from fedpipeline.state import parse_timestamp
+
+# Column types read from the CREATE TABLE statements in sql/db.sql, and per
+# entity a compiled row coercer that turns JSON values into the Python types
+# pyodbc binds natively: datetimes for DATETIME, bools for BIT, ints for INT,
+# length-checked strings for NVARCHAR (lists and objects as JSON). Values the
+# column can't hold reject the row here instead of in SQL Server.
+
+DEFAULT_DDL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sql", "db.sql")
+
+_TABLE_PATTERN = re.compile(r"CREATE\s+TABLE\s+(\w+)\s*\((.*?)\n\s*\)\s*;", re.IGNORECASE | re.DOTALL)
+_COLUMN_PATTERN = re.compile(r"^\s*(\w+)\s+(\w+)\s*(?:\(\s*(\w+)\s*(?:,\s*(\d+)\s*)?\))?(.*)$", re.IGNORECASE)
+
+_INT_RANGES = {"TINYINT": (0, 255), "SMALLINT": (-2 ** 15, 2 ** 15 - 1), "INT": (-2 ** 31, 2 ** 31 - 1),
+               "BIGINT": (-2 ** 63, 2 ** 63 - 1)}
+_TEXT_TYPES = ("NVARCHAR", "VARCHAR", "NCHAR", "CHAR")
+_MIN_DATETIME = datetime(1753, 1, 1)
+
+_lock = threading.Lock()
+_coercers = {}
+COERCION_STATS = {}
+
+
+class CoercionError(ValueError):
+    pass
+
+
+def parse_ddl(text):
+    # {table: {column: {"type", "length", "nullable"}}} for every CREATE TABLE.
+    tables = {}
+    for table, body in _TABLE_PATTERN.findall(text):
+        columns = {}
+        for line in body.split("\n"):
+            line = line.strip().rstrip(",")
+            match = _COLUMN_PATTERN.match(line)
+            if not match or match.group(1).upper() in ("CONSTRAINT", "PRIMARY", "FOREIGN", "UNIQUE", "INDEX"):
+                continue
+            name, kind, size, _, rest = match.groups()
+            rest = rest.upper()
+            columns[name] = {
+                "type": kind.upper(),
+                "length": None if size is None or size.upper() == "MAX" else int(size),
+                "nullable": "NOT NULL" not in rest and "PRIMARY KEY" not in rest,
+            }
+        tables[table] = columns
+    return tables
+
+
+@lru_cache(maxsize=None)
+def load_schema(path=None):
+    with open(path or SCHEMA_CONFIG["PATH"] or DEFAULT_DDL, encoding="utf-8") as handle:
+        return parse_ddl(handle.read())
+
+
+def table_definitions(path=None):
+    # {table: [column or constraint definition, ...]} as written in the DDL.
+    with open(path or SCHEMA_CONFIG["PATH"] or DEFAULT_DDL, encoding="utf-8") as handle:
+        text = handle.read()
+    return {
+        table: [line.strip().rstrip(",") for line in body.split("\n") if line.strip()]
+        for table, body in _TABLE_PATTERN.findall(text)
+    }
+
+
+# Timestamps repeat heavily within a page (bulk-updated rows share them), so
+# parsing is memoised on the raw string.
+@lru_cache(maxsize=65536)
+def _parse_datetime(value):
+    return parse_timestamp(value)
+
+
+def _to_datetime(value, column):
+    if isinstance(value, str):
+        parsed = _parse_datetime(value)
+    elif isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, date):
+        parsed = datetime(value.year, value.month, value.day)
+    else:
+        parsed = None
+    if parsed is None:
+        raise CoercionError(f"not a timestamp: {value!r}")
+    if column["type"] == "DATETIME":
+        if parsed < _MIN_DATETIME:
+            raise CoercionError(f"before 1753 for DATETIME: {value!r}")
+        # DATETIME has millisecond precision; binding microseconds with
+        # fast_executemany fails with "fractional second precision exceeds".
+        if parsed.microsecond % 1000:
+            parsed = parsed.replace(microsecond=parsed.microsecond // 1000 * 1000)
+    return parsed
+
+
+def _to_date(value, column):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    parsed = _parse_datetime(value) if isinstance(value, str) else None
+    if parsed is None:
+        raise CoercionError(f"not a date: {value!r}")
+    return parsed.date()
+
+
+def _to_bit(value, column):
+    if isinstance(value, bool):
+        return value
+    if value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.strip().lower() in ("true", "false", "1", "0"):
+        return value.strip().lower() in ("true", "1")
+    raise CoercionError(f"not a boolean: {value!r}")
+
+
+def _to_int(value, column):
+    if type(value) is int:
+        result = value
+    elif isinstance(value, bool):
+        result = int(value)
+    elif isinstance(value, float) and value.is_integer():
+        result = int(value)
+    elif isinstance(value, str) and value.strip().lstrip("-").isdigit():
+        result = int(value)
+    else:
+        raise CoercionError(f"not an integer: {value!r}")
+    low, high = _INT_RANGES[column["type"]]
+    if not low <= result <= high:
+        raise CoercionError(f"out of {column['type']} range: {value!r}")
+    return result
+
+
+def _to_number(value, column):
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        return value
+    try:
+        return Decimal(value) if column["type"] in ("DECIMAL", "NUMERIC") else float(value)
+    except (TypeError, ValueError, ArithmeticError):
+        raise CoercionError(f"not a number: {value!r}")
+
+
+def _to_text(value, column):
+    if not isinstance(value, str):
+        # Same serialisation the change-detection fingerprints use.
+        value = json.dumps(value, sort_keys=True) if isinstance(value, (list, dict)) else str(value)
+    length = column["length"]
+    if length is not None and len(value) > length:
+        if not SCHEMA_CONFIG["TRUNCATE"]:
+            raise CoercionError(f"{len(value)} characters for NVARCHAR({length})")
+        column["truncated"] += 1
+        value = value[:length]
+    return value
+
+
+def _converter(column):
+    kind = column["type"]
+    if kind in ("DATETIME", "DATETIME2", "SMALLDATETIME", "DATETIMEOFFSET"):
+        return _to_datetime
+    if kind == "DATE":
+        return _to_date
+    if kind == "BIT":
+        return _to_bit
+    if kind in _INT_RANGES:
+        return _to_int
+    if kind in ("DECIMAL", "NUMERIC", "FLOAT", "REAL", "MONEY"):
+        return _to_number
+    if kind in _TEXT_TYPES:
+        return _to_text
+    return None
+
+
+def compile_coercer(entity, schema):
+    # rows -> (coerced rows, [(ereserve_id, reason), ...]).
+    table = schema.get(entity.table)
+    if table is None:
+        raise KeyError(f"Table {entity.table} not found in the schema")
+    steps = []
+    for position, name in enumerate(entity.columns):
+        column = dict(table[name], name=name, truncated=0)
+        steps.append((position, column, _converter(column)))
+
+    def coerce_row(row):
+        values = list(row)
+        for position, column, convert in steps:
+            value = values[position]
+            if value is None:
+                if not column["nullable"]:
+                    raise CoercionError(f"{column['name']}: NULL in a NOT NULL column")
+                continue
+            if convert is not None:
+                try:
+                    values[position] = convert(value, column)
+                except CoercionError as e:
+                    raise CoercionError(f"{column['name']}: {e}")
+        return tuple(values)
+
+    def coerce(rows):
+        good, bad = [], []
+        for row in rows:
+            try:
+                good.append(coerce_row(row))
+            except CoercionError as e:
+                bad.append((row[0], str(e)))
+        return good, bad
+
+    coerce.columns = [column for _, column, _ in steps]
+    return coerce
+
+
+def _coercer(entity):
+    with _lock:
+        if entity.name not in _coercers:
+            try:
+                _coercers[entity.name] = compile_coercer(entity, load_schema())
+            except Exception as e:
+                logging.warning(f"No type coercion for {entity.name}: {e}")
+                _coercers[entity.name] = None
+        return _coercers[entity.name]
+
+
+def coerce_rows(entity, rows, rejects=None):
+    # Coerce one page of rows; returns (rows to load, number rejected). The
+    # (ereserve_id, reason) of each rejected row is added to `rejects` if given.
+    if not SCHEMA_CONFIG["ENABLED"] or not rows:
+        return rows, 0
+    coerce = _coercer(entity)
+    if coerce is None:
+        return rows, 0
+    truncated_before = sum(column["truncated"] for column in coerce.columns)
+    good, bad = coerce(rows)
+    if rejects is not None:
+        rejects.extend(bad)
+    truncated = sum(column["truncated"] for column in coerce.columns) - truncated_before
+    with _lock:
+        stats = COERCION_STATS.setdefault(entity.name, {"rows": 0, "rejected": 0, "truncated": 0})
+        stats["rows"] += len(rows)
+        stats["rejected"] += len(bad)
+        stats["truncated"] += truncated
+    if truncated:
+        logging.warning(f"{entity.name}: truncated {truncated} over-long values to their column length.")
+    if bad:
+        reasons = {}
+        for record_id, reason in bad:
+            reasons.setdefault(reason.split(":")[0], []).append(record_id)
+        for column, ids in reasons.items():
+            logging.error(
+                f"{entity.name}: {len(ids)} records rejected before load, bad {column} "
+                f"(e.g. IDs {', '.join(map(str, ids[:5]))}) – {next(r for i, r in bad if i == ids[0])}"
+            )
+    return good, len(bad)
+
+
+def reset_coercers():
+    with _lock:
+        _coercers.clear()
+        COERCION_STATS.clear()
+    load_schema.cache_clear()
+
+
+def coercion_stats():
+    with _lock:
+        return {entity: dict(stats) for entity, stats in COERCION_STATS.items()}
+
+
+def _collect():
+    values = {}
+    for entity_name, stats in coercion_stats().items():
+        values[(entity_name, "rejected")] = stats["rejected"]
+        values[(entity_name, "truncated")] = stats["truncated"]
+    return (
+        "fedpipeline_coercion_values_total", "counter",
+        "Rows rejected and values truncated by client-side type coercion.", values, ("entity", "result"),
+    )
+
+
+register_collector(_collect)
@@ -0,0 +1,186 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections import deque
+from fedpipeline.config import SPOOL_CONFIG
+from fedpipeline.metrics import register_collector
+
+# Fetched pages are appended to per-entity segment files before they are
+# loaded, and load progress is checkpointed page by page. A run that dies, or
+# can't reach SQL Server, leaves its pages on disk; the next run loads them
+# from there instead of downloading them again.
+#
+# A segment is a sequence of records: 4-byte length, 4-byte CRC32, then the
+# page's items as zlib-compressed JSON. A torn record at the tail (crash
+# mid-write) fails its CRC and marks the end of the segment.
+
+_HEADER = struct.Struct(">II")
+_CHECKPOINT = "checkpoint.json"
+
+
+def _segment_name(number):
+    return f"{number:08d}.seg"
+
+
+class Spool:
+    def __init__(self, entity_name, directory=None):
+        self.entity_name = entity_name
+        self.path = os.path.join(directory or SPOOL_CONFIG["DIR"], entity_name)
+        self._lock = threading.Lock()
+        self._positions = deque()
+        self._writer = None
+        self._writing = None
+        self.state = self._read_checkpoint()
+
+    def _read_checkpoint(self):
+        try:
+            with open(os.path.join(self.path, _CHECKPOINT)) as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return {"segment": 0, "offset": 0, "fetch_complete": False}
+
+    def _write_checkpoint(self):
+        # Caller holds _lock. Written aside and renamed, so a crash leaves
+        # either the old or the new checkpoint, never half of one.
+        os.makedirs(self.path, exist_ok=True)
+        temporary = os.path.join(self.path, _CHECKPOINT + ".tmp")
+        with open(temporary, "w") as handle:
+            json.dump(self.state, handle)
+            if SPOOL_CONFIG["FSYNC"]:
+                handle.flush()
+                os.fsync(handle.fileno())
+        os.replace(temporary, os.path.join(self.path, _CHECKPOINT))
+
+    def segments(self):
+        try:
+            names = sorted(name for name in os.listdir(self.path) if name.endswith(".seg"))
+        except FileNotFoundError:
+            return []
+        return [int(name[:-4]) for name in names]
+
+    def pending(self):
+        # True when an earlier run left pages that never finished loading.
+        return any(True for _ in self._records())
+
+    def _records(self):
+        # (segment, end offset, payload) for every record past the checkpoint.
+        for number in self.segments():
+            if number < self.state["segment"]:
+                continue
+            offset = self.state["offset"] if number == self.state["segment"] else 0
+            with open(os.path.join(self.path, _segment_name(number)), "rb") as handle:
+                if os.fstat(handle.fileno()).st_size <= offset:
+                    continue
+                with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    while offset + _HEADER.size <= len(data):
+                        length, checksum = _HEADER.unpack_from(data, offset)
+                        start, end = offset + _HEADER.size, offset + _HEADER.size + length
+                        if end > len(data) or zlib.crc32(data[start:end]) != checksum:
+                            logging.warning(f"{self.entity_name}: spool segment {number} ends in a torn record.")
+                            break
+                        yield number, end, data[start:end]
+                        offset = end
+
+    def replay(self):
+        # Yield the pages left by an earlier run, oldest first.
+        count = 0
+        for number, end, payload in self._records():
+            with self._lock:
+                self._positions.append((number, end))
+            count += 1
+            yield json.loads(zlib.decompress(payload))
+        logging.info(f"{self.entity_name}: replayed {count} spooled pages without refetching.")
+
+    def start(self):
+        # A fetch is about to append pages; until record() finishes, the
+        # spool doesn't hold the whole delta.
+        with self._lock:
+            self.state["fetch_complete"] = False
+            self._write_checkpoint()
+
+    def record(self, pages):
+        # Pass pages through, appending each to the spool before it's loaded.
+        for items in pages:
+            self._append(items)
+            yield items
+        with self._lock:
+            self._close_writer()
+            self.state["fetch_complete"] = True
+            self._write_checkpoint()
+
+    def _append(self, items):
+        payload = zlib.compress(json.dumps(items, separators=(",", ":"), default=str).encode(), 1)
+        with self._lock:
+            if self._writer is None or self._writer.tell() >= SPOOL_CONFIG["SEGMENT_BYTES"]:
+                # Every run writes into new segments, never after another
+                # run's (possibly torn) tail.
+                self._close_writer()
+                self._writing = max(self.segments() + [self.state["segment"] - 1]) + 1
+                os.makedirs(self.path, exist_ok=True)
+                self._writer = open(os.path.join(self.path, _segment_name(self._writing)), "ab")
+            self._writer.write(_HEADER.pack(len(payload), zlib.crc32(payload)))
+            self._writer.write(payload)
+            self._writer.flush()
+            if SPOOL_CONFIG["FSYNC"]:
+                os.fsync(self._writer.fileno())
+            self._positions.append((self._writing, self._writer.tell()))
+
+    def _close_writer(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def commit(self):
+        # The oldest page handed out has loaded: checkpoint past it and drop
+        # segments that are now fully loaded.
+        with self._lock:
+            number, end = self._positions.popleft()
+            self.state.update(segment=number, offset=end)
+            self._write_checkpoint()
+            for old in self.segments():
+                if old < number:
+                    os.remove(os.path.join(self.path, _segment_name(old)))
+
+    def clear(self):
+        # Everything fetched has loaded and the watermark is saved.
+        with self._lock:
+            self._close_writer()
+            for number in self.segments():
+                os.remove(os.path.join(self.path, _segment_name(number)))
+            self._positions.clear()
+            self.state = {"segment": 0, "offset": 0, "fetch_complete": False}
+            try:
+                os.remove(os.path.join(self.path, _CHECKPOINT))
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        with self._lock:
+            self._close_writer()
+
+
+def spool_bytes():
+    # Bytes of spooled pages on disk per entity, loaded or not.
+    sizes = {}
+    try:
+        entities = os.listdir(SPOOL_CONFIG["DIR"])
+    except FileNotFoundError:
+        return sizes
+    for entity_name in entities:
+        directory = os.path.join(SPOOL_CONFIG["DIR"], entity_name)
+        if os.path.isdir(directory):
+            sizes[entity_name] = sum(
+                os.path.getsize(os.path.join(directory, name))
+                for name in os.listdir(directory) if name.endswith(".seg")
+            )
+    return sizes
+
+
+register_collector(lambda: (
+    "fedpipeline_spool_bytes", "gauge", "Spooled page bytes on disk per entity.",
+    {(entity_name,): size for entity_name, size in spool_bytes().items()}, ("entity",),
+))
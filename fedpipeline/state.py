@@ -0,0 +1,119 @@
+import logging
+import pyodbc
+from datetime import datetime, timedelta, timezone
+from fedpipeline.config import SYNC_CONFIG
+from fedpipeline.db_handler import conn_str
+
+
+def parse_timestamp(value):
+    # API timestamps are ISO strings, sometimes with a trailing Z or date-only.
+    # Normalise to naive UTC so they compare with what DATETIME2 hands back.
+    if value is None or isinstance(value, datetime):
+        return value
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def get_watermark(entity_name):
+    try:
+        with pyodbc.connect(conn_str) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT last_updated_at, last_ereserve_id FROM PipelineState WHERE entity = ?",
+                entity_name,
+            )
+            row = cursor.fetchone()
+        if row and row[0] is not None:
+            return row[0], row[1]
+    except Exception as e:
+        logging.error(f"Failed to read {entity_name} watermark, falling back to full sync: {e}")
+    return None
+
+
+def save_watermark(entity_name, watermark):
+    updated_at, ereserve_id = watermark
+    try:
+        with pyodbc.connect(conn_str) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                MERGE INTO PipelineState AS target
+                USING (SELECT ? AS entity, ? AS last_updated_at, ? AS last_ereserve_id) AS source
+                    ON target.entity = source.entity
+                WHEN MATCHED THEN UPDATE SET
+                    last_updated_at = source.last_updated_at,
+                    last_ereserve_id = source.last_ereserve_id,
+                    synced_at = SYSUTCDATETIME()
+                WHEN NOT MATCHED THEN
+                    INSERT (entity, last_updated_at, last_ereserve_id)
+                    VALUES (source.entity, source.last_updated_at, source.last_ereserve_id);
+                """,
+                entity_name, updated_at, ereserve_id,
+            )
+            conn.commit()
+        logging.info(f"{entity_name} watermark advanced to {updated_at} / {ereserve_id}.")
+    except Exception as e:
+        logging.error(f"Failed to save {entity_name} watermark: {e}")
+
+
+def reset_watermark(entity_name):
+    try:
+        with pyodbc.connect(conn_str) as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM PipelineState WHERE entity = ?", entity_name)
+            removed = cursor.rowcount
+            conn.commit()
+        if removed:
+            logging.info(f"{entity_name} watermark cleared; next run is a full resync.")
+        else:
+            logging.warning(f"No watermark stored for {entity_name}.")
+        return bool(removed)
+    except Exception as e:
+        logging.error(f"Failed to clear {entity_name} watermark: {e}")
+        return False
+
+
+def sync_cutoff(watermark):
+    if not watermark:
+        return None
+    return watermark[0] - timedelta(seconds=SYNC_CONFIG["OVERLAP_SECONDS"])
+
+
+def since_params(watermark):
+    cutoff = sync_cutoff(watermark)
+    if cutoff is None:
+        return None
+    return {SYNC_CONFIG["UPDATED_SINCE_PARAM"]: cutoff.isoformat()}
+
+
+def filter_since(items, watermark):
+    # Keep records past the watermark, less the overlap window. The API may
+    # ignore the updated_since hint, so this is the authoritative filter.
+    cutoff = sync_cutoff(watermark)
+    if cutoff is None:
+        return items
+    last_id = watermark[1] or 0
+    kept = []
+    for item in items:
+        updated_at = parse_timestamp(item.get("updated_at"))
+        if updated_at is None or updated_at > cutoff or (updated_at == cutoff and (item.get("id") or 0) > last_id):
+            kept.append(item)
+    return kept
+
+
+def compute_watermark(items, watermark=None):
+    # Highest (updated_at, ereserve_id) seen; never moves backwards.
+    best = watermark
+    for item in items:
+        updated_at = parse_timestamp(item.get("updated_at"))
+        if updated_at is None:
+            continue
+        candidate = (updated_at, item.get("id"))
+        if best is None or (candidate[0], candidate[1] or 0) > (best[0], best[1] or 0):
+            best = candidate
+    return best
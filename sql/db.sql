@@ -1,5 +1,7 @@
 -- ----------------------------------------
 -- Create Database
+-- Base schema. Indexes, compression and later tables are applied on top by
+-- the pipeline's migrations (python -m fedpipeline.main migrate).
 -- ----------------------------------------
 
 CREATE DATABASE eReserveData;
@@ -196,3 +198,57 @@ CREATE TABLE ReadingUtilisation (
     CONSTRAINT FK_ReadingUtilisation_IntegrationUser FOREIGN KEY (integration_user_id) REFERENCES IntegrationUser (ereserve_id)
 );
 GO
+
+-- ----------------------------------------
+-- Table: PipelineState
+-- ----------------------------------------
+
+CREATE TABLE PipelineState (
+    entity NVARCHAR(100) PRIMARY KEY NOT NULL,
+    last_updated_at DATETIME2,
+    last_ereserve_id INT,
+    synced_at DATETIME2 DEFAULT SYSUTCDATETIME()
+);
+GO
+
+-- ----------------------------------------
+-- Table: ReadingUtilisationDaily
+-- Usage summaries, kept current by the pipeline's upserts
+-- (python -m fedpipeline.main rebuild-aggregates recomputes them)
+-- ----------------------------------------
+
+CREATE TABLE ReadingUtilisationDaily (
+    reading_id INT NOT NULL,
+    list_id INT NOT NULL,
+    usage_date DATE,
+    utilisations BIGINT NOT NULL DEFAULT 0,
+    INDEX UX_ReadingUtilisationDaily UNIQUE CLUSTERED (reading_id, list_id, usage_date)
+);
+GO
+
+-- ----------------------------------------
+-- Table: ReadingListItemUsageDaily
+-- ----------------------------------------
+
+CREATE TABLE ReadingListItemUsageDaily (
+    reading_id INT NOT NULL,
+    list_id INT NOT NULL,
+    usage_date DATE,
+    item_usages BIGINT NOT NULL DEFAULT 0,
+    utilisations BIGINT NOT NULL DEFAULT 0,
+    INDEX UX_ReadingListItemUsageDaily UNIQUE CLUSTERED (reading_id, list_id, usage_date)
+);
+GO
+
+-- ----------------------------------------
+-- Table: ReadingListUsageDaily
+-- ----------------------------------------
+
+CREATE TABLE ReadingListUsageDaily (
+    list_id INT NOT NULL,
+    usage_date DATE,
+    list_usages BIGINT NOT NULL DEFAULT 0,
+    item_usages BIGINT NOT NULL DEFAULT 0,
+    INDEX UX_ReadingListUsageDaily UNIQUE CLUSTERED (list_id, usage_date)
+);
+GO
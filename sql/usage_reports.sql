@@ -0,0 +1,30 @@
+-- Usage report queries over the summary tables in db.sql. Each reads a few
+-- summary rows instead of scanning ReadingUtilisation / *Usage.
+USE eReserveData;
+GO
+
+-- Utilisations per reading
+SELECT r.ereserve_id, r.reading_title, SUM(s.utilisations) AS utilisations
+FROM ReadingUtilisationDaily AS s
+JOIN Reading AS r ON r.ereserve_id = s.reading_id
+GROUP BY r.ereserve_id, r.reading_title;
+
+-- Utilisations per unit offering
+SELECT o.ereserve_id, o.source_unit_code, o.source_unit_offering, SUM(s.utilisations) AS utilisations
+FROM ReadingUtilisationDaily AS s
+JOIN UnitOffering AS o ON o.reading_list_id = s.list_id
+GROUP BY o.ereserve_id, o.source_unit_code, o.source_unit_offering;
+
+-- Utilisations per teaching session
+SELECT t.ereserve_id, t.name, SUM(s.utilisations) AS utilisations
+FROM ReadingUtilisationDaily AS s
+JOIN ReadingList AS l ON l.ereserve_id = s.list_id
+JOIN TeachingSession AS t ON t.ereserve_id = l.teaching_session_id
+GROUP BY t.ereserve_id, t.name;
+
+-- Activity per day
+SELECT usage_date, SUM(list_usages) AS list_usages, SUM(item_usages) AS item_usages
+FROM ReadingListUsageDaily
+GROUP BY usage_date
+ORDER BY usage_date;
+GO
@@ -0,0 +1,50 @@
+import pytest
+from unittest.mock import patch
+from fedpipeline import deadletter, fingerprints, http_cache, integrity, ratelimit, spool
+
+
+@pytest.fixture(autouse=True)
+def isolated_fingerprints(tmp_path):
+    # Every test gets its own empty change-detection store.
+    fingerprints.close_store()
+    with patch.dict(fingerprints.FINGERPRINT_CONFIG, {"PATH": str(tmp_path / "fingerprints.sqlite3")}):
+        yield
+    fingerprints.close_store()
+
+
+@pytest.fixture(autouse=True)
+def isolated_http_cache(tmp_path):
+    http_cache.close_http_cache()
+    with patch.dict(http_cache.HTTP_CACHE_CONFIG, {"PATH": str(tmp_path / "http_cache.sqlite3")}):
+        yield
+    http_cache.close_http_cache()
+
+
+@pytest.fixture(autouse=True)
+def fresh_rate_limiters():
+    ratelimit.reset_limiters()
+    yield
+    ratelimit.reset_limiters()
+
+
+@pytest.fixture(autouse=True)
+def isolated_integrity(tmp_path):
+    # Off unless a test opts in: the pre-check reads parent keys from SQL Server.
+    integrity.close_integrity()
+    with patch.dict(integrity.INTEGRITY_CONFIG, {"PATH": str(tmp_path / "orphans.sqlite3"), "ENABLED": False}):
+        yield
+    integrity.close_integrity()
+
+
+@pytest.fixture(autouse=True)
+def isolated_spool(tmp_path):
+    with patch.dict(spool.SPOOL_CONFIG, {"DIR": str(tmp_path / "spool"), "FSYNC": False}):
+        yield
+
+
+@pytest.fixture(autouse=True)
+def isolated_dead_letters(tmp_path):
+    deadletter.close_dead_letters()
+    with patch.dict(deadletter.DEADLETTER_CONFIG, {"PATH": str(tmp_path / "deadletters.sqlite3")}):
+        yield
+    deadletter.close_dead_letters()
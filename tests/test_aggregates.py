@@ -0,0 +1,67 @@
+from unittest.mock import patch, MagicMock
+from fedpipeline import aggregates
+from fedpipeline.db_handler import build_merge_query, upsert_records
+from fedpipeline.entities import ENTITIES
+from fedpipeline.schema import load_schema
+
+
+def test_summary_tables_are_declared_in_db_sql():
+    tables = load_schema()
+    for aggregate in aggregates.AGGREGATES:
+        columns = tables[aggregate.table]
+        assert set(columns) == set(aggregate.groups) | set(aggregate.measures)
+        assert set(aggregate.columns) <= set(tables[aggregate.source])
+    assert tables["ReadingUtilisationDaily"]["usage_date"]["nullable"] is True
+
+
+def test_only_usage_tables_capture_changes():
+    assert aggregates.merge_capture("School") == ((), "")
+    capture, after = aggregates.merge_capture("ReadingUtilisation")
+    assert capture == (("item_id", "INT"), ("created_at", "DATETIME"))
+    assert "MERGE INTO ReadingUtilisationDaily" in after
+    with patch.dict(aggregates.AGGREGATES_CONFIG, {"ENABLED": False}):
+        assert aggregates.merge_capture("ReadingUtilisation") == ((), "")
+
+
+def test_deltas_apply_in_the_same_batch_as_the_merge():
+    entity = ENTITIES["ReadingListUsage"]
+    capture, after = aggregates.merge_capture(entity.table)
+    sql = build_merge_query(entity.table, entity.columns, "ereserve_id", capture, after)
+    assert "new_list_id INT, old_list_id INT" in sql
+    assert "OUTPUT $action, inserted.list_id, deleted.list_id" in sql
+    # Old versions of updated rows come off, new versions go on.
+    assert "SELECT -1, old_list_id AS list_id" in sql
+    # Before the counts are returned, so before the caller commits.
+    assert sql.index("MERGE INTO ReadingListUsageDaily") < sql.index("FROM @changes;")
+
+
+@patch("fedpipeline.db_handler.pyodbc.connect")
+def test_upsert_of_usage_rows_maintains_summaries(mock_connect):
+    conn = MagicMock()
+    conn.__enter__.return_value = conn
+    mock_connect.return_value = conn
+    conn.cursor.return_value.fetchone.return_value = (1, 0)
+    upsert_records(ENTITIES["ReadingUtilisation"].insert_sql, [(1, 2, 3, 4, None, None)], "ReadingUtilisation")
+    statements = [call.args[0] for call in conn.cursor.return_value.execute.call_args_list]
+    merges = [sql for sql in statements if "MERGE INTO ReadingUtilisation " in sql]
+    assert len(merges) == 1 and "MERGE INTO ReadingUtilisationDaily" in merges[0]
+    conn.commit.assert_called()
+
+
+def test_rebuild_recomputes_from_the_base_table():
+    sql = aggregates.rebuild_sql(aggregates.AGGREGATES[0])
+    assert sql.startswith("DELETE FROM ReadingUtilisationDaily; INSERT INTO ReadingUtilisationDaily")
+    assert "FROM (SELECT 1 AS weight, * FROM ReadingUtilisation) AS d JOIN ReadingListItem" in sql
+
+
+@patch("fedpipeline.aggregates.pyodbc.connect")
+def test_rebuild_aggregates_creates_missing_tables(mock_connect):
+    conn = MagicMock()
+    conn.__enter__.return_value = conn
+    mock_connect.return_value = conn
+    cursor = conn.cursor.return_value
+    cursor.fetchone.return_value = (12,)
+    assert aggregates.rebuild_aggregates(["ReadingListUsage"]) == {"ReadingListUsageDaily": 12}
+    create = cursor.execute.call_args_list[0].args[0]
+    assert create.startswith("IF OBJECT_ID('ReadingListUsageDaily') IS NULL CREATE TABLE ReadingListUsageDaily (")
+    assert "INDEX UX_ReadingListUsageDaily UNIQUE CLUSTERED (list_id, usage_date)" in create
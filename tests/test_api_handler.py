@@ -2,8 +2,15 @@ import pytest
 from unittest.mock import patch, Mock
 from fedpipeline import api_handler
 
-@patch("fedpipeline.api_handler.requests.post")
-def test_get_token_success(mock_post):
+@pytest.fixture(autouse=True)
+def fresh_token_cache():
+    api_handler.clear_token_cache()
+    yield
+    api_handler.clear_token_cache()
+
+@patch("fedpipeline.api_handler.get_session")
+def test_get_token_success(mock_session):
+    mock_post = mock_session.return_value.post
     mock_response = Mock()
     mock_response.raise_for_status = Mock()
     mock_response.headers.get.return_value = "Bearer mock_token"
@@ -13,3 +20,142 @@ def test_get_token_success(mock_post):
     assert token == "Bearer mock_token"
 
 
+def page_response(body, links=None):
+    response = Mock()
+    response.raise_for_status = Mock()
+    response.json.return_value = body
+    response.content = b"{}"
+    response.status_code = 200
+    response.headers = {}
+    response.links = links or {}
+    return response
+
+
+@patch("fedpipeline.api_handler.get_session")
+def test_iter_api_pages_follows_next_links(mock_session):
+    mock_get = mock_session.return_value.get
+    mock_get.side_effect = [
+        page_response({"items": [{"id": 1}, {"id": 2}], "links": {"next": "https://api/x?page=2"}}),
+        page_response({"items": [{"id": 3}]}),
+    ]
+    pages = list(api_handler.iter_api_pages("https://api/x", "token", page_size=2))
+
+    assert pages == [[{"id": 1}, {"id": 2}], [{"id": 3}]]
+    assert mock_get.call_args_list[0].kwargs["params"] == {"per_page": 2, "page": 1}
+    assert mock_get.call_args_list[1].args[0] == "https://api/x?page=2"
+
+
+@patch("fedpipeline.api_handler.get_session")
+def test_iter_api_pages_follows_cursors(mock_session):
+    mock_get = mock_session.return_value.get
+    mock_get.side_effect = [
+        page_response({"items": [{"id": 1}], "next_cursor": "abc"}),
+        page_response({"items": [{"id": 2}], "next_cursor": None}),
+    ]
+    pages = list(api_handler.iter_api_pages("https://api/x", "token", page_size=1))
+
+    assert [p[0]["id"] for p in pages] == [1, 2]
+    assert mock_get.call_args_list[1].kwargs["params"]["cursor"] == "abc"
+
+
+@patch("fedpipeline.api_handler.get_session")
+def test_iter_api_pages_follows_page_counts(mock_session):
+    mock_get = mock_session.return_value.get
+    mock_get.side_effect = [
+        page_response({"items": [{"id": 1}], "meta": {"total_pages": 2}}),
+        page_response({"items": [{"id": 2}], "meta": {"total_pages": 2}}),
+    ]
+    pages = list(api_handler.iter_api_pages("https://api/x", "token", page_size=1))
+
+    assert [p[0]["id"] for p in pages] == [1, 2]
+    assert mock_get.call_args_list[1].kwargs["params"]["page"] == 2
+    assert mock_get.call_count == 2
+
+
+@patch("fedpipeline.api_handler.get_session")
+def test_fetch_data_from_api_stops_on_error(mock_session):
+    mock_get = mock_session.return_value.get
+    mock_get.side_effect = Exception("connection reset")
+    assert api_handler.fetch_data_from_api("https://api/x", "token") == []
+
+
+def test_sessions_share_one_pool_across_threads():
+    import threading
+    sessions = []
+    thread = threading.Thread(target=lambda: sessions.append(api_handler.get_session()))
+    thread.start()
+    thread.join()
+    main_session = api_handler.get_session()
+
+    assert sessions[0] is not main_session
+    assert sessions[0].get_adapter("https://x") is main_session.get_adapter("https://x")
+    assert main_session.get_adapter("https://x").max_retries.total == api_handler.HTTP_CONFIG["MAX_RETRIES"]
+    assert "gzip" in main_session.headers["Accept-Encoding"]
+
+
+@patch("fedpipeline.api_handler.get_session")
+def test_requests_use_explicit_timeouts(mock_session):
+    mock_session.return_value.get.return_value = page_response({"items": []})
+    api_handler.fetch_data_from_api("https://api/x", "token")
+    timeout = mock_session.return_value.get.call_args.kwargs["timeout"]
+    assert timeout == (api_handler.HTTP_CONFIG["CONNECT_TIMEOUT"], api_handler.HTTP_CONFIG["READ_TIMEOUT"])
+
+
+def login_response(token):
+    response = Mock()
+    response.raise_for_status = Mock()
+    response.headers = {"Authorization": token}
+    return response
+
+
+def make_jwt(exp):
+    import base64, json
+    claims = base64.urlsafe_b64encode(json.dumps({"exp": exp}).encode()).decode().rstrip("=")
+    return f"Bearer header.{claims}.signature"
+
+
+@patch("fedpipeline.api_handler.get_session")
+def test_get_token_is_cached_until_near_expiry(mock_session):
+    import time
+    mock_post = mock_session.return_value.post
+    mock_post.side_effect = [login_response(make_jwt(time.time() + 3600)), login_response("Bearer second")]
+    before = api_handler.token_cache_stats()
+
+    first = api_handler.get_token()
+    assert api_handler.get_token() == first
+    assert mock_post.call_count == 1
+
+    with patch("fedpipeline.api_handler.time.time", return_value=time.time() + 3590):
+        assert api_handler.get_token() == "Bearer second"
+    stats = api_handler.token_cache_stats()
+    assert stats["hits"] - before["hits"] == 1
+    assert stats["refreshes"] - before["refreshes"] == 2
+
+
+@patch("fedpipeline.api_handler.get_session")
+def test_concurrent_callers_share_one_login(mock_session):
+    import threading
+    mock_session.return_value.post.return_value = login_response("Bearer shared")
+    tokens = []
+    threads = [threading.Thread(target=lambda: tokens.append(api_handler.get_token())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert tokens == ["Bearer shared"] * 8
+    assert mock_session.return_value.post.call_count == 1
+
+
+@patch("fedpipeline.api_handler.get_session")
+def test_fetch_reauthenticates_on_401(mock_session):
+    session = mock_session.return_value
+    session.post.return_value = login_response("Bearer fresh")
+    expired = page_response({})
+    expired.status_code = 401
+    session.get.side_effect = [expired, page_response({"items": [{"id": 1}]})]
+
+    assert api_handler.fetch_data_from_api("https://api/x", "Bearer stale") == [{"id": 1}]
+    assert session.get.call_args.kwargs["headers"] == {"Authorization": "Bearer fresh"}
+    assert session.post.call_count == 1
+
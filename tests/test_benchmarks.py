@@ -0,0 +1,54 @@
+import pytest
+from benchmarks import fake_db
+from benchmarks.datagen import Dataset
+from benchmarks.run import compare, run_benchmark
+from fedpipeline.entities import ENTITIES
+
+
+def test_dataset_is_deterministic_and_fk_consistent():
+    first, second = Dataset(rows=500, seed=7), Dataset(rows=500, seed=7)
+    for name, entity in ENTITIES.items():
+        for index in (0, first.count(name) - 1):
+            item = first.item(name, index)
+            assert item == second.item(name, index)
+            for column, parent in entity.foreign_keys.items():
+                assert 1 <= item[column] <= first.count(parent)
+
+
+def test_dataset_pages_and_updated_since():
+    dataset = Dataset(rows=1000)
+    items, total_pages = dataset.page("ReadingUtilisation", 2, 300)
+    assert total_pages == 4
+    assert [item["id"] for item in items][:2] == [301, 302]
+
+    dataset.touch("ReadingUtilisation", 5)
+    since = Dataset(rows=1000).item("ReadingUtilisation", 999)["updated_at"]
+    from fedpipeline.state import parse_timestamp
+    changed, _ = dataset.page("ReadingUtilisation", 1, 100, parse_timestamp(since))
+    assert [item["id"] for item in changed] == [996, 997, 998, 999, 1000]
+
+
+def test_fake_db_enforces_primary_keys_and_rolls_back():
+    db = fake_db.Database(round_trip_ms=0, row_us=0)
+    conn = db.connect()
+    cursor = conn.cursor()
+    cursor.executemany("INSERT INTO School (ereserve_id, name) VALUES (?, ?)", [(1, "Arts")])
+    conn.commit()
+    with pytest.raises(fake_db.IntegrityError):
+        cursor.executemany("INSERT INTO School (ereserve_id, name) VALUES (?, ?)", [(2, "Law"), (1, "Arts")])
+    conn.rollback()
+    assert db.tables["School"] == {1: (1, "Arts")}
+
+
+def test_benchmark_loads_every_table_and_reports():
+    results = run_benchmark(rows=200, db_round_trip_ms=0, db_row_us=0)
+    cold, warm = results["runs"]
+    for name in ENTITIES:
+        assert cold["db_rows"][ENTITIES[name].table] == results["meta"]["table_rows"][name]
+        assert cold["entities"][name]["rows"] == results["meta"]["table_rows"][name]
+    assert warm["rows"] < cold["rows"]
+    assert cold["unsupported_sql"] == {}
+
+    regressions, table = compare(results, results)
+    assert regressions == []
+    assert "cold/ReadingUtilisation" in table
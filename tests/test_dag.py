@@ -0,0 +1,44 @@
+import threading
+import time
+import pytest
+from fedpipeline import dag
+
+
+def test_topological_order_puts_parents_first():
+    parents = {"ReadingList": ("Unit",), "Unit": (), "ReadingListItem": ("ReadingList", "Reading"), "Reading": ()}
+    order = dag.topological_order(parents)
+    assert order.index("Unit") < order.index("ReadingList") < order.index("ReadingListItem")
+    assert order.index("Reading") < order.index("ReadingListItem")
+
+
+def test_topological_order_rejects_cycles_and_unknown_parents():
+    with pytest.raises(ValueError, match="cycle"):
+        dag.topological_order({"A": ("B",), "B": ("A",)})
+    with pytest.raises(ValueError, match="Unknown"):
+        dag.topological_order({"A": ("Missing",)})
+
+
+def test_run_graph_overlaps_fetches_and_orders_loads():
+    events = []
+    lock = threading.Lock()
+    started = threading.Barrier(3, timeout=5)
+
+    def task(name, fetch_seconds):
+        def run():
+            started.wait()          # all three fetches are in flight together
+            time.sleep(fetch_seconds)
+            dag.wait_for_parents(name)
+            with lock:
+                events.append(name)
+        return run
+
+    parents = {"Parent": (), "Child": ("Parent",), "Grandchild": ("Child",)}
+    tasks = {"Parent": task("Parent", 0.05), "Child": task("Child", 0), "Grandchild": task("Grandchild", 0)}
+    timings = dag.run_graph(tasks, parents, max_workers=3)
+
+    assert events == ["Parent", "Child", "Grandchild"]
+    assert set(timings) == set(parents)
+
+
+def test_wait_for_parents_outside_graph_does_not_block():
+    assert dag.wait_for_parents("ReadingList") is True
@@ -0,0 +1,155 @@
+import pytest
+from unittest.mock import patch, MagicMock
+from fedpipeline import db_handler
+
+
+def make_connection(bad_ids=()):
+    # Cursor that rejects any batch containing one of bad_ids, like a PK/FK violation would.
+    conn = MagicMock()
+    conn.__enter__.return_value = conn
+    cursor = conn.cursor.return_value
+    cursor.committed = []
+    pending = []
+
+    def executemany(query, batch):
+        if any(record[0] in bad_ids for record in batch):
+            raise Exception("constraint violation")
+        pending.extend(batch)
+
+    def commit():
+        cursor.committed.extend(pending)
+        pending.clear()
+
+    cursor.executemany.side_effect = executemany
+    conn.commit.side_effect = commit
+    conn.rollback.side_effect = pending.clear
+    return conn, cursor
+
+
+@patch("fedpipeline.db_handler.pyodbc.connect")
+def test_insert_records_batches(mock_connect):
+    conn, cursor = make_connection()
+    mock_connect.return_value = conn
+    records = [(i, f"School {i}") for i in range(10)]
+
+    stats = db_handler.insert_records("INSERT INTO School VALUES (?, ?)", records, "School", batch_size=4)
+
+    assert cursor.executemany.call_count == 3
+    assert cursor.fast_executemany is True
+    assert cursor.committed == records
+    assert stats["sent"] == 10
+    assert stats["rejected"] == 0
+    assert stats["batches"] == 3
+
+
+@patch("fedpipeline.db_handler.pyodbc.connect")
+def test_insert_records_isolates_bad_rows(mock_connect):
+    conn, cursor = make_connection(bad_ids={3, 6})
+    mock_connect.return_value = conn
+    records = [(i, f"School {i}") for i in range(8)]
+
+    stats = db_handler.insert_records("INSERT INTO School VALUES (?, ?)", records, "School", batch_size=8)
+
+    assert sorted(r[0] for r in cursor.committed) == [0, 1, 2, 4, 5, 7]
+    assert stats["sent"] == 8
+    assert stats["rejected"] == 2
+    assert stats["batches"] == 1
+
+
+@patch("fedpipeline.db_handler.pyodbc.connect")
+def test_insert_records_aggregates_rejection_logging(mock_connect, caplog):
+    bad_ids = set(range(0, 100, 2))
+    conn, cursor = make_connection(bad_ids=bad_ids)
+    cursor.executemany.side_effect = None
+    mock_connect.return_value = conn
+
+    def executemany(query, batch):
+        if any(record[0] in bad_ids for record in batch):
+            raise Exception("23000", 'The INSERT statement conflicted with the FOREIGN KEY constraint "FK_School"')
+    cursor.executemany.side_effect = executemany
+    records = [(i, f"School {i}") for i in range(100)]
+
+    with caplog.at_level("ERROR"):
+        stats = db_handler.insert_records("INSERT INTO School VALUES (?, ?)", records, "School", batch_size=50)
+
+    assert stats["rejected"] == 50
+    assert len(stats["rejected_ids"]) == 50
+    error = stats["errors"]["Exception 23000 FK_School"]
+    assert error["count"] == 50
+    assert error["sample_ids"] == [0, 2, 4, 6, 8]
+    assert set(stats["rejected_errors"].values()) == {"Exception 23000 FK_School"}
+    rejected_lines = [r for r in caplog.records if "rejected with" in r.getMessage()]
+    assert len(rejected_lines) == 1
+    assert "50 records rejected with Exception 23000 FK_School" in rejected_lines[0].getMessage()
+
+
+@patch("fedpipeline.db_handler.pyodbc.connect")
+def test_insert_records_empty(mock_connect):
+    stats = db_handler.insert_records("INSERT INTO School VALUES (?, ?)", [], "School")
+    mock_connect.assert_not_called()
+    assert stats["sent"] == 0
+
+
+SCHOOL_INSERT = "INSERT INTO School (ereserve_id, name) VALUES (?, ?)"
+
+
+def test_parse_insert_query():
+    table, columns = db_handler.parse_insert_query("""
+        INSERT INTO Unit (
+            ereserve_id, code, name
+        ) VALUES (?, ?, ?)
+    """)
+    assert table == "Unit"
+    assert columns == ("ereserve_id", "code", "name")
+
+
+@patch("fedpipeline.db_handler.pyodbc.connect")
+def test_upsert_records_reports_merge_counts(mock_connect):
+    conn, cursor = make_connection()
+    mock_connect.return_value = conn
+    cursor.fetchone.return_value = (2, 1)
+    records = [(1, "Arts"), (2, "Law"), (3, "Science"), (4, "Music"), (2, "Law")]
+
+    stats = db_handler.upsert_records(SCHOOL_INSERT, records, "School")
+
+    merges = [c for c in cursor.execute.call_args_list if "MERGE INTO School" in c.args[0]]
+    assert len(merges) == 1
+    assert merges[0].args[1:] == (1, 4)
+    assert sorted(cursor.committed) == [(1, "Arts"), (2, "Law"), (3, "Science"), (4, "Music")]
+    assert stats["sent"] == 4
+    assert (stats["inserted"], stats["updated"], stats["unchanged"]) == (2, 1, 1)
+
+
+@patch("fedpipeline.db_handler.pyodbc.connect")
+def test_upsert_records_isolates_failing_key(mock_connect):
+    conn, cursor = make_connection()
+    mock_connect.return_value = conn
+
+    def execute(query, *params):
+        if "MERGE INTO" in query:
+            low, high = params
+            if low <= 3 <= high:
+                raise Exception("FK violation")
+            cursor.fetchone.return_value = (high - low + 1, 0)
+
+    cursor.execute.side_effect = execute
+    records = [(i, f"School {i}") for i in range(1, 5)]
+
+    stats = db_handler.upsert_records(SCHOOL_INSERT, records, "School")
+
+    assert stats["rejected"] == 1
+    assert stats["inserted"] == 3
+    assert stats["unchanged"] == 0
+
+
+@patch("fedpipeline.db_handler.upsert_records")
+@patch("fedpipeline.db_handler.insert_records")
+def test_load_records_dispatches_on_mode(mock_insert, mock_upsert):
+    with patch.dict(db_handler.LOAD_CONFIG, {"MODE": "insert"}):
+        db_handler.load_records(SCHOOL_INSERT, [(1, "Arts")], "School")
+    mock_insert.assert_called_once()
+    mock_upsert.assert_not_called()
+
+    with patch.dict(db_handler.LOAD_CONFIG, {"MODE": "upsert"}):
+        db_handler.load_records(SCHOOL_INSERT, [(1, "Arts")], "School")
+    mock_upsert.assert_called_once()
@@ -0,0 +1,109 @@
+import json
+from unittest.mock import patch
+import pytest
+from fedpipeline import deadletter
+from fedpipeline.entities import ENTITIES
+
+
+@pytest.fixture
+def due_now():
+    with patch.dict(deadletter.DEADLETTER_CONFIG, {"RETRY_BASE_SECONDS": 0}):
+        yield
+
+
+def stored(entity_name):
+    return deadletter._connect().execute(
+        "SELECT ereserve_id, payload, stage, error_class, attempts, next_attempt - last_failed"
+        " FROM dead_letters WHERE entity = ? ORDER BY ereserve_id", (entity_name,)
+    ).fetchall()
+
+
+def load_stats(rejected=()):
+    errors = {"IntegrityError 23000 FK_x": {"count": len(rejected), "sample_ids": [], "message": "FK conflict"}}
+    return {
+        "failed": False, "rejected": len(rejected), "rejected_ids": list(rejected),
+        "rejected_errors": {key: "IntegrityError 23000 FK_x" for key in rejected}, "errors": errors,
+    }
+
+
+def test_failures_keep_the_raw_payload_and_back_off():
+    entity = ENTITIES["School"]
+    items = [{"id": 1, "name": "Arts", "extra": "kept"}, {"id": 2, "name": "Law"}]
+    deadletter.record(entity, deadletter.load_failures(load_stats([1])), items=items)
+    deadletter.record(entity, deadletter.load_failures(load_stats([1])), items=items, attempt=True)
+
+    [(key, payload, stage, error_class, attempts, wait)] = stored("School")
+    assert (key, stage, error_class, attempts) == (1, "load", "IntegrityError 23000 FK_x", 2)
+    assert json.loads(payload) == items[0]
+    assert wait == 2 * deadletter.DEADLETTER_CONFIG["RETRY_BASE_SECONDS"]
+
+
+def test_repeated_syncs_do_not_count_attempts():
+    entity = ENTITIES["School"]
+    items = [{"id": 1, "name": "Arts"}]
+    deadletter.record(entity, deadletter.load_failures(load_stats([1])), items=items)
+    [(next_attempt,)] = deadletter._connect().execute("SELECT next_attempt FROM dead_letters").fetchall()
+    for name in ("Arts II", "Arts III", "Arts IV"):
+        deadletter.record(entity, deadletter.load_failures(load_stats([1])), items=[{"id": 1, "name": name}])
+
+    [(_, payload, _, _, attempts, _)] = stored("School")
+    assert attempts == 1
+    assert json.loads(payload) == {"id": 1, "name": "Arts IV"}
+    assert deadletter._connect().execute("SELECT next_attempt FROM dead_letters").fetchall() == [(next_attempt,)]
+
+
+def test_rows_without_an_item_are_stored_under_field_names():
+    entity = ENTITIES["School"]
+    deadletter.record(entity, deadletter.coercion_failures([(5, "name: too long")]), rows=[(5, "x" * 10)])
+    [(key, payload, stage, error_class, _, _)] = stored("School")
+    assert json.loads(payload) == {"id": 5, "name": "x" * 10}
+    assert (stage, error_class) == ("transform", "CoercionError name")
+
+
+@patch("fedpipeline.deadletter.load_records")
+def test_replay_loads_due_rows_and_keeps_the_rest(mock_load, due_now):
+    entity = ENTITIES["School"]
+    items = [{"id": key, "name": f"School {key}"} for key in (1, 2, 3)]
+    deadletter.record(entity, deadletter.load_failures(load_stats([1, 2, 3])), items=items)
+    mock_load.return_value = load_stats([2])
+
+    with patch.dict(deadletter.DEADLETTER_CONFIG, {"BATCH_SIZE": 2}):
+        report = deadletter.replay_entity(entity)
+
+    assert report == {"retried": 3, "loaded": 2, "failed": 1}
+    assert [call.args[1] for call in mock_load.call_args_list] == [
+        [(1, "School 1"), (2, "School 2")], [(3, "School 3")],
+    ]
+    assert [(key, attempts) for key, _, _, _, attempts, _ in stored("School")] == [(2, 2)]
+
+
+@patch("fedpipeline.deadletter.load_records")
+def test_replay_waits_for_the_retry_spacing_unless_forced(mock_load):
+    entity = ENTITIES["School"]
+    deadletter.record(entity, deadletter.load_failures(load_stats([1])), items=[{"id": 1, "name": "Arts"}])
+    mock_load.return_value = load_stats()
+
+    assert deadletter.replay() == {"School": {"retried": 0, "loaded": 0, "failed": 0}}
+    mock_load.assert_not_called()
+    assert deadletter.replay(["School"], force=True) == {"School": {"retried": 1, "loaded": 1, "failed": 0}}
+    assert deadletter.dead_letter_counts() == {}
+
+
+@patch("fedpipeline.deadletter.load_records")
+def test_failed_load_does_not_count_an_attempt(mock_load, due_now):
+    entity = ENTITIES["School"]
+    deadletter.record(entity, deadletter.load_failures(load_stats([1])), items=[{"id": 1, "name": "Arts"}])
+    mock_load.return_value = dict(load_stats(), failed=True)
+
+    assert deadletter.replay_entity(entity) == {"retried": 0, "loaded": 0, "failed": 0}
+    assert [attempts for _, _, _, _, attempts, _ in stored("School")] == [1]
+
+
+def test_loaded_keys_are_resolved():
+    entity = ENTITIES["School"]
+    items = [{"id": 1, "name": "Arts"}, {"id": 2, "name": "Law"}]
+    deadletter.record(entity, deadletter.load_failures(load_stats([1, 2])), items=items)
+    deadletter.resolve("School", [1])
+    assert deadletter.dead_letter_keys("School") == [2]
+    deadletter.forget("School")
+    assert deadletter.dead_letter_counts() == {}
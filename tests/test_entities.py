@@ -0,0 +1,33 @@
+import pytest
+from fedpipeline import entities, dag
+from fedpipeline.config import API_CONFIG
+
+
+def test_registry_covers_every_endpoint_and_forms_a_dag():
+    assert {entity.endpoint for entity in entities.ENTITIES.values()} == set(API_CONFIG) - {"LOGIN_URL"}
+    order = dag.topological_order(entities.entity_parents())
+    assert order.index("Unit") < order.index("ReadingList") < order.index("UnitOffering")
+    assert order.index("ReadingListUsage") < order.index("ReadingListItemUsage")
+
+
+def test_projector_matches_payload_fields():
+    entity = entities.ENTITIES["Unit"]
+    rows = entity.project([{"id": 4, "code": "CS101", "name": "Intro to CS", "extra": 1}])
+    assert rows == [(4, "CS101", "Intro to CS")]
+
+
+def test_projector_fills_missing_fields_with_none():
+    entity = entities.ENTITIES["TeachingSession"]
+    rows = entity.project([
+        {"id": 6, "name": "Semester 1", "start_date": "2024-02-01", "end_date": "2024-06-01",
+         "archived": False, "created_at": "2024-01-15", "updated_at": "2024-01-16"},
+        {"id": 7, "name": "Semester 2"},
+    ])
+    assert rows[0] == (6, "Semester 1", "2024-02-01", "2024-06-01", False, "2024-01-15", "2024-01-16")
+    assert rows[1] == (7, "Semester 2", None, None, None, None, None)
+
+
+def test_insert_sql_is_prepared_once_per_entity():
+    entity = entities.ENTITIES["School"]
+    assert entity.insert_sql == "INSERT INTO School (ereserve_id, name) VALUES (?, ?)"
+    assert entity.insert_sql is entities.ENTITIES["School"].insert_sql
@@ -0,0 +1,66 @@
+import pytest
+import sqlite3
+from datetime import datetime, date
+from unittest.mock import patch, MagicMock
+from fedpipeline import fingerprints
+from fedpipeline.entities import ENTITIES
+
+
+def test_unchanged_rows_are_skipped_after_a_load():
+    rows = [(1, "Arts"), (2, "Law")]
+    assert fingerprints.filter_changed("School", rows) == rows
+    fingerprints.record_loaded("School", rows)
+
+    assert fingerprints.filter_changed("School", [(1, "Arts"), (2, "Law & Justice"), (3, "Music")]) == [
+        (2, "Law & Justice"), (3, "Music")
+    ]
+    stats = fingerprints.fingerprint_stats()["School"]
+    assert (stats["hits"], stats["misses"]) == (1, 4)
+
+
+def test_rejected_rows_are_not_remembered():
+    fingerprints.record_loaded("School", [(1, "Arts"), (2, "Law")], rejected_ids=[2])
+    assert fingerprints.filter_changed("School", [(1, "Arts"), (2, "Law")]) == [(2, "Law")]
+
+
+def test_fingerprints_survive_restart():
+    fingerprints.record_loaded("Unit", [(4, "CS101", "Intro to CS")])
+    fingerprints.close_store()
+    assert fingerprints.filter_changed("Unit", [(4, "CS101", "Intro to CS")]) == []
+
+
+def test_api_and_database_values_hash_alike():
+    api_row = (6, "Semester 1", "2024-02-01", "2024-06-01", False, "2024-01-15T00:00:00Z", "2024-01-16T09:30:00Z")
+    db_row = (6, "Semester 1", date(2024, 2, 1), date(2024, 6, 1), False,
+              datetime(2024, 1, 15), datetime(2024, 1, 16, 9, 30))
+    assert fingerprints.fingerprint(api_row) == fingerprints.fingerprint(db_row)
+
+
+@patch("fedpipeline.fingerprints.pyodbc.connect")
+def test_rebuild_from_database_reports_drift(mock_connect):
+    fingerprints.record_loaded("School", [(1, "Arts"), (2, "Law"), (9, "Gone")])
+    conn = MagicMock()
+    conn.__enter__.return_value = conn
+    conn.cursor.return_value.fetchmany.side_effect = [[(1, "Arts"), (2, "Law (renamed)"), (3, "Music")], []]
+    mock_connect.return_value = conn
+
+    report = fingerprints.rebuild_from_database(ENTITIES["School"])
+
+    assert report == {"matched": 1, "stale": 1, "missing_in_db": 1, "rows": 3}
+    assert fingerprints.filter_changed("School", [(9, "Gone"), (3, "Music")]) == [(9, "Gone")]
+
+
+def test_changes_from_another_process_are_picked_up():
+    rows = [(1, "Arts"), (2, "Law")]
+    fingerprints.record_loaded("School", rows)
+    assert fingerprints.filter_changed("School", rows) == []
+
+    # e.g. `resync School` run from the CLI while the scheduler is up.
+    other = sqlite3.connect(fingerprints.FINGERPRINT_CONFIG["PATH"])
+    other.execute("DELETE FROM fingerprints WHERE entity = 'School'")
+    other.execute("UPDATE generations SET generation = generation + 1 WHERE entity = 'School'")
+    other.execute("INSERT OR IGNORE INTO generations (entity, generation) VALUES ('School', 1)")
+    other.commit()
+    other.close()
+
+    assert fingerprints.filter_changed("School", rows) == rows
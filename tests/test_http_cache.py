@@ -0,0 +1,88 @@
+import json
+import pytest
+from unittest.mock import patch, Mock
+from fedpipeline import api_handler, http_cache
+
+
+def response(body=None, status=200, etag=None, links=None):
+    resp = Mock()
+    resp.status_code = status
+    resp.raise_for_status = Mock()
+    resp.headers = {"ETag": etag} if etag else {}
+    resp.content = json.dumps(body).encode() if body is not None else b""
+    resp.json.return_value = body
+    resp.links = links or {}
+    return resp
+
+
+def fetch(url="https://api/schools", skip_unchanged=True):
+    return list(api_handler.iter_api_pages(url, "token", entity_name="School", skip_unchanged=skip_unchanged))
+
+
+@patch("fedpipeline.api_handler.get_session")
+def test_pages_are_revalidated_only_after_commit(mock_session):
+    get = mock_session.return_value.get
+    get.return_value = response({"items": [{"id": 1}]}, etag='"v1"')
+
+    assert fetch() == [[{"id": 1}]]
+    assert fetch() == [[{"id": 1}]]
+    assert "If-None-Match" not in get.call_args.kwargs["headers"]
+
+    http_cache.commit("School")
+    get.return_value = response(status=304)
+    assert fetch() == []
+    assert get.call_args.kwargs["headers"]["If-None-Match"] == '"v1"'
+    stats = http_cache.http_cache_stats()["School"]
+    assert stats["hits"] == 1
+    assert stats["bytes_saved"] == len(json.dumps({"items": [{"id": 1}]}))
+
+
+@patch("fedpipeline.api_handler.get_session")
+def test_discarded_pages_are_downloaded_again(mock_session):
+    get = mock_session.return_value.get
+    get.return_value = response({"items": [{"id": 1}]}, etag='"v1"')
+    fetch()
+    http_cache.discard("School")
+    http_cache.commit("School")
+    fetch()
+    assert "If-None-Match" not in get.call_args.kwargs["headers"]
+
+
+@patch("fedpipeline.api_handler.get_session")
+def test_not_modified_serves_cached_body_to_plain_fetches(mock_session):
+    get = mock_session.return_value.get
+    get.return_value = response({"items": [{"id": 1}, {"id": 2}]}, etag='"v1"')
+    assert api_handler.fetch_data_from_api("https://api/units", "token") == [{"id": 1}, {"id": 2}]
+
+    get.return_value = response(status=304)
+    assert api_handler.fetch_data_from_api("https://api/units", "token") == [{"id": 1}, {"id": 2}]
+
+
+@patch("fedpipeline.api_handler.get_session")
+def test_unchanged_pages_still_lead_to_the_next_page(mock_session):
+    get = mock_session.return_value.get
+    get.side_effect = [
+        response({"items": [{"id": 1}]}, etag='"p1"', links={"next": {"url": "https://api/schools?page=2"}}),
+        response({"items": [{"id": 2}]}, etag='"p2"'),
+    ]
+    assert fetch() == [[{"id": 1}], [{"id": 2}]]
+    http_cache.commit("School")
+
+    get.side_effect = [response(status=304), response({"items": [{"id": 3}]}, etag='"p2b"')]
+    assert fetch() == [[{"id": 3}]]
+    assert get.call_args.args[0] == "https://api/schools?page=2"
+
+
+@patch("fedpipeline.api_handler.get_session")
+def test_cache_is_bounded(mock_session):
+    get = mock_session.return_value.get
+    for n in range(5):
+        get.return_value = response({"items": [{"id": n, "name": "x" * 2000}]}, etag=f'"{n}"')
+        fetch(f"https://api/schools/{n}")
+        http_cache.commit("School")
+
+    with patch.dict(http_cache.HTTP_CACHE_CONFIG, {"MAX_BYTES": 100}):
+        http_cache.commit("School")
+    assert http_cache.lookup("School", http_cache.request_key("https://api/schools/0", {"per_page": 500, "page": 1})) is None
+    keys = [key for key, in http_cache._connect().execute("SELECT key FROM http_cache")]
+    assert len(keys) <= 1
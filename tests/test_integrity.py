@@ -0,0 +1,118 @@
+from unittest.mock import patch, MagicMock
+import pytest
+from fedpipeline import integrity
+from fedpipeline.entities import ENTITIES
+
+
+def keys_connection(tables):
+    # pyodbc stand-in answering "SELECT ereserve_id FROM <table>".
+    conn = MagicMock()
+    conn.__enter__.return_value = conn
+    cursor = conn.cursor.return_value
+    pending = []
+
+    def execute(query):
+        table = query.rsplit(" ", 1)[-1]
+        pending[:] = [[(key,) for key in tables.get(table, [])], []]
+
+    cursor.execute.side_effect = execute
+    cursor.fetchmany.side_effect = lambda size: pending.pop(0) if pending else []
+    return conn
+
+
+@pytest.fixture
+def enabled():
+    with patch.dict(integrity.INTEGRITY_CONFIG, {"ENABLED": True}):
+        yield
+
+
+def item(ereserve_id, list_id, reading_id):
+    return (ereserve_id, list_id, reading_id, "active", False, 0, "high", 0, "2024-01-01", "2024-01-01")
+
+
+def test_key_index_merges_recent_keys():
+    index = integrity.KeyIndex([5, 1, 3])
+    assert 3 in index and 4 not in index
+    index.add(range(10, 5000))
+    assert 4999 in index and 1 in index
+    assert len(index) == 3 + 4990
+
+
+@patch("fedpipeline.integrity.pyodbc.connect")
+def test_orphans_are_split_out_per_relationship(mock_connect, enabled):
+    mock_connect.return_value = keys_connection({"ReadingList": [1, 2], "Reading": [10]})
+    ready, orphans = integrity.split_orphans(ENTITIES["ReadingListItem"], [
+        item(100, 1, 10), item(101, 3, 10), item(102, 2, 11), item(103, None, 10),
+    ])
+    assert [row[0] for row in ready] == [100, 103]
+    assert [(row[0], missing) for row, missing in orphans] == [
+        (101, [("list_id", "ReadingList")]), (102, [("reading_id", "Reading")]),
+    ]
+
+
+@patch("fedpipeline.integrity.pyodbc.connect")
+def test_parked_rows_are_released_when_parent_arrives(mock_connect, enabled):
+    mock_connect.return_value = keys_connection({"ReadingList": [1], "Reading": [10]})
+    entity = ENTITIES["ReadingListItem"]
+    _, orphans = integrity.split_orphans(entity, [item(101, 3, 10)])
+    integrity.park(entity.name, orphans)
+    assert integrity.orphan_stats() == {("ReadingListItem", "list_id", "ReadingList"): 1}
+    assert integrity.children_waiting_on("ReadingList") == ["ReadingListItem"]
+    assert integrity.release_ready(entity) == []
+
+    integrity.record_keys("ReadingList", [3])
+    released = integrity.release_ready(entity)
+    assert released == [item(101, 3, 10)]
+    assert integrity.parked_counts() == {"ReadingListItem": 1}
+    integrity.resolve(entity.name, [101])
+    assert integrity.parked_counts() == {}
+
+
+@patch("fedpipeline.integrity.pyodbc.connect")
+def test_expired_orphans_are_released_anyway(mock_connect, enabled):
+    mock_connect.return_value = keys_connection({"ReadingList": [], "Reading": []})
+    entity = ENTITIES["ReadingListItem"]
+    integrity.park(entity.name, integrity.split_orphans(entity, [item(101, 3, 10)])[1])
+    with patch.dict(integrity.INTEGRITY_CONFIG, {"MAX_PARK_HOURS": -1}):
+        assert integrity.release_ready(entity) == [item(101, 3, 10)]
+
+
+@patch("fedpipeline.integrity.pyodbc.connect", side_effect=Exception("no database"))
+def test_unreadable_parent_disables_the_check(mock_connect, enabled):
+    rows = [item(101, 3, 10)]
+    assert integrity.split_orphans(ENTITIES["ReadingListItem"], rows) == (rows, [])
+
+
+@patch("fedpipeline.integrity.pyodbc.connect")
+def test_unreadable_parent_is_retried_after_a_back_off(mock_connect, enabled):
+    rows = [item(101, 3, 10)]
+    mock_connect.side_effect = Exception("no database")
+    assert integrity.split_orphans(ENTITIES["ReadingListItem"], rows) == (rows, [])
+    mock_connect.side_effect = None
+    mock_connect.return_value = keys_connection({"ReadingList": [1], "Reading": [10]})
+    assert integrity.split_orphans(ENTITIES["ReadingListItem"], rows) == (rows, [])
+
+    with patch.dict(integrity.INTEGRITY_CONFIG, {"SEED_RETRY_SECONDS": 0}):
+        ready, orphans = integrity.split_orphans(ENTITIES["ReadingListItem"], rows)
+    assert ready == [] and [row for row, _ in orphans] == rows
+
+
+@patch("fedpipeline.integrity.pyodbc.connect")
+def test_parent_keys_are_read_without_the_global_lock(mock_connect, enabled):
+    conn = keys_connection({"ReadingList": [1], "Reading": [10]})
+    scan = conn.cursor.return_value.fetchmany.side_effect
+    free = []
+
+    def fetchmany(size):
+        # Other entities and /metrics must not wait behind the scan.
+        free.append(integrity._lock.acquire(timeout=1))
+        integrity._lock.release()
+        # A parent row loaded mid-scan isn't lost.
+        integrity.record_keys("ReadingList", [3])
+        return scan(size)
+
+    conn.cursor.return_value.fetchmany.side_effect = fetchmany
+    mock_connect.return_value = conn
+    ready, orphans = integrity.split_orphans(ENTITIES["ReadingListItem"], [item(101, 3, 10)])
+    assert all(free) and free
+    assert [row[0] for row in ready] == [101] and orphans == []
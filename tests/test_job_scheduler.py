@@ -0,0 +1,118 @@
+import pytest
+from unittest.mock import patch
+from fedpipeline import job_scheduler
+from fedpipeline.entities import ENTITIES
+
+
+@patch("fedpipeline.jobs.sync_entity")
+@patch("fedpipeline.job_scheduler.get_token", return_value="fake_token")
+def test_job_runs_every_entity(mock_token, mock_sync):
+    job_scheduler.job()
+    called = sorted(call.args[0].name for call in mock_sync.call_args_list)
+    assert called == sorted(ENTITIES)
+    assert all(call.args[1] == "fake_token" for call in mock_sync.call_args_list)
+
+
+@patch("fedpipeline.job_scheduler.run_graph")
+@patch("fedpipeline.job_scheduler.get_token", return_value=None)
+def test_job_aborts_without_token(mock_token, mock_run_graph):
+    job_scheduler.job()
+    mock_run_graph.assert_not_called()
+
+
+@patch("fedpipeline.jobs.sync_entity")
+@patch("fedpipeline.job_scheduler.get_token", return_value="fake_token")
+def test_run_entity(mock_token, mock_sync):
+    assert job_scheduler.run_entity("Unit") is mock_sync.return_value
+    mock_sync.assert_called_once_with(ENTITIES["Unit"], "fake_token")
+
+
+class FixedRandom:
+    # Deterministic stand-in for random: no jitter, first runs immediately.
+    def uniform(self, low, high):
+        return low if low == 0 else (low + high) / 2
+
+
+def test_next_interval_narrows_on_changes_and_widens_when_quiet():
+    state = {"interval": 120, "min": 60, "max": 600}
+    assert job_scheduler.next_interval(state, 10) == 60
+    assert job_scheduler.next_interval(state, 0) == 180
+    assert job_scheduler.next_interval(state, None) == 120
+    assert job_scheduler.next_interval(dict(state, interval=500), 0) == 600
+
+
+def test_initial_schedule_uses_per_entity_bounds():
+    plan = job_scheduler.initial_schedule(1000, FixedRandom())
+    low, high = job_scheduler.SCHEDULER_CONFIG["INTERVALS"]["School"]
+    assert (plan["School"]["min"], plan["School"]["max"]) == (low, high)
+    assert all(state["next_run"] == 1000 for state in plan.values())
+
+
+def test_children_wait_for_running_parents():
+    plan = job_scheduler.initial_schedule(0, FixedRandom())
+    parents = {"School": [], "ReadingList": ["School"]}
+    plan = {name: plan[name] for name in parents}
+    plan["School"]["running"] = True
+    assert job_scheduler.due_entities(plan, 0, parents) == []
+    plan["School"]["running"] = False
+    assert sorted(job_scheduler.due_entities(plan, 0, parents)) == ["ReadingList", "School"]
+
+
+def test_failed_load_keeps_the_interval():
+    plan = job_scheduler.initial_schedule(0, FixedRandom())
+    interval = plan["School"]["interval"]
+    stats = {"load": {"rows": 0}, "rejected": 0, "failed": True}
+    job_scheduler.finish_run(plan, "School", stats, 100, {"School": []}, FixedRandom())
+    assert plan["School"]["interval"] == interval
+    assert plan["School"]["last_changes"] is None
+
+
+def test_rejections_pull_parents_forward():
+    plan = job_scheduler.initial_schedule(0, FixedRandom())
+    plan["School"]["next_run"] = 5000
+    stats = {"load": {"rows": 3}, "rejected": 2}
+    job_scheduler.finish_run(plan, "ReadingList", stats, 100, {"ReadingList": ["School", "Unit"]}, FixedRandom())
+    assert plan["School"]["next_run"] == 100
+    assert plan["ReadingList"]["next_run"] == 100 + plan["ReadingList"]["interval"]
+    assert not plan["ReadingList"]["running"]
+
+
+@patch("fedpipeline.job_scheduler.run_entity")
+def test_adaptive_loop_runs_each_entity_once_per_interval(mock_run):
+    mock_run.return_value = {"load": {"rows": 0}}
+    clock = {"now": 0.0}
+    calls = []
+
+    def stop():
+        calls.append(clock["now"])
+        clock["now"] += 1
+        return clock["now"] > 50
+
+    with patch("fedpipeline.job_scheduler.time.sleep"):
+        plan = job_scheduler.run_adaptive(stop=stop, now=lambda: clock["now"], rng=FixedRandom())
+    assert sorted(call.args[0] for call in mock_run.call_args_list) == sorted(ENTITIES)
+    # Nothing changed, so every entity backed off from its minimum interval.
+    assert all(state["interval"] > state["min"] for state in plan.values())
+    # No run overlapped the next one.
+    assert all(state["coalesced"] == 0 for state in plan.values())
+
+
+def test_run_brought_forward_mid_run_starts_when_it_finishes():
+    plan = job_scheduler.initial_schedule(0, FixedRandom())
+    plan["School"].update(running=True, next_run=float("inf"))
+    job_scheduler.finish_run(plan, "ReadingList", {"load": {"rows": 1}, "rejected": 1}, 100,
+                             {"ReadingList": ["School"]}, FixedRandom())
+    assert plan["School"]["next_run"] == 100
+    # run_adaptive notices it came due while running...
+    plan["School"].update(pending=True, coalesced=1, next_run=float("inf"))
+    # ...and it's due again the moment the run ends.
+    job_scheduler.finish_run(plan, "School", {"load": {"rows": 0}}, 130, {}, FixedRandom())
+    assert plan["School"]["next_run"] == 130 and not plan["School"]["pending"]
+
+
+@patch("fedpipeline.job_scheduler.run_adaptive")
+@patch("fedpipeline.job_scheduler.job")
+def test_start_scheduler_runs_full_pass_before_adaptive(mock_job, mock_adaptive):
+    job_scheduler.start_scheduler()
+    mock_job.assert_called_once()
+    mock_adaptive.assert_called_once()
@@ -1,4 +1,5 @@
 import pytest
+from datetime import datetime
 from unittest.mock import patch
 from fedpipeline import jobs
 
@@ -6,12 +7,18 @@ from fedpipeline import jobs
 def dummy_token():
     return "fake_token"
 
+@pytest.fixture(autouse=True)
+def no_watermarks():
+    with patch("fedpipeline.jobs.get_watermark", return_value=None), \
+         patch("fedpipeline.jobs.save_watermark") as mock_save:
+        yield mock_save
+
 # ----------- Test Cases for Each Processing Function -----------
 
-@patch("fedpipeline.jobs.fetch_data_from_api")
-@patch("fedpipeline.jobs.insert_records")
-def test_process_integration_users(mock_insert, mock_fetch, dummy_token):
-    mock_fetch.return_value = [{
+@patch("fedpipeline.jobs.iter_api_pages")
+@patch("fedpipeline.jobs.load_records")
+def test_process_integration_users(mock_load, mock_fetch, dummy_token):
+    mock_fetch.return_value = [[{
         "id": 1,
         "identifier": "ABC123",
         "roles": ["user"],
@@ -22,23 +29,23 @@ def test_process_integration_users(mock_insert, mock_fetch, dummy_token):
         "lti_lis_person_sourcedid": "LIS456",
         "created_at": "2024-01-01T00:00:00Z",
         "updated_at": "2024-01-02T00:00:00Z"
-    }]
+    }]]
     jobs.process_integration_users(dummy_token)
-    mock_insert.assert_called_once()
+    mock_load.assert_called_once()
     
-@patch("fedpipeline.jobs.fetch_data_from_api")
-@patch("fedpipeline.jobs.insert_records")
+@patch("fedpipeline.jobs.iter_api_pages")
+@patch("fedpipeline.jobs.load_records")
     #Test the process_schools function
-def test_process_schools(mock_insert, mock_fetch, dummy_token):
-        mock_fetch.return_value = [{"id": 2, "name": "Engineering"}]
+def test_process_schools(mock_load, mock_fetch, dummy_token):
+        mock_fetch.return_value = [[{"id": 2, "name": "Engineering"}]]
         jobs.process_schools(dummy_token)
-        mock_insert.assert_called_once()
+        mock_load.assert_called_once()
 
-@patch("fedpipeline.jobs.fetch_data_from_api")
-@patch("fedpipeline.jobs.insert_records")
-def test_process_readings(mock_insert, mock_fetch, dummy_token):
+@patch("fedpipeline.jobs.iter_api_pages")
+@patch("fedpipeline.jobs.load_records")
+def test_process_readings(mock_load, mock_fetch, dummy_token):
   #  Test the process_readings function with dummy reading data.
-    mock_fetch.return_value = [{
+    mock_fetch.return_value = [[{
         "id": 3,
         "reading_title": "IoT Basics",
         "genre": "Tech",
@@ -46,23 +53,23 @@ def test_process_readings(mock_insert, mock_fetch, dummy_token):
         "article_number": "A123",
         "created_at": "2024-03-01",
         "updated_at": "2024-03-02"
-    }]
+    }]]
     jobs.process_readings(dummy_token)
-    mock_insert.assert_called_once()
+    mock_load.assert_called_once()
 
-@patch("fedpipeline.jobs.fetch_data_from_api")
-@patch("fedpipeline.jobs.insert_records")
-def test_process_units(mock_insert, mock_fetch, dummy_token):
+@patch("fedpipeline.jobs.iter_api_pages")
+@patch("fedpipeline.jobs.load_records")
+def test_process_units(mock_load, mock_fetch, dummy_token):
    # Verifies processing of units and insert call.
-    mock_fetch.return_value = [{"id": 4, "code": "CS101", "name": "Intro to CS"}]
+    mock_fetch.return_value = [[{"id": 4, "code": "CS101", "name": "Intro to CS"}]]
     jobs.process_units(dummy_token)
-    mock_insert.assert_called_once()
+    mock_load.assert_called_once()
     
-@patch("fedpipeline.jobs.fetch_data_from_api")
-@patch("fedpipeline.jobs.insert_records")
-def test_process_unit_offerings(mock_insert, mock_fetch, dummy_token):
+@patch("fedpipeline.jobs.iter_api_pages")
+@patch("fedpipeline.jobs.load_records")
+def test_process_unit_offerings(mock_load, mock_fetch, dummy_token):
     # Ensure process_unit_offerings correctly handles fetched data.
-    mock_fetch.return_value = [{
+    mock_fetch.return_value = [[{
         "id": 5,
         "unit_id": 4,
         "reading_list_id": 8,
@@ -73,15 +80,15 @@ def test_process_unit_offerings(mock_insert, mock_fetch, dummy_token):
         "list_publication_method": "Manual",
         "created_at": "2024-04-01",
         "updated_at": "2024-04-02"
-    }]
+    }]]
     jobs.process_unit_offerings(dummy_token)
-    mock_insert.assert_called_once()
+    mock_load.assert_called_once()
     
-@patch("fedpipeline.jobs.fetch_data_from_api")
-@patch("fedpipeline.jobs.insert_records")
-def test_process_teaching_sessions(mock_insert, mock_fetch, dummy_token):
+@patch("fedpipeline.jobs.iter_api_pages")
+@patch("fedpipeline.jobs.load_records")
+def test_process_teaching_sessions(mock_load, mock_fetch, dummy_token):
     # Test for teaching session data integration.
-    mock_fetch.return_value = [{
+    mock_fetch.return_value = [[{
         "id": 6,
         "name": "Semester 1",
         "start_date": "2024-02-01",
@@ -89,15 +96,15 @@ def test_process_teaching_sessions(mock_insert, mock_fetch, dummy_token):
         "archived": False,
         "created_at": "2024-01-15",
         "updated_at": "2024-01-16"
-    }]
+    }]]
     jobs.process_teaching_sessions(dummy_token)
-    mock_insert.assert_called_once()
+    mock_load.assert_called_once()
 
-@patch("fedpipeline.jobs.fetch_data_from_api")
-@patch("fedpipeline.jobs.insert_records")
-def test_process_reading_lists(mock_insert, mock_fetch, dummy_token):
+@patch("fedpipeline.jobs.iter_api_pages")
+@patch("fedpipeline.jobs.load_records")
+def test_process_reading_lists(mock_load, mock_fetch, dummy_token):
    # Test reading list processing with expected structure.
-    mock_fetch.return_value = [{
+    mock_fetch.return_value = [[{
         "id": 7,
         "unit_id": 4,
         "teaching_session_id": 6,
@@ -112,15 +119,15 @@ def test_process_reading_lists(mock_insert, mock_fetch, dummy_token):
         "deleted": False,
         "created_at": "2024-01-20",
         "updated_at": "2024-01-21"
-    }]
+    }]]
     jobs.process_reading_lists(dummy_token)
-    mock_insert.assert_called_once()
+    mock_load.assert_called_once()
 
-@patch("fedpipeline.jobs.fetch_data_from_api")
-@patch("fedpipeline.jobs.insert_records")
-def test_process_reading_list_items(mock_insert, mock_fetch, dummy_token):
+@patch("fedpipeline.jobs.iter_api_pages")
+@patch("fedpipeline.jobs.load_records")
+def test_process_reading_list_items(mock_load, mock_fetch, dummy_token):
    # Ensure reading list items are processed and inserted correctly.
-    mock_fetch.return_value = [{
+    mock_fetch.return_value = [[{
         "id": 8,
         "list_id": 7,
         "reading_id": 3,
@@ -131,15 +138,15 @@ def test_process_reading_list_items(mock_insert, mock_fetch, dummy_token):
         "usage_count": 7,
         "created_at": "2024-01-22",
         "updated_at": "2024-01-23"
-    }]
+    }]]
     jobs.process_reading_list_items(dummy_token)
-    mock_insert.assert_called_once()
+    mock_load.assert_called_once()
 
-@patch("fedpipeline.jobs.fetch_data_from_api")
-@patch("fedpipeline.jobs.insert_records")
-def test_process_reading_list_usage(mock_insert, mock_fetch, dummy_token):
+@patch("fedpipeline.jobs.iter_api_pages")
+@patch("fedpipeline.jobs.load_records")
+def test_process_reading_list_usage(mock_load, mock_fetch, dummy_token):
     #Test that reading list usage entries are handled properly.
-    mock_fetch.return_value = [{
+    mock_fetch.return_value = [[{
         "id": 9,
         "list_id": 7,
         "integration_user_id": 1,
@@ -147,15 +154,15 @@ def test_process_reading_list_usage(mock_insert, mock_fetch, dummy_token):
         "list_publication_method": "auto",
         "created_at": "2024-01-24",
         "updated_at": "2024-01-25"
-    }]
+    }]]
     jobs.process_reading_list_usage(dummy_token)
-    mock_insert.assert_called_once()
+    mock_load.assert_called_once()
 
-@patch("fedpipeline.jobs.fetch_data_from_api")
-@patch("fedpipeline.jobs.insert_records")
-def test_process_reading_list_item_usage(mock_insert, mock_fetch, dummy_token):
+@patch("fedpipeline.jobs.iter_api_pages")
+@patch("fedpipeline.jobs.load_records")
+def test_process_reading_list_item_usage(mock_load, mock_fetch, dummy_token):
    # Confirm reading list item usage data is transformed and stored.
-    mock_fetch.return_value = [{
+    mock_fetch.return_value = [[{
         "id": 10,
         "item_id": 8,
         "list_usage_id": 9,
@@ -163,25 +170,228 @@ def test_process_reading_list_item_usage(mock_insert, mock_fetch, dummy_token):
         "utilisation_count": 2,
         "created_at": "2024-01-26",
         "updated_at": "2024-01-27"
-    }]
+    }]]
     jobs.process_reading_list_item_usage(dummy_token)
-    mock_insert.assert_called_once()
+    mock_load.assert_called_once()
 
-@patch("fedpipeline.jobs.fetch_data_from_api")
-@patch("fedpipeline.jobs.insert_records")
-def test_process_reading_utilisation(mock_insert, mock_fetch, dummy_token):
+@patch("fedpipeline.jobs.iter_api_pages")
+@patch("fedpipeline.jobs.load_records")
+def test_process_reading_utilisation(mock_load, mock_fetch, dummy_token):
    # Test reading utilisation records are successfully processed.
-    mock_fetch.return_value = [{
+    mock_fetch.return_value = [[{
         "id": 11,
         "integration_user_id": 1,
         "item_id": 8,
         "item_usage_id": 10,
         "created_at": "2024-01-28",
         "updated_at": "2024-01-29"
-    }]
+    }]]
     jobs.process_reading_utilisation(dummy_token)
-    mock_insert.assert_called_once()
+    mock_load.assert_called_once()
+
+
+@patch("fedpipeline.jobs.iter_api_pages")
+@patch("fedpipeline.jobs.load_records")
+def test_incremental_sync_filters_and_advances_watermark(mock_load, mock_fetch, dummy_token, no_watermarks):
+    # Only records past the watermark (less the overlap window) reach the load.
+    watermark = (datetime(2024, 1, 28, 12, 0, 0), 20)
+    mock_fetch.return_value = [[
+        {"id": 11, "integration_user_id": 1, "item_id": 8, "item_usage_id": 10,
+         "created_at": "2024-01-01", "updated_at": "2024-01-01T00:00:00Z"},
+        {"id": 12, "integration_user_id": 1, "item_id": 8, "item_usage_id": 10,
+         "created_at": "2024-01-29", "updated_at": "2024-01-29T08:30:00Z"},
+    ]]
+    mock_load.return_value = {"failed": False}
+    with patch("fedpipeline.jobs.get_watermark", return_value=watermark):
+        jobs.process_reading_utilisation(dummy_token)
+
+    params = mock_fetch.call_args.args[2]
+    assert params == {"updated_since": "2024-01-28T11:55:00"}
+    loaded = mock_load.call_args.args[1]
+    assert [row[0] for row in loaded] == [12]
+    no_watermarks.assert_called_once_with("ReadingUtilisation", (datetime(2024, 1, 29, 8, 30), 12))
+
+
+@patch("fedpipeline.jobs.iter_api_pages")
+@patch("fedpipeline.jobs.load_records")
+def test_process_loads_each_page(mock_load, mock_fetch, dummy_token, no_watermarks):
+    # Pages are loaded as they stream in; the watermark is saved once at the end.
+    mock_fetch.return_value = iter([
+        [{"id": 1, "list_id": 7, "integration_user_id": 1, "updated_at": "2024-01-01"}],
+        [{"id": 2, "list_id": 7, "integration_user_id": 1, "updated_at": "2024-01-03"}],
+        [{"id": 3, "list_id": 7, "integration_user_id": 1, "updated_at": "2024-01-02"}],
+    ])
+    mock_load.return_value = {"failed": False}
+    jobs.process_reading_list_usage(dummy_token)
+
+    assert mock_load.call_count == 3
+    no_watermarks.assert_called_once_with("ReadingListUsage", (datetime(2024, 1, 3), 2))
+
+
+@patch("fedpipeline.jobs.iter_api_pages")
+@patch("fedpipeline.jobs.load_records")
+def test_failed_load_keeps_watermark(mock_load, mock_fetch, dummy_token, no_watermarks):
+    mock_fetch.return_value = [[{"id": 1, "list_id": 7, "integration_user_id": 1, "updated_at": "2024-01-01"}]]
+    mock_load.return_value = {"failed": True}
+    jobs.process_reading_list_usage(dummy_token)
+    no_watermarks.assert_not_called()
+
+
+@patch("fedpipeline.jobs.iter_api_pages")
+@patch("fedpipeline.jobs.load_records")
+def test_interrupted_fetch_keeps_watermark(mock_load, mock_fetch, dummy_token, no_watermarks):
+    def pages(*args, **kwargs):
+        yield [{"id": 1, "list_id": 7, "integration_user_id": 1, "updated_at": "2024-01-01"}]
+        raise ConnectionError("reset by peer")
+
+    mock_fetch.side_effect = pages
+    mock_load.return_value = {"failed": False}
+    jobs.process_reading_list_usage(dummy_token)
+
+    mock_load.assert_called_once()
+    no_watermarks.assert_not_called()
+
+
+@patch("fedpipeline.jobs.iter_api_pages")
+@patch("fedpipeline.jobs.load_records")
+def test_unchanged_rows_are_not_reloaded(mock_load, mock_fetch, dummy_token):
+    page = [{"id": 2, "name": "Engineering"}, {"id": 3, "name": "Law"}]
+    mock_load.return_value = {"failed": False, "rejected_ids": []}
+    mock_fetch.return_value = [page]
+    jobs.process_schools(dummy_token)
+
+    mock_fetch.return_value = [page + [{"id": 4, "name": "Music"}]]
+    jobs.process_schools(dummy_token)
+
+    assert mock_load.call_count == 2
+    assert mock_load.call_args.args[1] == [(4, "Music")]
+
 
 
+@patch("fedpipeline.jobs.http_cache")
+@patch("fedpipeline.jobs.iter_api_pages")
+@patch("fedpipeline.jobs.load_records")
+def test_cached_pages_commit_only_when_every_row_is_recoverable(mock_load, mock_fetch, mock_cache, dummy_token):
+    page = [{"id": 1, "list_id": 7, "integration_user_id": 1, "updated_at": "2024-01-01"}]
+    mock_fetch.return_value = [page]
+    mock_load.return_value = {"failed": False, "rejected": 1, "rejected_ids": [1]}
+    with patch.dict(jobs.DEADLETTER_CONFIG, {"ENABLED": False}):
+        jobs.process_reading_list_usage(dummy_token)
+    mock_cache.commit.assert_not_called()
+    assert mock_fetch.call_args.kwargs["skip_unchanged"] is True
 
+    # The rejected row is kept for replay, so the page needn't be fetched again.
+    mock_fetch.return_value = [page]
+    jobs.process_reading_list_usage(dummy_token)
+    mock_cache.commit.assert_called_once_with("ReadingListUsage")
+
+    mock_cache.reset_mock()
+    mock_fetch.return_value = [page]
+    mock_load.return_value = {"failed": False, "rejected": 0, "rejected_ids": []}
+    with patch.dict(jobs.DEADLETTER_CONFIG, {"ENABLED": False}):
+        jobs.process_reading_list_usage(dummy_token)
+    mock_cache.commit.assert_called_once_with("ReadingListUsage")
+
+
+@patch("fedpipeline.integrity.pyodbc.connect")
+@patch("fedpipeline.jobs.iter_api_pages")
+@patch("fedpipeline.jobs.load_records")
+def test_orphans_wait_for_their_parents(mock_load, mock_fetch, mock_connect, dummy_token):
+    from fedpipeline import integrity
+    from tests.test_integrity import keys_connection
+    mock_connect.return_value = keys_connection({"ReadingList": [7], "IntegrationUser": [1]})
+    mock_load.return_value = {"failed": False, "rejected": 0, "rejected_ids": []}
+    mock_fetch.return_value = [[
+        {"id": 1, "list_id": 7, "integration_user_id": 1, "updated_at": "2024-01-01"},
+        {"id": 2, "list_id": 8, "integration_user_id": 1, "updated_at": "2024-01-01"},
+    ]]
+    with patch.dict(integrity.INTEGRITY_CONFIG, {"ENABLED": True}):
+        stats = jobs.process_reading_list_usage(dummy_token)
+        assert stats["parked"] == 1
+        assert [row[0] for row in mock_load.call_args.args[1]] == [1]
+
+        integrity.record_keys("ReadingList", [8])
+        mock_fetch.return_value = []
+        jobs.process_reading_list_usage(dummy_token)
+        assert [row[0] for row in mock_load.call_args.args[1]] == [2]
+        assert integrity.parked_counts() == {}
+
+
+@patch("fedpipeline.jobs.iter_api_pages")
+@patch("fedpipeline.jobs.load_records")
+def test_failed_load_resumes_from_spool_without_refetching(mock_load, mock_fetch, dummy_token, no_watermarks):
+    mock_fetch.return_value = [
+        [{"id": 1, "list_id": 7, "integration_user_id": 1, "updated_at": "2024-01-01T00:00:00Z"}],
+        [{"id": 2, "list_id": 7, "integration_user_id": 1, "updated_at": "2024-01-02T00:00:00Z"}],
+    ]
+    mock_load.side_effect = [{"failed": False}, {"failed": True}]
+    jobs.process_reading_list_usage(dummy_token)
+    no_watermarks.assert_not_called()
+
+    # SQL Server is back: only the page that didn't load is sent, from disk.
+    mock_fetch.reset_mock()
+    mock_load.side_effect = None
+    mock_load.return_value = {"failed": False}
+    jobs.process_reading_list_usage(dummy_token)
+
+    mock_fetch.assert_not_called()
+    assert [row[0] for row in mock_load.call_args.args[1]] == [2]
+    no_watermarks.assert_called_once_with("ReadingListUsage", (datetime(2024, 1, 2), 2))
 
+
+@patch("fedpipeline.jobs.iter_api_pages")
+@patch("fedpipeline.jobs.load_records")
+def test_outage_stops_loading_but_keeps_spooling(mock_load, mock_fetch, dummy_token, no_watermarks):
+    mock_fetch.return_value = [
+        [{"id": key, "list_id": 7, "integration_user_id": 1, "updated_at": f"2024-01-0{key}T00:00:00Z"}]
+        for key in (1, 2, 3)
+    ]
+    mock_load.return_value = {"failed": True}
+    stats = jobs.process_reading_list_usage(dummy_token)
+    assert mock_load.call_count == 1
+    assert stats["failed"]
+
+    # Every page waits on disk for the next run.
+    mock_fetch.reset_mock()
+    mock_load.reset_mock()
+    mock_load.return_value = {"failed": False}
+    jobs.process_reading_list_usage(dummy_token)
+    mock_fetch.assert_not_called()
+    assert [call.args[1][0][0] for call in mock_load.call_args_list] == [1, 2, 3]
+
+
+@patch("fedpipeline.jobs.iter_api_pages")
+@patch("fedpipeline.jobs.load_records")
+def test_rejected_rows_go_to_the_dead_letter_store(mock_load, mock_fetch, dummy_token):
+    from fedpipeline import deadletter
+    mock_fetch.return_value = [[{"id": 2, "name": "Engineering"}, {"id": 3, "name": "Law"}]]
+    mock_load.return_value = {
+        "failed": False, "rejected": 1, "rejected_ids": [3],
+        "rejected_errors": {3: "IntegrityError 23000"}, "errors": {"IntegrityError 23000": {"message": "boom"}},
+    }
+    jobs.process_schools(dummy_token)
+    assert deadletter.dead_letter_keys("School") == [3]
+
+    # The row loads on a later fetch: it's no longer a dead letter.
+    mock_fetch.return_value = [[{"id": 3, "name": "Law School"}]]
+    mock_load.return_value = {"failed": False, "rejected": 0, "rejected_ids": []}
+    jobs.process_schools(dummy_token)
+    assert deadletter.dead_letter_counts() == {}
+
+
+@patch("fedpipeline.jobs.iter_api_pages")
+@patch("fedpipeline.jobs.load_records")
+def test_watermark_stays_behind_rejected_rows_without_dead_letters(mock_load, mock_fetch, no_watermarks, dummy_token):
+    mock_fetch.return_value = [[
+        {"id": 1, "list_id": 7, "integration_user_id": 1, "updated_at": "2024-01-01"},
+        {"id": 2, "list_id": 7, "integration_user_id": 1, "updated_at": "2024-01-02"},
+    ]]
+    mock_load.return_value = {"failed": False, "rejected": 1, "rejected_ids": [1]}
+    with patch.dict(jobs.DEADLETTER_CONFIG, {"ENABLED": False}):
+        jobs.process_reading_list_usage(dummy_token)
+    no_watermarks.assert_called_once_with("ReadingListUsage", (datetime(2024, 1, 1), 0))
+
+    # With the dead-letter store the row is kept there, so the watermark moves on.
+    no_watermarks.reset_mock()
+    jobs.process_reading_list_usage(dummy_token)
+    no_watermarks.assert_called_once_with("ReadingListUsage", (datetime(2024, 1, 2), 2))
@@ -0,0 +1,19 @@
+import logging
+from fedpipeline import logger
+
+
+def test_records_are_written_by_the_listener_thread(tmp_path):
+    path = tmp_path / "test.log"
+    handler = logging.FileHandler(path)
+    handler.setFormatter(logger._file_handler.formatter)
+    logger.listener.handlers = logger.listener.handlers + (handler,)
+    record = logging.LogRecord("fedpipeline", logging.WARNING, __file__, 1, "queued message", None, None)
+    try:
+        logger._queue_handler.handle(record)
+        # stop() drains the queue before returning.
+        logger.listener.stop()
+        logger.listener.start()
+    finally:
+        logger.listener.handlers = logger.listener.handlers[:-1]
+        handler.close()
+    assert "WARNING  | queued message" in path.read_text()
@@ -0,0 +1,67 @@
+import pytest
+from unittest.mock import patch
+from fedpipeline import main
+
+
+@patch("fedpipeline.main.start_scheduler")
+@patch("fedpipeline.main.clear_http_cache")
+@patch("fedpipeline.main.clear_fingerprints")
+@patch("fedpipeline.main.reset_watermark", return_value=True)
+def test_resync_command(mock_reset, mock_clear, mock_clear_http, mock_scheduler):
+    assert main.main(["resync", "ReadingList"]) == 0
+    mock_reset.assert_called_once_with("ReadingList")
+    mock_clear.assert_called_once_with("ReadingList")
+    mock_clear_http.assert_called_once_with("ReadingList")
+    mock_scheduler.assert_not_called()
+
+
+@patch("fedpipeline.main.migrate")
+@patch("fedpipeline.main.install_profiling")
+@patch("fedpipeline.main.start_metrics")
+@patch("fedpipeline.main.start_scheduler")
+def test_default_starts_scheduler(mock_scheduler, mock_metrics, mock_profiling, mock_migrate):
+    assert main.main([]) == 0
+    mock_migrate.assert_called_once_with()
+    mock_metrics.assert_called_once()
+    mock_profiling.assert_called_once()
+    mock_scheduler.assert_called_once()
+
+
+@patch("fedpipeline.main.rebuild_from_database")
+def test_rebuild_fingerprints_command(mock_rebuild):
+    mock_rebuild.return_value = {"rows": 2, "matched": 2, "stale": 0, "missing_in_db": 0}
+    assert main.main(["rebuild-fingerprints", "School", "Unit"]) == 0
+    assert [call.args[0].name for call in mock_rebuild.call_args_list] == ["School", "Unit"]
+
+
+
+@patch("fedpipeline.main.reconcile_all")
+def test_reconcile_command(mock_reconcile):
+    mock_reconcile.return_value = {"Unit": {"stale": 2, "removed": 1, "blocked": 1, "skipped": False}}
+    assert main.main(["reconcile", "--dry-run", "Unit"]) == 0
+    mock_reconcile.assert_called_once_with(["Unit"], dry_run=True)
+
+
+@patch("fedpipeline.main.full_refresh")
+def test_full_refresh_command(mock_refresh):
+    mock_refresh.return_value = {"swapped": False, "entities": {}}
+    assert main.main(["full-refresh", "School"]) == 1
+    mock_refresh.assert_called_once_with(["School"])
+
+
+@patch("fedpipeline.main.rebuild_aggregates", return_value={"ReadingListUsageDaily": 3})
+def test_rebuild_aggregates_command(mock_rebuild):
+    assert main.main(["rebuild-aggregates"]) == 0
+    mock_rebuild.assert_called_once_with()
+
+
+@patch("fedpipeline.main.migrate", return_value={"current": 2, "applied": [], "pending": [3, 4]})
+def test_migrate_dry_run_command(mock_migrate):
+    assert main.main(["migrate", "--dry-run"]) == 0
+    mock_migrate.assert_called_once_with(dry_run=True)
+
+
+@patch("fedpipeline.main.replay", return_value={"ReadingListItem": {"retried": 3, "loaded": 3, "failed": 0}})
+def test_replay_dead_letters_command(mock_replay):
+    assert main.main(["replay-dead-letters", "--force", "ReadingListItem"]) == 0
+    mock_replay.assert_called_once_with(["ReadingListItem"], force=True)
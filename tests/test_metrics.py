@@ -0,0 +1,61 @@
+import urllib.request
+from unittest.mock import patch
+import pytest
+from fedpipeline import metrics
+from fedpipeline.db_handler import load_records
+
+
+def test_counter_renders_labelled_series():
+    counter = metrics.Counter("test_things_total", "Things.", ("entity",))
+    counter.inc(2, entity="School")
+    counter.inc(entity="School")
+    assert counter.value(entity="School") == 3
+    assert 'test_things_total{entity="School"} 3' in counter.render()
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram("test_latency_seconds", "Latency.", ("stage",), buckets=(0.1, 1))
+    histogram.observe(0.05, stage="http")
+    histogram.observe(0.5, stage="http")
+    lines = histogram.render()
+    assert 'test_latency_seconds_bucket{stage="http",le="0.1"} 1' in lines
+    assert 'test_latency_seconds_bucket{stage="http",le="1"} 2' in lines
+    assert 'test_latency_seconds_bucket{stage="http",le="+Inf"} 2' in lines
+    assert 'test_latency_seconds_count{stage="http"} 2' in lines
+
+
+def test_timed_counts_errors_and_reraises():
+    before = metrics.ERRORS.value(entity="Test", stage="decode")
+    with pytest.raises(ValueError):
+        with metrics.timed("decode", "Test"):
+            raise ValueError("bad json")
+    assert metrics.ERRORS.value(entity="Test", stage="decode") == before + 1
+    assert metrics.STAGE_SECONDS.count(entity="Test", stage="decode") >= 1
+
+
+@patch("fedpipeline.db_handler.upsert_records")
+def test_load_records_counts_rows_and_rejects(mock_upsert):
+    mock_upsert.return_value = {"sent": 5, "rejected": 1, "failed": False}
+    before_rows = metrics.ROWS.value(entity="MetricsTest", stage="load")
+    before_errors = metrics.ERRORS.value(entity="MetricsTest", stage="load")
+    load_records("INSERT INTO School (ereserve_id) VALUES (?)", [(1,)], "MetricsTest")
+    assert metrics.ROWS.value(entity="MetricsTest", stage="load") == before_rows + 4
+    assert metrics.ERRORS.value(entity="MetricsTest", stage="load") == before_errors + 1
+
+
+def test_metrics_endpoint_serves_text_format():
+    server = metrics.start_metrics_server(host="127.0.0.1", port=0)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url, timeout=5) as response:
+            body = response.read().decode()
+        assert "# TYPE fedpipeline_stage_duration_seconds histogram" in body
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_write_textfile(tmp_path):
+    path = tmp_path / "fedpipeline.prom"
+    metrics.write_textfile(str(path))
+    assert "fedpipeline_rows_total" in path.read_text()
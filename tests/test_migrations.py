@@ -0,0 +1,93 @@
+from unittest.mock import patch, MagicMock
+from fedpipeline import migrations
+from fedpipeline.entities import ENTITIES
+
+
+def database(applied=(), lock=0):
+    conn = MagicMock()
+    conn.__enter__.return_value = conn
+    cursor = conn.cursor.return_value
+    cursor.fetchone.return_value = (lock,)
+    cursor.fetchall.return_value = [(version,) for version in applied]
+    return conn, cursor
+
+
+def executed(cursor):
+    return [call.args[0] for call in cursor.execute.call_args_list]
+
+
+def test_versions_are_ordered_and_unique():
+    versions = [version for version, _, _ in migrations.MIGRATIONS]
+    assert versions == sorted(set(versions))
+
+
+def test_every_foreign_key_column_gets_an_index():
+    statements = migrations.fk_index_statements(ENTITIES["ReadingListItem"])
+    assert len(statements) == 2
+    assert "CREATE INDEX IX_ReadingListItem_list_id ON ReadingListItem (list_id)" in statements[0]
+    assert statements[0].startswith("IF NOT EXISTS")
+    usage = migrations.fk_index_statements(ENTITIES["ReadingUtilisation"], "ReadingUtilisation_shadow")
+    assert "ON ReadingUtilisation_shadow (item_id) WITH (DATA_COMPRESSION = PAGE)" in usage[1]
+
+
+@patch("fedpipeline.migrations.pyodbc.connect")
+def test_pending_migrations_apply_in_order_under_the_lock(mock_connect):
+    conn, cursor = database(applied=[1, 2])
+    mock_connect.return_value = conn
+
+    result = migrations.migrate()
+
+    assert result == {"current": 4, "applied": [3, 4], "pending": []}
+    statements = executed(cursor)
+    assert "sp_getapplock" in statements[0] and "sp_releaseapplock" in statements[-1]
+    recorded = [
+        call.args[1:] for call in cursor.execute.call_args_list
+        if call.args[0].startswith("INSERT INTO SchemaMigrations")
+    ]
+    assert recorded == [(3, "Indexes on foreign key columns"), (4, "Data compression on usage tables")]
+    assert not any("CREATE TABLE PipelineState" in s for s in statements)
+    assert any("ALTER TABLE ReadingUtilisation REBUILD WITH (DATA_COMPRESSION = PAGE)" in s for s in statements)
+
+
+@patch("fedpipeline.migrations.pyodbc.connect")
+def test_dry_run_changes_nothing(mock_connect):
+    conn, cursor = database(applied=[1])
+    mock_connect.return_value = conn
+    result = migrations.migrate(dry_run=True)
+    assert result["pending"] == [2, 3, 4] and result["applied"] == [] and result["current"] == 1
+    assert not any("CREATE " in s or "ALTER " in s or "INSERT INTO" in s for s in executed(cursor))
+    conn.commit.assert_not_called()
+
+
+@patch("fedpipeline.migrations.pyodbc.connect")
+def test_dry_run_on_a_new_database_lists_every_migration(mock_connect):
+    conn, cursor = database()
+    cursor.fetchone.side_effect = [(0,), (None,)]
+    mock_connect.return_value = conn
+    result = migrations.migrate(dry_run=True)
+    assert result == {"current": 0, "applied": [], "pending": [1, 2, 3, 4]}
+    assert "SELECT version FROM SchemaMigrations" not in executed(cursor)
+    conn.commit.assert_not_called()
+
+
+@patch("fedpipeline.migrations.pyodbc.connect")
+def test_busy_lock_skips_migrations(mock_connect):
+    conn, cursor = database(lock=-1)
+    mock_connect.return_value = conn
+    assert migrations.migrate()["applied"] == []
+    assert len(executed(cursor)) == 1
+
+
+@patch("fedpipeline.migrations.pyodbc.connect")
+def test_failed_migration_rolls_back_and_stops(mock_connect):
+    conn, cursor = database(applied=[1, 2])
+
+    def execute(sql, *params):
+        if "CREATE INDEX" in sql:
+            raise Exception("permission denied")
+
+    cursor.execute.side_effect = execute
+    mock_connect.return_value = conn
+    result = migrations.migrate()
+    assert result["applied"] == [] and result["pending"] == [3, 4]
+    conn.rollback.assert_called_once()
@@ -0,0 +1,69 @@
+import threading
+import time
+import pytest
+from fedpipeline import pipeline
+
+
+def test_pipeline_transforms_and_loads_every_page():
+    loaded = []
+    pages = [[{"id": 1}, {"id": 2}], [{"id": 3}]]
+    stats = pipeline.run_pipeline(
+        "School", iter(pages),
+        lambda items: [(item["id"],) for item in items],
+        lambda rows, items: loaded.append(rows),
+    )
+    assert loaded == [[(1,), (2,)], [(3,)]]
+    assert stats["fetch"]["rows"] == 3
+    assert stats["load"]["pages"] == 2
+    assert stats["errors"] == []
+    assert pipeline.pipeline_stats()["School"]["transform"]["rows"] == 3
+
+
+def test_fetch_overlaps_load_but_is_throttled_by_backpressure():
+    fetched = []
+    first_load_started = threading.Event()
+    release_load = threading.Event()
+
+    def pages():
+        for n in range(10):
+            fetched.append(n)
+            yield [{"id": n}]
+
+    def load(rows, items):
+        first_load_started.set()
+        release_load.wait(5)
+
+    thread = threading.Thread(target=pipeline.run_pipeline, args=(
+        "ReadingUtilisation", pages(), lambda items: items, load, 1
+    ))
+    thread.start()
+    assert first_load_started.wait(5)
+    time.sleep(0.3)
+    # Page 0 is being written while later pages were fetched, but bounded
+    # queues stop the fetcher from running through the whole stream.
+    assert 1 < len(fetched) < 10
+    release_load.set()
+    thread.join(5)
+    assert len(fetched) == 10
+
+
+def test_fetch_error_still_loads_fetched_pages():
+    loaded = []
+
+    def pages():
+        yield [{"id": 1}]
+        raise ConnectionError("reset by peer")
+
+    stats = pipeline.run_pipeline("Unit", pages(), lambda items: items, lambda rows, items: loaded.append(rows))
+    assert loaded == [[{"id": 1}]]
+    assert [stage for stage, _ in stats["errors"]] == ["fetch"]
+
+
+def test_load_error_stops_the_pipeline():
+    def load(rows, items):
+        raise RuntimeError("database gone")
+
+    pages = iter([[{"id": n}] for n in range(100)])
+    stats = pipeline.run_pipeline("Reading", pages, lambda items: items, load, 1)
+    assert [stage for stage, _ in stats["errors"]] == ["load"]
+    assert stats["fetch"]["pages"] < 100
@@ -0,0 +1,95 @@
+import os
+import signal
+import threading
+from unittest.mock import patch
+import pytest
+from fedpipeline import profiling
+from fedpipeline.pipeline import run_pipeline
+
+
+@pytest.fixture(autouse=True)
+def profile_dir(tmp_path):
+    profiling._armed["cycles"] = 0
+    with patch.dict(profiling.PROFILING_CONFIG, {"DIR": str(tmp_path), "TOP": 5}):
+        yield tmp_path
+    profiling._armed["cycles"] = 0
+
+
+def test_unarmed_cycle_is_not_profiled(profile_dir):
+    with profiling.profile_cycle() as path:
+        with profiling.profile_thread("School"):
+            sum(range(1000))
+    assert path is None
+    assert os.listdir(profile_dir) == []
+
+
+def test_armed_cycle_writes_per_entity_profiles(profile_dir):
+    profiling.arm(1)
+    with profiling.profile_cycle() as path:
+        run_pipeline(
+            "School", iter([[{"id": n} for n in range(100)]]),
+            lambda items: [(item["id"],) for item in items],
+            lambda rows, items: None,
+        )
+    files = sorted(os.listdir(path))
+    assert files == ["School.prof", "allocations.snapshot", "summary.txt"]
+    summary = open(os.path.join(path, "summary.txt")).read()
+    assert "Top 5 functions by own time" in summary
+    assert "Top 5 allocation sites" in summary
+    assert profiling.armed_cycles() == 0
+
+    with profiling.profile_cycle() as path:
+        pass
+    assert path is None
+
+
+def test_profiles_from_stage_threads_are_merged(profile_dir):
+    profiling.arm(1)
+    with profiling.profile_cycle() as path:
+        threads = [threading.Thread(target=profiling.profiled("Unit", sum), args=(range(100),)) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(profiling._session.get()["profiles"]["Unit"]) == 3
+    assert os.path.exists(os.path.join(path, "Unit.prof"))
+
+
+def test_overlapping_runs_keep_their_own_profiles(profile_dir):
+    # Adaptive mode: two entities' runs in flight at the same time.
+    profiling.arm(2)
+    barrier = threading.Barrier(2)
+    paths = {}
+
+    def run(entity_name):
+        with profiling.profile_cycle(entity_name) as path:
+            barrier.wait()
+            run_pipeline(
+                entity_name, iter([[{"id": n} for n in range(50)]]),
+                lambda items: [(item["id"],) for item in items],
+                lambda rows, items: None,
+            )
+            barrier.wait()
+        paths[entity_name] = path
+
+    threads = [threading.Thread(target=run, args=(name,)) for name in ("School", "Unit")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert paths["School"] != paths["Unit"]
+    assert "School.prof" in os.listdir(paths["School"]) and "Unit.prof" not in os.listdir(paths["School"])
+    assert "Unit.prof" in os.listdir(paths["Unit"]) and "School.prof" not in os.listdir(paths["Unit"])
+    assert profiling.armed_cycles() == 0 and not profiling._tracing["sessions"]
+
+
+@pytest.mark.skipif(not hasattr(signal, "SIGUSR1"), reason="SIGUSR1 not available")
+def test_signal_arms_profiling():
+    previous = signal.getsignal(signal.SIGUSR1)
+    try:
+        with patch.dict(profiling.PROFILING_CONFIG, {"CYCLES": 0, "SIGNAL_CYCLES": 2}):
+            profiling.install_profiling()
+            os.kill(os.getpid(), signal.SIGUSR1)
+        assert profiling.armed_cycles() == 2
+    finally:
+        signal.signal(signal.SIGUSR1, previous)
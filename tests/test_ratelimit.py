@@ -0,0 +1,114 @@
+import threading
+import time
+from unittest.mock import patch, Mock
+import pytest
+from fedpipeline import api_handler, ratelimit
+
+
+def response(status, retry_after=None, body=None):
+    resp = Mock()
+    resp.status_code = status
+    resp.raise_for_status = Mock()
+    resp.headers = {"Retry-After": retry_after} if retry_after else {}
+    resp.content = b"{}"
+    resp.json.return_value = body or {"items": []}
+    resp.links = {}
+    return resp
+
+
+def test_endpoint_name_matches_longest_configured_prefix():
+    base = api_handler.API_CONFIG["READING_LISTS_URL"]
+    assert ratelimit.endpoint_name(base + "?page=2") == "READING_LISTS_URL"
+    assert ratelimit.endpoint_name(api_handler.API_CONFIG["READING_LIST_ITEMS_URL"]) == "READING_LIST_ITEMS_URL"
+    assert ratelimit.endpoint_name("https://elsewhere.example/x") == "elsewhere.example"
+
+
+def test_retry_after_parsing():
+    assert ratelimit.retry_after_seconds("7") == 7
+    assert ratelimit.retry_after_seconds("100000") == ratelimit.RATE_LIMIT_CONFIG["MAX_RETRY_AFTER_SECONDS"]
+    assert ratelimit.retry_after_seconds(None, attempt=2) == ratelimit.RATE_LIMIT_CONFIG["BACKOFF_SECONDS"] * 4
+    assert 0 <= ratelimit.retry_after_seconds("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+
+
+def test_token_bucket_paces_requests():
+    bucket = ratelimit.TokenBucket(rate=50, burst=1, min_rate=1)
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.09
+
+
+def test_throttling_halves_rate_and_pauses_then_recovers():
+    bucket = ratelimit.TokenBucket(rate=10, burst=5, min_rate=1)
+    bucket.throttled(0.1)
+    assert bucket.rate == 5
+    start = time.monotonic()
+    bucket.acquire()
+    assert time.monotonic() - start >= 0.09
+    for _ in range(20):
+        bucket.succeeded()
+    assert bucket.rate == 10
+
+
+def test_concurrency_limit_is_aimd():
+    limit = ratelimit.ConcurrencyLimit(8, 1)
+    for _ in range(3):
+        limit.acquire()
+    limit.release(throttled=True)
+    limit.release(throttled=True)  # same congestion event
+    assert limit.limit == 4
+    for _ in range(8):
+        limit.acquire()
+        limit.release()
+    assert 5 < limit.limit < 7
+    limit.release()
+
+
+def test_errors_do_not_raise_the_concurrency_limit():
+    limit = ratelimit.ConcurrencyLimit(8, 1)
+    limit.limit = 4
+    ratelimit._concurrency["limit"] = limit
+    # None: the request raised (connection error, timeout).
+    for status in (None, 500, 502, 404):
+        limit.acquire()
+        assert ratelimit.after_request("api", status) is None
+        assert limit.limit == 4, status
+    limit.acquire()
+    ratelimit.after_request("api", 200)
+    assert limit.limit == 4.25
+
+
+def test_concurrency_limit_blocks_beyond_limit():
+    limit = ratelimit.ConcurrencyLimit(1, 1)
+    limit.acquire()
+    entered = threading.Event()
+    thread = threading.Thread(target=lambda: (limit.acquire(), entered.set()))
+    thread.start()
+    assert not entered.wait(0.05)
+    limit.release()
+    assert entered.wait(1)
+    thread.join()
+
+
+@patch("fedpipeline.api_handler.get_session")
+def test_throttled_requests_are_retried_after_retry_after(mock_session):
+    get = mock_session.return_value.get
+    get.side_effect = [response(429, "0.05"), response(503), response(200, body={"items": [{"id": 1}]})]
+    with patch.dict(ratelimit.RATE_LIMIT_CONFIG, {"BACKOFF_SECONDS": 0.01}):
+        start = time.monotonic()
+        assert api_handler.fetch_data_from_api("https://api/x", "token") == [{"id": 1}]
+    assert get.call_count == 3
+    assert time.monotonic() - start >= 0.05
+    assert ratelimit.THROTTLED.value(endpoint="api") >= 2
+    rates, concurrency = ratelimit.limiter_stats()
+    assert rates["api"]["rate"] < ratelimit.RATE_LIMIT_CONFIG["RATE"]
+    assert concurrency < ratelimit.RATE_LIMIT_CONFIG["MAX_CONCURRENCY"]
+
+
+@patch("fedpipeline.api_handler.get_session")
+def test_gives_up_after_max_retries(mock_session):
+    get = mock_session.return_value.get
+    get.return_value = response(429, "0")
+    with patch.dict(ratelimit.RATE_LIMIT_CONFIG, {"MAX_RETRIES": 2}):
+        assert api_handler.fetch_data_from_api("https://api/x", "token") == []
+    assert get.call_count == 3
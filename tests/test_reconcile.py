@@ -0,0 +1,99 @@
+from unittest.mock import patch, MagicMock
+from fedpipeline import reconcile
+from fedpipeline.entities import ENTITIES
+from fedpipeline.fingerprints import record_loaded, filter_changed
+
+
+def bitmap(keys):
+    ids = reconcile.IdBitmap()
+    for key in keys:
+        ids.add(key)
+    return ids
+
+
+def test_bitmap_difference_streams_sorted_ids():
+    in_db = bitmap([1, 7, 8, 100000, 3, 2 ** 40])
+    in_api = bitmap([7, 3, 5])
+    assert len(in_db) == 6 and 100000 in in_db and 2 ** 40 in in_db and 4 not in in_db
+    assert list(in_db.difference(in_api, chunk=16)) == [1, 8, 100000, 2 ** 40]
+
+
+def test_sparse_ids_do_not_grow_the_bitmap():
+    in_db = bitmap([5, 2 ** 31 - 1, 2 ** 30, 2 ** 30])
+    assert len(in_db.bits) <= 8 and len(in_db) == 3
+    assert list(in_db.difference(bitmap([2 ** 30]))) == [5, 2 ** 31 - 1]
+
+
+@patch("fedpipeline.reconcile.apply_deletions")
+@patch("fedpipeline.reconcile.api_ids")
+@patch("fedpipeline.reconcile.database_ids")
+def test_only_rows_gone_upstream_are_removed(mock_db, mock_api, mock_apply):
+    entity = ENTITIES["School"]
+    rows = [(n, f"School {n}") for n in range(1, 21)]
+    record_loaded("School", rows)
+    mock_db.return_value = bitmap(range(1, 21))
+    mock_api.return_value = bitmap(list(range(1, 20)) + [21])
+    mock_apply.return_value = ([20], {"rejected": 0})
+
+    report = reconcile.reconcile_entity(entity, "token")
+
+    mock_apply.assert_called_once_with(entity, [20])
+    assert report["stale"] == 1 and report["removed"] == 1 and report["missing"] == 1
+    # A deleted row that comes back must be loaded again.
+    assert filter_changed("School", rows[-2:]) == rows[-1:]
+    assert reconcile.reconcile_stats()["School"]["removed"] == 1
+
+
+@patch("fedpipeline.reconcile.apply_deletions")
+@patch("fedpipeline.reconcile.api_ids")
+@patch("fedpipeline.reconcile.database_ids")
+def test_truncated_listing_is_not_treated_as_deletions(mock_db, mock_api, mock_apply):
+    mock_db.return_value = bitmap(range(100))
+    mock_api.return_value = bitmap(range(50))
+    report = reconcile.reconcile_entity(ENTITIES["Unit"], "token")
+    assert report["skipped"] and report["stale"] == 50
+    mock_apply.assert_not_called()
+
+    mock_api.return_value = bitmap(range(95))
+    report = reconcile.reconcile_entity(ENTITIES["Unit"], "token", dry_run=True)
+    assert not report["skipped"] and report["stale"] == 5
+    mock_apply.assert_not_called()
+
+
+@patch("fedpipeline.reconcile.pyodbc.connect")
+def test_referenced_parents_are_skipped(mock_connect):
+    conn = MagicMock()
+    conn.__enter__.return_value = conn
+    mock_connect.return_value = conn
+    cursor = conn.cursor.return_value
+
+    def executemany(query, batch):
+        if (3,) in batch:
+            raise Exception("The DELETE statement conflicted with the REFERENCE constraint \"FK_x\"")
+
+    cursor.executemany.side_effect = executemany
+    removed, stats = reconcile.apply_deletions(ENTITIES["Unit"], [1, 2, 3, 4])
+    assert removed == [1, 2, 4]
+    assert stats["rejected_ids"] == [3]
+    assert cursor.executemany.call_args.args[0] == "DELETE FROM Unit WHERE ereserve_id = ?"
+
+
+@patch("fedpipeline.reconcile.pyodbc.connect")
+def test_soft_delete_flags_rows(mock_connect):
+    conn = MagicMock()
+    conn.__enter__.return_value = conn
+    mock_connect.return_value = conn
+    reconcile.apply_deletions(ENTITIES["ReadingList"], [5])
+    query = conn.cursor.return_value.executemany.call_args.args[0]
+    assert query == "UPDATE ReadingList SET deleted = 1 WHERE ereserve_id = ?"
+
+
+@patch("fedpipeline.reconcile.reconcile_entity")
+def test_children_are_reconciled_before_parents(mock_entity):
+    mock_entity.return_value = {}
+    reconcile.reconcile_all(token="token")
+    order = [call.args[0].name for call in mock_entity.call_args_list]
+    assert len(order) == len(ENTITIES)
+    for entity in ENTITIES.values():
+        for parent in entity.parents:
+            assert order.index(entity.name) < order.index(parent)
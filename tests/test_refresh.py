@@ -0,0 +1,114 @@
+from datetime import datetime
+from unittest.mock import patch, MagicMock
+from fedpipeline import refresh
+from fedpipeline.entities import ENTITIES
+
+
+def test_refresh_covers_everything_that_references_the_table():
+    assert refresh.refresh_set(["School"]) == ["School"]
+    names = refresh.refresh_set(["ReadingList"])
+    assert set(names) == {
+        "ReadingList", "ReadingListItem", "ReadingListUsage", "UnitOffering",
+        "ReadingListItemUsage", "ReadingUtilisation",
+    }
+    assert names[0] == "ReadingList"
+    assert names.index("ReadingListItem") < names.index("ReadingUtilisation")
+
+
+def test_shadow_is_a_heap_whose_fks_point_at_shadow_parents():
+    ddl = refresh.shadow_ddl(ENTITIES["ReadingListItem"], ["ReadingListItem"])
+    assert ddl["create"].startswith("CREATE TABLE ReadingListItem_shadow (")
+    assert "PRIMARY KEY" not in ddl["create"] and "CONSTRAINT" not in ddl["create"]
+    assert "ereserve_id INT NOT NULL" in ddl["create"]
+    assert ddl["foreign_keys"] == [
+        ("FK_ReadingListItem_ReadingList", "list_id", "ReadingList", "ereserve_id"),
+        ("FK_ReadingListItem_Reading", "reading_id", "Reading", "ereserve_id"),
+    ]
+    ddl = refresh.shadow_ddl(ENTITIES["ReadingListItem"], ["ReadingList", "ReadingListItem"])
+    assert ddl["foreign_keys"][0][2] == "ReadingList_shadow"
+
+
+def test_swap_renames_in_one_transaction():
+    names = ["ReadingList", "UnitOffering"]
+    ddls = {name: refresh.shadow_ddl(ENTITIES[name], names) for name in names}
+    sql = refresh.swap_sql(names, ddls).splitlines()
+    assert sql[0] == "SET NOCOUNT ON;"
+    assert sql[3] == "BEGIN TRANSACTION;" and sql[-1] == "COMMIT TRANSACTION;"
+    assert sum("BEGIN" in line for line in sql) == 1
+    body = "\n".join(sql)
+    # Constraint names are freed before the shadow's take them over.
+    assert body.index("'FK_ReadingList_Unit', 'FK_ReadingList_Unit_old'") < body.index(
+        "'FK_ReadingList_Unit_shadow', 'FK_ReadingList_Unit'")
+    assert body.index("'ReadingList', 'ReadingList_old'") < body.index("'ReadingList_shadow', 'ReadingList'")
+
+
+def database(live_rows, shadow_rows):
+    conn = MagicMock()
+    conn.__enter__.return_value = conn
+    cursor = conn.cursor.return_value
+    cursor.rowcount = 0
+    cursor.nextset.return_value = False
+    cursor.fetchone.side_effect = lambda: (
+        ("SIMPLE",) if "recovery_model" in cursor.execute.call_args.args[0]
+        else (shadow_rows,) if "_shadow" in cursor.execute.call_args.args[0] else (live_rows,)
+    )
+    return conn, cursor
+
+
+@patch("fedpipeline.refresh.save_watermark")
+@patch("fedpipeline.refresh.iter_api_pages")
+@patch("fedpipeline.refresh.pyodbc.connect")
+def test_full_refresh_loads_shadow_and_swaps(mock_connect, mock_fetch, mock_save):
+    conn, cursor = database(live_rows=2, shadow_rows=2)
+    mock_connect.return_value = conn
+    mock_fetch.return_value = [[{"id": 1, "name": "Law", "updated_at": "2024-01-01"}, {"id": 2, "name": "Arts"}]]
+
+    result = refresh.full_refresh(["School"], token="token")
+
+    assert result["swapped"]
+    statements = [call.args[0] for call in cursor.execute.call_args_list]
+    assert any(s.startswith("CREATE TABLE School_shadow") for s in statements)
+    assert any("ADD CONSTRAINT PK_School_shadow PRIMARY KEY" in s for s in statements)
+    assert any("EXEC sp_rename 'School_shadow', 'School';" in s for s in statements)
+    insert, rows = cursor.executemany.call_args.args
+    assert insert.startswith("INSERT INTO School_shadow WITH (TABLOCK)")
+    assert rows == [(1, "Law"), (2, "Arts")]
+    # Incremental sync resumes from the snapshot.
+    mock_save.assert_called_once_with("School", (datetime(2024, 1, 1), 1))
+
+
+@patch("fedpipeline.refresh.iter_api_pages")
+@patch("fedpipeline.refresh.pyodbc.connect")
+def test_short_shadow_leaves_live_table_alone(mock_connect, mock_fetch):
+    conn, cursor = database(live_rows=1000, shadow_rows=1)
+    mock_connect.return_value = conn
+    mock_fetch.return_value = [[{"id": 1, "name": "Law"}]]
+
+    result = refresh.full_refresh(["School"], token="token")
+
+    assert not result["swapped"]
+    statements = [call.args[0] for call in cursor.execute.call_args_list]
+    assert not any("sp_rename" in s for s in statements)
+    assert statements[-1] == "DROP TABLE IF EXISTS School_old"
+
+
+@patch("fedpipeline.refresh.time.sleep")
+@patch("fedpipeline.refresh.save_watermark")
+@patch("fedpipeline.refresh.clear_fingerprints")
+@patch("fedpipeline.refresh.iter_api_pages")
+@patch("fedpipeline.refresh.pyodbc.connect")
+def test_rolled_back_swap_touches_no_state(mock_connect, mock_fetch, mock_clear, mock_save, mock_sleep):
+    conn, cursor = database(live_rows=2, shadow_rows=2)
+    answer = cursor.fetchone.side_effect
+    # The batch ran without raising, but School_old never appeared.
+    cursor.fetchone.side_effect = lambda: None if "OBJECT_ID('School_old')" in cursor.execute.call_args.args[0] \
+        else answer()
+    mock_connect.return_value = conn
+    mock_fetch.return_value = [[{"id": 1, "name": "Law", "updated_at": "2024-01-01"}, {"id": 2, "name": "Arts"}]]
+
+    result = refresh.full_refresh(["School"], token="token")
+
+    assert not result["swapped"]
+    assert cursor.nextset.called
+    mock_clear.assert_not_called()
+    mock_save.assert_not_called()
@@ -0,0 +1,75 @@
+from datetime import date, datetime
+from unittest.mock import patch
+import pytest
+from fedpipeline import schema
+from fedpipeline.entities import ENTITIES
+
+
+@pytest.fixture(autouse=True)
+def fresh_coercers():
+    schema.reset_coercers()
+    yield
+    schema.reset_coercers()
+
+
+def test_schema_is_read_from_db_sql():
+    tables = schema.load_schema()
+    assert tables["IntegrationUser"]["roles"] == {"type": "NVARCHAR", "length": 255, "nullable": False}
+    assert tables["TeachingSession"]["archived"]["type"] == "BIT"
+    assert tables["ReadingList"]["unit_id"]["nullable"] is True
+    assert tables["PipelineState"]["last_updated_at"]["type"] == "DATETIME2"
+    assert "CONSTRAINT" not in tables["ReadingList"]
+    for entity in ENTITIES.values():
+        assert set(entity.columns) <= set(tables[entity.table])
+
+
+def test_values_are_coerced_to_column_types():
+    entity = ENTITIES["TeachingSession"]
+    rows, rejected = schema.coerce_rows(entity, [
+        ("7", "Semester 1", "2024-02-26", "2024-06-30", "false", "2024-01-01T10:00:00.123456Z", None),
+    ])
+    assert rejected == 0
+    assert rows == [(7, "Semester 1", date(2024, 2, 26), date(2024, 6, 30), False,
+                     datetime(2024, 1, 1, 10, 0, 0, 123000), None)]
+
+
+def test_lists_are_serialised_and_long_strings_truncated():
+    entity = ENTITIES["Unit"]
+    rows, rejected = schema.coerce_rows(entity, [(1, ["B", "A"], "x" * 300)])
+    assert rows == [(1, '["B", "A"]', "x" * 255)]
+    assert schema.coercion_stats()["Unit"]["truncated"] == 1
+
+    with patch.dict(schema.SCHEMA_CONFIG, {"TRUNCATE": False}):
+        rows, rejected = schema.coerce_rows(entity, [(1, "C1", "x" * 300)])
+    assert (rows, rejected) == ([], 1)
+
+
+def test_bad_values_reject_the_row_before_the_database(caplog):
+    entity = ENTITIES["ReadingListItem"]
+    good = (1, 7, 9, "active", True, 0, "high", 0, None, None)
+    rows, rejected = schema.coerce_rows(entity, [
+        good,
+        (2, "seven", 9, "active", True, 0, "high", 0, None, None),
+        (3, None, 9, "active", True, 0, "high", 0, None, None),
+        (4, 7, 9, "active", "maybe", 0, "high", 0, None, None),
+        (5, 7, 9, "active", True, 0, "high", 0, "not a date", None),
+    ])
+    assert rows == [good]
+    assert rejected == 4
+    messages = " ".join(record.getMessage() for record in caplog.records)
+    assert "bad list_id" in messages and "bad hidden" in messages and "bad created_at" in messages
+
+
+def test_timestamp_parsing_is_memoised():
+    schema._parse_datetime.cache_clear()
+    entity = ENTITIES["Reading"]
+    rows = [(n, "t", "g", "s", "a", "2024-01-01T00:00:00Z", "2024-01-01T00:00:00Z") for n in range(100)]
+    schema.coerce_rows(entity, rows)
+    info = schema._parse_datetime.cache_info()
+    assert info.misses == 1 and info.hits == 199
+
+
+def test_missing_schema_disables_coercion():
+    rows = [(1, "x")]
+    with patch.dict(schema.SCHEMA_CONFIG, {"PATH": "/nonexistent/db.sql"}):
+        assert schema.coerce_rows(ENTITIES["School"], rows) == (rows, 0)
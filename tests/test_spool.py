@@ -0,0 +1,54 @@
+import os
+from unittest.mock import patch
+from fedpipeline import spool
+
+
+def test_pages_survive_a_restart_until_committed():
+    first = spool.Spool("School")
+    first.start()
+    pages = list(first.record(iter([[{"id": 1}], [{"id": 2}], [{"id": 3}]])))
+    assert pages == [[{"id": 1}], [{"id": 2}], [{"id": 3}]]
+    first.commit()
+    first.close()
+
+    # A new process picks up after the last committed page.
+    second = spool.Spool("School")
+    assert second.pending() and second.state["fetch_complete"]
+    assert list(second.replay()) == [[{"id": 2}], [{"id": 3}]]
+    second.commit()
+    second.commit()
+    assert not spool.Spool("School").pending()
+
+    second.clear()
+    assert spool.Spool("School").segments() == []
+
+
+def test_torn_tail_record_is_ignored():
+    writer = spool.Spool("Unit")
+    writer.start()
+    list(writer.record(iter([[{"id": 1}], [{"id": 2}]])))
+    path = os.path.join(writer.path, "00000000.seg")
+    with open(path, "r+b") as handle:
+        handle.truncate(os.path.getsize(path) - 3)
+
+    reader = spool.Spool("Unit")
+    assert list(reader.replay()) == [[{"id": 1}]]
+
+
+def test_loaded_segments_are_removed():
+    with patch.dict(spool.SPOOL_CONFIG, {"SEGMENT_BYTES": 1}):
+        writer = spool.Spool("Reading")
+        writer.start()
+        list(writer.record(iter([[{"id": n}] for n in range(3)])))
+        assert writer.segments() == [0, 1, 2]
+        writer.commit()
+        writer.commit()
+        assert writer.segments() == [1, 2]
+        assert spool.spool_bytes()["Reading"] > 0
+
+        # A resumed run appends to new segments, after the ones it replays.
+        resumed = spool.Spool("Reading")
+        assert list(resumed.replay()) == [[{"id": 2}]]
+        resumed.start()
+        list(resumed.record(iter([[{"id": 3}]])))
+        assert resumed.segments() == [1, 2, 3]
@@ -0,0 +1,48 @@
+import pytest
+from datetime import datetime
+from unittest.mock import patch, MagicMock
+from fedpipeline import state
+
+
+def test_parse_timestamp_normalises_to_naive_utc():
+    assert state.parse_timestamp("2024-01-01T10:00:00+02:00") == datetime(2024, 1, 1, 8, 0, 0)
+    assert state.parse_timestamp("2024-01-01T00:00:00Z") == datetime(2024, 1, 1)
+    assert state.parse_timestamp("2024-03-01") == datetime(2024, 3, 1)
+    assert state.parse_timestamp("not a date") is None
+
+
+def test_filter_since_keeps_overlap_window():
+    watermark = (datetime(2024, 1, 10, 12, 0, 0), 5)
+    items = [
+        {"id": 1, "updated_at": "2024-01-09T00:00:00Z"},
+        {"id": 2, "updated_at": "2024-01-10T11:58:00Z"},
+        {"id": 3, "updated_at": "2024-01-11T00:00:00Z"},
+        {"id": 4},
+    ]
+    with patch.dict(state.SYNC_CONFIG, {"OVERLAP_SECONDS": 300}):
+        kept = state.filter_since(items, watermark)
+    assert [item["id"] for item in kept] == [2, 3, 4]
+    assert state.filter_since(items, None) is items
+
+
+def test_compute_watermark_never_moves_backwards():
+    current = (datetime(2024, 1, 10), 7)
+    assert state.compute_watermark([{"id": 9, "updated_at": "2024-01-09"}], current) == current
+    assert state.compute_watermark([
+        {"id": 9, "updated_at": "2024-01-11"},
+        {"id": 3, "updated_at": "2024-01-11"},
+    ], current) == (datetime(2024, 1, 11), 9)
+    assert state.compute_watermark([{"id": 1, "name": "Arts"}]) is None
+
+
+@patch("fedpipeline.state.pyodbc.connect")
+def test_reset_watermark(mock_connect):
+    conn = MagicMock()
+    conn.__enter__.return_value = conn
+    conn.cursor.return_value.rowcount = 1
+    mock_connect.return_value = conn
+
+    assert state.reset_watermark("ReadingList") is True
+    conn.cursor.return_value.execute.assert_called_once_with(
+        "DELETE FROM PipelineState WHERE entity = ?", "ReadingList"
+    )